@@ -2,8 +2,7 @@ from http.server import BaseHTTPRequestHandler
 import json
 from urllib.parse import urlparse
 
-from trialmatch.services.db import patients_collection
-from trialmatch.services.matching_orchestrator import latest_matches_for_patient
+from trialmatch.services.patient_repository import load_patient_read_model
 
 
 class handler(BaseHTTPRequestHandler):
@@ -32,21 +31,18 @@ class handler(BaseHTTPRequestHandler):
             self._send_json(400, {"error": "patient_id query parameter is required"})
             return
 
-        doc = patients_collection().find_one({"patient_id": patient_id})
-        if not doc:
+        patient = load_patient_read_model(patient_id)
+        if not patient:
             self._send_json(404, {"error": f"Patient '{patient_id}' not found"})
             return
 
-        profile = doc.get("profile") or {}
-        latest_matches = latest_matches_for_patient(patient_id)
-
         self._send_json(
             200,
             {
                 "patient_id": patient_id,
-                "created_at": doc.get("created_at"),
-                "profile": profile,
-                "latest_matches": latest_matches,
+                "created_at": patient.created_at,
+                "profile": patient.profile,
+                "latest_matches": patient.latest_match,
             },
         )
 
@@ -11,46 +11,138 @@ load_dotenv()
 
 from flask import Flask, jsonify, request, send_file
 from flask_cors import CORS
+from pymongo import UpdateOne
 from pymongo.errors import PyMongoError
 from reportlab.pdfbase.pdfmetrics import stringWidth
 
-from trialmatch.services.db import patients_collection, trials_collection
+from trialmatch.services.db import ensure_indexes, patients_collection, trials_collection
 from trialmatch.services.clinicaltrials_gov_import import (
     extract_trial_input_list,
     normalize_trial_record,
 )
-from trialmatch.services.patient_processor import build_patient_profile_from_json
-from trialmatch.services.matching_engine import get_embedding
-from trialmatch.services.prepared_trials import build_trial_cache
-from trialmatch.services.matching_orchestrator import (
-    run_matching_for_patient,
-    latest_matches_for_patient,
+from trialmatch.services.patient_processor import (
+    build_patient_profile_from_json,
+    build_patient_profiles_from_json,
 )
+from trialmatch.services.patient_repository import (
+    DEFAULT_PAGE_SIZE,
+    list_patients_page,
+    load_patient_read_model,
+)
+from trialmatch.services.embedding_codec import encode_embedding
+from trialmatch.services.matching_engine import get_embedding, get_embeddings
+from trialmatch.services.prepared_trials import (
+    embedding_version,
+    prepare_criteria_many,
+    trial_metadata_update,
+)
+from trialmatch.services.trial_repository import bump_catalog_version, current_catalog_version
+from trialmatch.services.delta_matching import run_delta_matching
+from trialmatch.services.cohort_screening import screen_trial
+from trialmatch.services.matching_orchestrator import run_matching_for_patient
+from trialmatch.services.rerank import RerankBudget
 from trialmatch.services.auth import require_auth
+from trialmatch.services.concurrency import limiter_stats
+from trialmatch.services.hedging import hedger_stats
+from trialmatch.services.write_behind import get_write_behind
 from trialmatch.config import settings
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 
 
+# Largest ``patients`` list accepted by one bulk ``/api/patients_upload`` call.
+MAX_BULK_PATIENTS = 500
+MAX_BULK_NER_CHUNKS = 5000
+
 app = Flask(__name__)
 CORS(app)
 logger = logging.getLogger(__name__)
 
+if settings.mongodb_uri and settings.mongodb_ensure_indexes:
+    try:
+        ensure_indexes()
+    except PyMongoError as exc:
+        logger.warning("startup:ensure_indexes_failed error=%s", exc)
+
 
 def _error_response(message: str, status: int):
     return jsonify({"error": {"message": message, "status": status}}), status
 
 
+def _valid_deadline(deadline_ms: Any) -> bool:
+    if deadline_ms is None:
+        return True
+    if isinstance(deadline_ms, bool) or not isinstance(deadline_ms, (int, float)):
+        return False
+    return deadline_ms > 0
+
+
 @app.errorhandler(PyMongoError)
 def handle_mongo_error(exc: PyMongoError):
     """Return a clean JSON 500 instead of a raw Python traceback for DB errors."""
     return _error_response(f"Database error: {exc}", 500)
 
 
+def _patient_document(patient_id: str, profile: Dict[str, Any], embedding: Any) -> Dict[str, Any]:
+    summary = str(profile.get("text_summary") or "").strip()
+    return {
+        "patient_id": patient_id,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "profile": profile,
+        "profile_embedding": encode_embedding(embedding if summary else []),
+        "profile_embedding_hash": (
+            hashlib.sha256(summary.encode("utf-8")).hexdigest() if summary else ""
+        ),
+        "profile_embedding_version": embedding_version() if summary else {},
+    }
+
+
+def _upload_patients(items: List[Any]):
+    """Bulk ingestion: one batched NER pass and one embedding batch for all patients."""
+    if not items or len(items) > MAX_BULK_PATIENTS:
+        return _error_response(
+            f"`patients` must hold between 1 and {MAX_BULK_PATIENTS} entries.", 400
+        )
+    entries = [
+        item for item in items if isinstance(item, dict) and isinstance(item.get("patient"), dict)
+    ]
+    try:
+        profiles = build_patient_profiles_from_json(
+            [entry["patient"] for entry in entries], max_ner_chunks=MAX_BULK_NER_CHUNKS
+        )
+    except ValueError as ve:
+        return _error_response(str(ve), 400)
+    built = [(entry, profile) for entry, profile in zip(entries, profiles) if profile]
+    summaries = [str(profile.get("text_summary") or "").strip() for _, profile in built]
+    embeddings = iter(get_embeddings([summary for summary in summaries if summary]))
+
+    stamp = int(time.time())
+    uploaded: List[Dict[str, Any]] = []
+    ops: List[UpdateOne] = []
+    for index, ((entry, profile), summary) in enumerate(zip(built, summaries)):
+        patient_id = str(
+            entry.get("patient_id") or entry["patient"].get("id") or f"patient-{stamp}-{index}"
+        )
+        doc = _patient_document(patient_id, profile, next(embeddings) if summary else None)
+        ops.append(UpdateOne({"patient_id": patient_id}, {"$set": doc}, upsert=True))
+        uploaded.append({"patient_id": patient_id, "profile": profile})
+    if not ops:
+        return _error_response("Could not build any patient profile from supplied JSON.", 400)
+    patients_collection().bulk_write(ops, ordered=False)
+    return jsonify({"patients": uploaded, "skipped": len(items) - len(uploaded)})
+
+
 @app.post("/api/patients_upload")
 @require_auth(require_admin=False)
 def upload_patient():
+    """
+    Body ``{"patient": {...}, "patient_id"?}``, or ``{"patients": [{"patient": {...},
+    "patient_id"?}, ...]}`` to ingest up to ``MAX_BULK_PATIENTS`` patients at once
+    (and at most ``MAX_BULK_NER_CHUNKS`` summary chunks for NER).
+    """
     data = request.get_json(force=True, silent=True) or {}
+    if isinstance(data.get("patients"), list):
+        return _upload_patients(data["patients"])
     patient_json = data.get("patient")
     patient_id = data.get("patient_id")
 
@@ -65,20 +157,7 @@ def upload_patient():
         return _error_response("Could not build patient profile from supplied JSON.", 400)
 
     summary = str(profile.get("text_summary") or "").strip()
-    if summary:
-        profile_embedding = get_embedding(summary).tolist()
-        profile_embedding_hash = hashlib.sha256(summary.encode("utf-8")).hexdigest()
-    else:
-        profile_embedding = []
-        profile_embedding_hash = ""
-
-    doc = {
-        "patient_id": patient_id,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "profile": profile,
-        "profile_embedding": profile_embedding,
-        "profile_embedding_hash": profile_embedding_hash,
-    }
+    doc = _patient_document(patient_id, profile, get_embedding(summary) if summary else None)
     patients_collection().update_one(
         {"patient_id": patient_id},
         {"$set": doc},
@@ -91,18 +170,23 @@ def upload_patient():
 @app.get("/api/patients_index")
 @require_auth(require_admin=False)
 def list_patients():
-    cursor = patients_collection().find().sort("created_at", -1).limit(100)
-    patients = []
-    for doc in cursor:
-        profile = doc.get("profile") or {}
-        patients.append(
-            {
-                "patient_id": doc.get("patient_id"),
-                "created_at": doc.get("created_at"),
-                "conditions": profile.get("conditions", [])[:4],
-            }
+    """
+    Patients newest first, one page at a time.
+    Query: limit (default 100, max 500), cursor (``next_cursor`` of the previous
+    page), condition (case-insensitive substring), created_from / created_to (ISO).
+    """
+    try:
+        limit = int(request.args.get("limit", DEFAULT_PAGE_SIZE))
+        page = list_patients_page(
+            limit=limit,
+            cursor=request.args.get("cursor") or None,
+            condition=request.args.get("condition") or None,
+            created_from=request.args.get("created_from") or None,
+            created_to=request.args.get("created_to") or None,
         )
-    return jsonify({"patients": patients})
+    except ValueError as exc:
+        return _error_response(str(exc) or "Invalid query parameters.", 400)
+    return jsonify(page)
 
 
 @app.get("/api/patient_detail")
@@ -112,19 +196,16 @@ def patient_detail():
     if not patient_id:
         return _error_response("patient_id query parameter is required.", 400)
 
-    doc = patients_collection().find_one({"patient_id": patient_id})
-    if not doc:
+    patient = load_patient_read_model(patient_id)
+    if not patient:
         return _error_response(f"Patient '{patient_id}' not found.", 404)
 
-    profile = doc.get("profile") or {}
-    latest = latest_matches_for_patient(patient_id)
-
     return jsonify(
         {
             "patient_id": patient_id,
-            "created_at": doc.get("created_at"),
-            "profile": profile,
-            "latest_matches": latest,
+            "created_at": patient.created_at,
+            "profile": patient.profile,
+            "latest_matches": patient.latest_match,
         }
     )
 
@@ -136,17 +217,37 @@ def trials_match():
     patient_id = data.get("patient_id")
     mode = data.get("mode", "demo")
     num_trials = data.get("num_trials")
+    top_k = data.get("top_k")
+    deadline_ms = data.get("deadline_ms")
+    rerank = data.get("rerank")
 
     if not patient_id:
         return _error_response("patient_id is required.", 400)
     if mode not in ("demo", "random"):
         return _error_response("mode must be 'demo' or 'random'.", 400)
+    if top_k is not None and (
+        isinstance(top_k, bool) or not isinstance(top_k, int) or top_k <= 0
+    ):
+        return _error_response("top_k must be a positive integer.", 400)
+    if not _valid_deadline(deadline_ms):
+        return _error_response("deadline_ms must be a positive number.", 400)
+    match_options: Dict[str, Any] = {}
+    if top_k is not None:
+        match_options["top_k"] = top_k
+    if deadline_ms is not None:
+        match_options["deadline_s"] = deadline_ms / 1000.0
+    if rerank not in (None, False):
+        try:
+            match_options["rerank"] = RerankBudget.from_request(rerank)
+        except ValueError as ve:
+            return _error_response(str(ve), 400)
 
     try:
         match_doc = run_matching_for_patient(
             patient_id=patient_id,
             mode=mode,
             num_trials=num_trials,
+            **match_options,
         )
     except ValueError as ve:
         return _error_response(str(ve), 404)
@@ -165,6 +266,10 @@ def trials_match():
             "mode": match_doc.get("mode"),
             "created_at": match_doc.get("created_at"),
             "trials": match_doc.get("trials", []),
+            "partial": bool(match_doc.get("partial")),
+            "pending_trials": match_doc.get("pending_trials", []),
+            "stale_trials": match_doc.get("stale_trials", []),
+            "rerank": match_doc.get("rerank"),
         }
     )
 
@@ -174,25 +279,55 @@ def trials_match():
 def trials_match_batch():
     """
     Run matching for multiple patients in one request.
-    Body: { "patient_ids": [...], "mode": "demo" | "random", "num_trials"?: int }
+    Body: { "patient_ids": [...], "mode": "demo" | "random", "num_trials"?: int, "top_k"?: int,
+            "deadline_ms"?: number (whole batch), "rerank"?: true | {...} (per patient) }
+    Patients still unmatched when ``deadline_ms`` runs out get an error entry.
     """
     data = request.get_json(force=True, silent=True) or {}
     patient_ids = data.get("patient_ids") or []
     mode = data.get("mode", "demo")
     num_trials = data.get("num_trials")
+    top_k = data.get("top_k")
+    deadline_ms = data.get("deadline_ms")
+    rerank = data.get("rerank")
 
     if not isinstance(patient_ids, list) or not patient_ids:
         return _error_response("patient_ids must be a non-empty list.", 400)
     if mode not in ("demo", "random"):
         return _error_response("mode must be 'demo' or 'random'.", 400)
+    if top_k is not None and (
+        isinstance(top_k, bool) or not isinstance(top_k, int) or top_k <= 0
+    ):
+        return _error_response("top_k must be a positive integer.", 400)
+    if not _valid_deadline(deadline_ms):
+        return _error_response("deadline_ms must be a positive number.", 400)
+    match_options: Dict[str, Any] = {}
+    if top_k is not None:
+        match_options["top_k"] = top_k
+    if rerank not in (None, False):
+        try:
+            match_options["rerank"] = RerankBudget.from_request(rerank)
+        except ValueError as ve:
+            return _error_response(str(ve), 400)
+    # One budget for the whole batch: each patient gets what is left of it.
+    batch_deadline = time.monotonic() + deadline_ms / 1000.0 if deadline_ms is not None else None
 
     results: List[Dict[str, Any]] = []
     for pid in patient_ids:
+        if batch_deadline is not None:
+            remaining_s = batch_deadline - time.monotonic()
+            if remaining_s <= 0:
+                results.append(
+                    {"patient_id": str(pid), "error": "deadline_ms exceeded before matching."}
+                )
+                continue
+            match_options["deadline_s"] = remaining_s
         try:
             match_doc = run_matching_for_patient(
                 patient_id=str(pid),
                 mode=mode,
                 num_trials=num_trials,
+                **match_options,
             )
             results.append(
                 {
@@ -200,6 +335,10 @@ def trials_match_batch():
                     "mode": match_doc.get("mode"),
                     "created_at": match_doc.get("created_at"),
                     "trials": match_doc.get("trials", []),
+                    "partial": bool(match_doc.get("partial")),
+                    "pending_trials": match_doc.get("pending_trials", []),
+                    "stale_trials": match_doc.get("stale_trials", []),
+                    "rerank": match_doc.get("rerank"),
                 }
             )
         except Exception as exc:  # noqa: BLE001
@@ -242,15 +381,40 @@ def trials_upload():
     coll = trials_collection()
     upserted = 0
     skipped = 0
+    docs: List[Dict[str, Any]] = []
     for item in trial_items:
         doc = normalize_trial_record(item)
         if not doc:
             skipped += 1
             continue
-        cache_payload = build_trial_cache(doc["criteria"])
+        docs.append(doc)
+
+    # Only new or changed trials get a new catalog version, so delta matching
+    # does not rescore re-uploads of identical trials.
+    existing = {
+        prev["nct_id"]: prev
+        for prev in coll.find(
+            {"nct_id": {"$in": [doc["nct_id"] for doc in docs]}},
+            {"nct_id": 1, "brief_title": 1, "criteria_hash": 1},
+        )
+    }
+    catalog_version = None
+    cache_payloads = prepare_criteria_many([doc["criteria"] for doc in docs])
+    for doc, cache_payload in zip(docs, cache_payloads):
+        prev = existing.get(doc["nct_id"])
+        metadata = trial_metadata_update(cache_payload)
+        update = {**doc, **metadata["$set"]}
+        if (
+            prev is None
+            or prev.get("criteria_hash") != cache_payload["criteria_hash"]
+            or prev.get("brief_title") != doc.get("brief_title")
+        ):
+            if catalog_version is None:
+                catalog_version = bump_catalog_version()
+            update["catalog_version"] = catalog_version
         coll.update_one(
             {"nct_id": doc["nct_id"]},
-            {"$set": {**doc, **cache_payload}},
+            {"$set": update, "$unset": metadata["$unset"]},
             upsert=True,
         )
         upserted += 1
@@ -263,7 +427,71 @@ def trials_upload():
             400,
         )
 
-    return jsonify({"upserted": upserted, "skipped": skipped})
+    return jsonify(
+        {
+            "upserted": upserted,
+            "skipped": skipped,
+            "catalog_version": catalog_version or current_catalog_version(),
+        }
+    )
+
+
+@app.get("/api/trial_cohort")
+@require_auth(require_admin=False)
+def trial_cohort():
+    """
+    Reverse matching: rank stored patients for one trial.
+    Query: nct_id (required), page (default 1), page_size (default 50, max 500), min_score.
+    """
+    nct_id = request.args.get("nct_id")
+    if not nct_id:
+        return _error_response("nct_id query parameter is required.", 400)
+    try:
+        page = int(request.args.get("page", 1))
+        page_size = int(request.args.get("page_size", 50))
+        min_score = float(request.args.get("min_score", 0))
+    except ValueError:
+        return _error_response("page, page_size and min_score must be numbers.", 400)
+    if page < 1 or not 1 <= page_size <= 500:
+        return _error_response("page must be >= 1 and page_size between 1 and 500.", 400)
+
+    try:
+        cohort = screen_trial(nct_id, page=page, page_size=page_size, min_score=min_score)
+    except ValueError as ve:
+        return _error_response(str(ve), 404)
+    return jsonify(cohort)
+
+
+@app.post("/api/trials_match_delta")
+@require_auth(require_admin=True)
+def trials_match_delta():
+    """
+    Score trials added or changed since each patient's latest demo match and merge
+    them into that match, instead of re-running the full catalog per patient.
+    """
+    try:
+        summary = run_delta_matching()
+    except Exception as exc:  # noqa: BLE001
+        logger.exception("trials_match_delta failed")
+        return _error_response(str(exc), 500)
+    return jsonify(summary)
+
+
+@app.get("/api/runtime_metrics")
+@require_auth(require_admin=True)
+def runtime_metrics():
+    """
+    In-process counters: adaptive provider concurrency limits, hedged-call
+    latencies and the write-behind queue (``null`` when write-behind is disabled).
+    """
+    buffer = get_write_behind()
+    return jsonify(
+        {
+            "provider_limits": limiter_stats(),
+            "hedging": hedger_stats(),
+            "write_behind": buffer.stats() if buffer else None,
+        }
+    )
 
 
 @app.get("/api/patient_report_pdf")
@@ -276,15 +504,15 @@ def patient_report_pdf():
     if not patient_id:
         return _error_response("patient_id query parameter is required.", 400)
 
-    doc = patients_collection().find_one({"patient_id": patient_id})
-    if not doc:
+    patient = load_patient_read_model(patient_id)
+    if not patient:
         return _error_response(f"Patient '{patient_id}' not found.", 404)
 
-    match_doc = latest_matches_for_patient(patient_id)
+    match_doc = patient.latest_match
     if not match_doc:
         return _error_response("No match results found for this patient.", 404)
 
-    profile = doc.get("profile") or {}
+    profile = patient.profile
 
     buffer = io.BytesIO()
     p = canvas.Canvas(buffer, pagesize=letter)
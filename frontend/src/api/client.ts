@@ -35,6 +35,29 @@ export interface TrialMatch {
   nct_id: string;
   title: string;
   score: number;
+  /** Set on trials judged by the rerank stage; `score` is then the blended score. */
+  semantic_score?: number;
+  llm_score?: number;
+  llm_verdict?: "eligible" | "ineligible" | "uncertain";
+  llm_reason?: string;
+}
+
+export interface RerankOptions {
+  k?: number;
+  max_tokens?: number;
+  time_budget_ms?: number;
+  policy?: "blend" | "replace" | "tiebreak";
+  weight?: number;
+}
+
+export interface RerankStats {
+  k: number;
+  policy: string;
+  cached: number;
+  judged: number;
+  skipped: number;
+  tokens_estimate: number;
+  elapsed_s: number;
 }
 
 export interface MatchDocument {
@@ -42,6 +65,11 @@ export interface MatchDocument {
   mode: string;
   created_at: string;
   trials: TrialMatch[];
+  /** True when `deadline_ms` ran out before every trial could be prepared. */
+  partial?: boolean;
+  pending_trials?: string[];
+  stale_trials?: string[];
+  rerank?: RerankStats | null;
 }
 
 export async function uploadPatient(patient: unknown, patientId?: string) {
@@ -52,9 +80,22 @@ export async function uploadPatient(patient: unknown, patientId?: string) {
   return res.data as { patient_id: string; profile: PatientProfile };
 }
 
-export async function listPatients(options?: { signal?: AbortSignal }) {
-  const res = await api.get("/api/patients_index", { signal: options?.signal });
-  return res.data as { patients: PatientSummary[] };
+export interface PatientListQuery {
+  limit?: number;
+  cursor?: string;
+  condition?: string;
+  created_from?: string;
+  created_to?: string;
+}
+
+export async function listPatients(
+  options?: { signal?: AbortSignal; query?: PatientListQuery }
+) {
+  const res = await api.get("/api/patients_index", {
+    signal: options?.signal,
+    params: options?.query,
+  });
+  return res.data as { patients: PatientSummary[]; next_cursor: string | null };
 }
 
 export async function fetchPatientDetail(patientId: string, options?: { signal?: AbortSignal }) {
@@ -69,11 +110,19 @@ export async function fetchPatientDetail(patientId: string, options?: { signal?:
   };
 }
 
-export async function runMatching(patientId: string, mode: "demo" | "random", numTrials?: number) {
+export async function runMatching(
+  patientId: string,
+  mode: "demo" | "random",
+  numTrials?: number,
+  deadlineMs?: number,
+  rerank?: boolean | RerankOptions
+) {
   const res = await api.post("/api/trials_match", {
     patient_id: patientId,
     mode,
-    num_trials: numTrials
+    num_trials: numTrials,
+    deadline_ms: deadlineMs,
+    rerank
   });
   return res.data as MatchDocument;
 }
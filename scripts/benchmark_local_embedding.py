@@ -0,0 +1,94 @@
+"""
+Local benchmark: CPU embedding throughput of the local model (not run by pytest).
+
+Compares the previous path (one forward pass per text, ``last_hidden_state``
+converted with ``.tolist()`` and mean-pooled with NumPy) against the pooled
+``_LocalEmbeddingClient.embed`` in float32 and with dynamic int8 quantization,
+printing texts per second and the cosine agreement with the previous path.
+Needs ``transformers`` and ``torch``.
+
+Run: python scripts/benchmark_local_embedding.py --texts 256 --threads 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from trialmatch.config import settings  # noqa: E402
+from trialmatch.services.llm_models import _LocalEmbeddingClient  # noqa: E402
+
+SAMPLES = [
+    "Histologically confirmed stage IV non-small cell lung cancer",
+    "ECOG performance status 0-1",
+    "Prior treatment with an anti-PD-1 or anti-PD-L1 antibody",
+    "Adequate hepatic function: total bilirubin <= 1.5 x ULN",
+    "Known active central nervous system metastases and/or carcinomatous meningitis",
+    "Type 2 diabetes mellitus on stable metformin dose for at least 3 months",
+    "Pregnant or breastfeeding women",
+    "History of myocardial infarction within 6 months prior to enrollment",
+]
+
+
+def previous_path(client: _LocalEmbeddingClient, text: str) -> np.ndarray:
+    inputs = client._tokenizer(
+        text, return_tensors="pt", truncation=True, padding=True, max_length=512
+    )
+    with client._torch.no_grad():
+        outputs = client._model(**inputs)
+    features = np.array(outputs.last_hidden_state.detach().cpu().tolist(), dtype=np.float32)
+    return features.mean(axis=1)[0]
+
+
+def cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return np.sum(a * b, axis=1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--texts", type=int, default=256)
+    parser.add_argument(
+        "--threads", type=int, default=0, help="torch intra-op threads (0 = default)"
+    )
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    texts = [f"{SAMPLES[i % len(SAMPLES)]} ({i})" for i in range(args.texts)]
+    settings.local_torch_threads = args.threads
+    settings.local_embedding_batch_size = args.batch_size
+
+    settings.local_embedding_quantize = False
+    fp32 = _LocalEmbeddingClient()
+    t0 = time.perf_counter()
+    baseline = np.stack([previous_path(fp32, text) for text in texts])
+    previous_s = time.perf_counter() - t0
+    print(f"previous path (per text, .tolist()): {len(texts) / previous_s:.1f} texts/s")
+
+    t0 = time.perf_counter()
+    pooled = fp32.embed(texts)
+    fp32_s = time.perf_counter() - t0
+    agreement = cosine(baseline, pooled)
+    print(
+        f"pooled float32 (batch {args.batch_size}): {len(texts) / fp32_s:.1f} texts/s, "
+        f"x{previous_s / fp32_s:.1f}, min cosine vs previous {agreement.min():.5f}"
+    )
+
+    settings.local_embedding_quantize = True
+    int8 = _LocalEmbeddingClient()
+    t0 = time.perf_counter()
+    quantized = int8.embed(texts)
+    int8_s = time.perf_counter() - t0
+    agreement = cosine(baseline, quantized)
+    print(
+        f"pooled int8 (batch {args.batch_size}): {len(texts) / int8_s:.1f} texts/s, "
+        f"x{previous_s / int8_s:.1f}, min cosine vs previous {agreement.min():.5f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Local benchmark: quantized vs float32 catalog scoring (not run by pytest).
+
+Builds a synthetic catalog of random criterion embeddings, scores it against random
+patients with the float32 path and with each quantized tier, checks the scores are
+identical and prints the index's resident bytes (measured with tracemalloc while
+building it), bytes read per patient (codes plus rescored float32 rows) and timings.
+
+Run: python scripts/benchmark_quantized_scoring.py --trials 20000 --criteria 12
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from trialmatch.services.matching_engine import calculate_match_score_from_precomputed  # noqa: E402
+from trialmatch.services.quantized_index import QuantizedCriteriaIndex  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trials", type=int, default=5000)
+    parser.add_argument("--criteria", type=int, default=12, help="inclusion rows per trial")
+    parser.add_argument("--exclusions", type=int, default=6, help="exclusion rows per trial")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--patients", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    # A shared component keeps cosines in the 0.5-0.9 range the thresholds care about.
+    base = rng.normal(size=args.dim).astype(np.float32)
+
+    def rows(count):
+        return (base + 0.6 * rng.normal(size=(count, args.dim))).astype(np.float32)
+
+    trials = [
+        (f"NCT{i:08d}", rows(args.criteria), rows(args.exclusions)) for i in range(args.trials)
+    ]
+    patients = [rows(1)[0] for _ in range(args.patients)]
+
+    t0 = time.perf_counter()
+    expected = [
+        {
+            nct_id: calculate_match_score_from_precomputed(
+                patient,
+                {"inclusion_embeddings": inclusion, "exclusion_embeddings": exclusion},
+            )
+            for nct_id, inclusion, exclusion in trials
+        }
+        for patient in patients
+    ]
+    scalar_s = (time.perf_counter() - t0) / len(patients)
+    print(f"float32 scalar path: {scalar_s * 1000:.1f} ms/patient")
+
+    by_id = {nct_id: (inclusion, exclusion) for nct_id, inclusion, exclusion in trials}
+
+    def row_source(nct_id):
+        return by_id[nct_id]
+
+    mib = 2**20
+    for dtype in ("int8", "float16"):
+        # Everything the index allocates and keeps, not just its codes.
+        tracemalloc.start()
+        index = QuantizedCriteriaIndex(trials, dtype=dtype)
+        resident = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        stats = {}
+        t0 = time.perf_counter()
+        scored = [index.score_trials(patient, row_source, stats=stats) for patient in patients]
+        elapsed = (time.perf_counter() - t0) / len(patients)
+        assert scored == expected, f"{dtype} scores differ from the float32 path"
+        read = index.codes_nbytes + stats["rescored"] * args.dim * 4
+        print(
+            f"{dtype:>7}: {elapsed * 1000:.1f} ms/patient | resident {resident / mib:.1f} MiB "
+            f"(nbytes {index.nbytes / mib:.1f} MiB) vs float32 {index.float32_nbytes / mib:.1f} MiB "
+            f"({index.float32_nbytes / resident:.1f}x) | read {read / mib:.1f} MiB/patient | "
+            f"rescored {stats['rescored']}/{stats['rows']} rows "
+            f"({100.0 * stats['rescored'] / max(1, stats['rows']):.2f}%) | scores identical"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
+import time
+
 import pytest
 import jwt
 from datetime import datetime, timezone, timedelta
-from unittest.mock import MagicMock, patch
+from unittest.mock import patch
 
 from app import app
 from trialmatch.config import settings
@@ -84,12 +86,10 @@ def test_batch_match_requires_admin(client):
     assert response.status_code == 403
     assert "Admin privileges required" in response.get_json()["error"]["message"]
 
-@patch("app.patients_collection")
-def test_token_in_query_params(mock_patients_collection, client):
-    """Avoid real Mongo: PDF route calls find_one; CI / local may have no server."""
-    mock_coll = MagicMock()
-    mock_coll.find_one.return_value = None
-    mock_patients_collection.return_value = mock_coll
+@patch("app.load_patient_read_model")
+def test_token_in_query_params(mock_read_model, client):
+    """Avoid real Mongo: PDF route reads the patient; CI / local may have no server."""
+    mock_read_model.return_value = None
 
     token = generate_token(role="user")
     response = client.get(f"/api/patient_report_pdf?patient_id=test&token={token}")
@@ -132,3 +132,107 @@ def test_trials_match_response_shape_demo_and_random(mock_run_matching, client):
         assert isinstance(body["trials"][0]["score"], (int, float))
 
     assert mock_run_matching.call_count == 2
+
+
+@patch("app.run_matching_for_patient")
+def test_trials_match_passes_deadline_and_reports_pending_trials(mock_run_matching, client):
+    token = generate_token(role="user")
+    mock_run_matching.return_value = {
+        "patient_id": "p123",
+        "mode": "demo",
+        "created_at": "2026-03-23T00:00:00+00:00",
+        "trials": [{"nct_id": "NCT0001", "title": "Trial A", "score": 88.5}],
+        "partial": True,
+        "pending_trials": ["NCT0002"],
+    }
+
+    response = client.post(
+        "/api/trials_match",
+        json={"patient_id": "p123", "deadline_ms": 1500},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == 200
+    assert mock_run_matching.call_args.kwargs["deadline_s"] == 1.5
+    body = response.get_json()
+    assert body["partial"] is True
+    assert body["pending_trials"] == ["NCT0002"]
+
+    response = client.post(
+        "/api/trials_match",
+        json={"patient_id": "p123", "deadline_ms": "soon"},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == 400
+
+
+@patch("app.run_matching_for_patient")
+def test_trials_match_passes_rerank_budget(mock_run_matching, client):
+    token = generate_token(role="user")
+    mock_run_matching.return_value = {
+        "patient_id": "p123",
+        "mode": "demo",
+        "created_at": "2026-03-23T00:00:00+00:00",
+        "trials": [{"nct_id": "NCT0001", "title": "Trial A", "score": 88.5}],
+        "rerank": {"k": 5, "policy": "replace", "judged": 1},
+    }
+
+    response = client.post(
+        "/api/trials_match",
+        json={"patient_id": "p123", "rerank": {"k": 5, "policy": "replace"}},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == 200
+    budget = mock_run_matching.call_args.kwargs["rerank"]
+    assert (budget.k, budget.policy) == (5, "replace")
+    assert response.get_json()["rerank"]["judged"] == 1
+
+    response = client.post(
+        "/api/trials_match",
+        json={"patient_id": "p123", "rerank": {"policy": "vote"}},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == 400
+
+
+@patch("app.run_matching_for_patient")
+def test_batch_match_deadline_bounds_the_whole_batch(mock_run_matching, client):
+    token = generate_token(role="admin")
+    budgets = []
+
+    def slow_match(patient_id, **kwargs):
+        budgets.append(kwargs["deadline_s"])
+        time.sleep(0.15)
+        return {"patient_id": patient_id, "mode": "demo", "trials": []}
+
+    mock_run_matching.side_effect = slow_match
+
+    response = client.post(
+        "/api/trials_match_batch",
+        json={"patient_ids": ["p1", "p2", "p3"], "deadline_ms": 200},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    # p2 only gets what p1 left of the budget; p3 is not started at all.
+    assert len(budgets) == 2 and budgets[1] < budgets[0] <= 0.2
+    assert "error" not in results[1]
+    assert "deadline_ms" in results[2]["error"]
+
+
+@patch("app.run_matching_for_patient")
+def test_match_routes_reject_boolean_top_k(mock_run_matching, client):
+    user, admin = generate_token(role="user"), generate_token(role="admin")
+
+    single = client.post(
+        "/api/trials_match",
+        json={"patient_id": "p123", "top_k": True},
+        headers={"Authorization": f"Bearer {user}"},
+    )
+    batch = client.post(
+        "/api/trials_match_batch",
+        json={"patient_ids": ["p1"], "top_k": True},
+        headers={"Authorization": f"Bearer {admin}"},
+    )
+    assert single.status_code == batch.status_code == 400
+    assert "top_k" in single.get_json()["error"]["message"]
+    mock_run_matching.assert_not_called()
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from trialmatch.services import cohort_screening, matching_engine
+from trialmatch.services.patient_matrix import PatientEmbeddingMatrix
+
+
+class FakeTrials:
+    def __init__(self, docs):
+        self.docs = {doc["nct_id"]: doc for doc in docs}
+
+    def find_one(self, query, projection=None):
+        return self.docs.get(query["nct_id"])
+
+
+@pytest.fixture
+def cohort(monkeypatch):
+    rng = np.random.default_rng(5)
+    base = rng.normal(size=6)
+    embeddings = (base + rng.normal(scale=0.6, size=(30, 6))).astype(np.float32)
+    trial = {
+        "nct_id": "NCT1",
+        "brief_title": "Trial one",
+        "criteria_embeddings": {
+            "inclusion": (base + rng.normal(scale=0.4, size=(3, 6))).tolist(),
+            "exclusion": rng.normal(size=(1, 6)).tolist(),
+        },
+    }
+    matrix = PatientEmbeddingMatrix(
+        patient_ids=[f"p{i}" for i in range(30)],
+        embeddings=embeddings,
+    )
+    monkeypatch.setattr(cohort_screening, "trials_collection", lambda: FakeTrials([trial]))
+    monkeypatch.setattr(cohort_screening, "ensure_trial_prepared", lambda doc: doc)
+    monkeypatch.setattr(cohort_screening, "load_patient_embedding_matrix", lambda: matrix)
+    monkeypatch.setattr(cohort_screening, "_matrix", None)
+    return trial, matrix
+
+
+def test_screen_trial_ranks_patients_like_scalar_scoring(cohort):
+    trial, matrix = cohort
+    criteria = {
+        "inclusion_embeddings": trial["criteria_embeddings"]["inclusion"],
+        "exclusion_embeddings": trial["criteria_embeddings"]["exclusion"],
+    }
+    expected = []
+    for pid, row in zip(matrix.patient_ids, matrix.embeddings):
+        score = matching_engine.calculate_match_score_from_precomputed(row, criteria)
+        if score > 0:
+            expected.append({"patient_id": pid, "score": float(round(score, 2))})
+    expected.sort(key=lambda x: x["score"], reverse=True)
+
+    result = cohort_screening.screen_trial("NCT1", page=1, page_size=100)
+
+    assert result["screened"] == 30
+    assert result["total"] == len(expected)
+    assert result["patients"] == expected
+
+
+def test_screen_trial_paginates_and_rejects_unknown_trials(cohort):
+    full = cohort_screening.screen_trial("NCT1", page=1, page_size=100)["patients"]
+
+    page_two = cohort_screening.screen_trial("NCT1", page=2, page_size=4)
+
+    assert page_two["patients"] == full[4:8]
+    with pytest.raises(ValueError):
+        cohort_screening.screen_trial("NCT404")
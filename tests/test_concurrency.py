@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+from trialmatch.services import concurrency
+
+
+class Throttled(Exception):
+    def __init__(self):
+        super().__init__("429")
+        self.response = type("R", (), {"status_code": 429})()
+
+
+def test_limit_grows_while_saturated_and_halves_on_throttle():
+    limiter = concurrency.AdaptiveLimiter("test", initial_limit=2, max_limit=8)
+    release = threading.Event()
+
+    def call():
+        with limiter.slot():
+            release.wait(timeout=5)
+
+    for _ in range(20):
+        threads = [threading.Thread(target=call) for _ in range(limiter.limit)]
+        for thread in threads:
+            thread.start()
+        while limiter.stats()["in_flight"] < len(threads):
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        release.clear()
+    grown = limiter.limit
+    assert grown > 2
+
+    with pytest.raises(Throttled):
+        with limiter.slot():
+            raise Throttled()
+    assert limiter.limit == max(1, grown // 2)
+    assert limiter.stats()["throttled"] == 1
+
+
+def test_in_flight_never_exceeds_limit():
+    limiter = concurrency.AdaptiveLimiter("test", initial_limit=3, max_limit=3)
+    peak = []
+    lock = threading.Lock()
+    active = [0]
+
+    def call():
+        with limiter.slot():
+            with lock:
+                active[0] += 1
+                peak.append(active[0])
+            time.sleep(0.005)
+            with lock:
+                active[0] -= 1
+
+    threads = [threading.Thread(target=call) for _ in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(peak) <= 3
+    assert limiter.stats()["calls"] == 12
+
+
+def test_provider_slot_is_a_no_op_when_disabled(monkeypatch):
+    monkeypatch.setattr(concurrency.settings, "adaptive_concurrency_enabled", False)
+    with concurrency.provider_slot("hf-inference"):
+        pass
+    assert "hf-inference" not in concurrency.limiter_stats()
+
+
+def test_sustained_latency_rise_cuts_the_limit(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(concurrency.time, "monotonic", lambda: clock[0])
+    limiter = concurrency.AdaptiveLimiter("test", initial_limit=8, latency_tolerance=2.0)
+
+    def call(latency):
+        with limiter.slot():
+            clock[0] += latency
+
+    for _ in range(5):
+        call(0.2)
+    assert limiter.limit == 8
+    for _ in range(10):
+        call(1.0)
+    assert limiter.limit < 8
+    assert limiter.stats()["slow"] > 0
@@ -0,0 +1,162 @@
+import os
+import shutil
+import socket
+import subprocess
+import time
+
+import pytest
+from bson import ObjectId
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure, PyMongoError
+
+from trialmatch.services import db
+from trialmatch.services.patient_repository import encode_cursor, patient_list_query
+
+
+class FakeCollection:
+    def __init__(self, name, calls, fail=False):
+        self.name = name
+        self.calls = calls
+        self.fail = fail
+
+    def create_indexes(self, indexes):
+        if self.fail:
+            raise OperationFailure("E11000 duplicate key error")
+        self.calls.append(self.name)
+        return [index.document["name"] for index in indexes]
+
+
+class FakeDb:
+    def __init__(self, failing=()):
+        self.calls = []
+        self.failing = set(failing)
+
+    def __getitem__(self, name):
+        return FakeCollection(name, self.calls, fail=name in self.failing)
+
+
+def test_ensure_indexes_applies_registry_and_skips_failing_collections():
+    fake = FakeDb(failing={"patients"})
+
+    applied = db.ensure_indexes(fake)
+
+    assert "patients" not in applied
+    assert applied["trials"] == ["nct_id_unique", "overall_status", "catalog_version"]
+    assert applied["matches"] == ["patient_id_created_at"]
+    assert sorted(fake.calls) == sorted(set(db.INDEXES) - {"patients"})
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _ping(uri, timeout_ms=500):
+    client = MongoClient(uri, serverSelectionTimeoutMS=timeout_ms)
+    try:
+        client.admin.command("ping")
+    except PyMongoError:
+        client.close()
+        return None
+    return client
+
+
+def _unavailable(reason):
+    # CI sets MONGOD_REQUIRED so a missing server fails the run instead of skipping.
+    if os.getenv("MONGOD_REQUIRED"):
+        pytest.fail(reason)
+    pytest.skip(reason)
+
+
+@pytest.fixture(scope="module")
+def mongo_client(tmp_path_factory):
+    """
+    Client for a real MongoDB: ``MONGODB_TEST_URI`` when set, otherwise a throwaway
+    ``mongod`` (``MONGOD_BIN`` or the one on PATH) on a free port and temp dbpath.
+    """
+    uri = os.getenv("MONGODB_TEST_URI")
+    if uri:
+        client = _ping(uri)
+        if client is None:
+            _unavailable(f"No MongoDB reachable at {uri}")
+        yield client
+        client.close()
+        return
+
+    mongod = os.getenv("MONGOD_BIN") or shutil.which("mongod")
+    if not mongod:
+        _unavailable("mongod not found (set MONGOD_BIN or MONGODB_TEST_URI)")
+    port = _free_port()
+    dbpath = tmp_path_factory.mktemp("mongod")
+    process = subprocess.Popen(
+        [mongod, "--port", str(port), "--bind_ip", "127.0.0.1", "--dbpath", str(dbpath),
+         "--logpath", str(dbpath / "mongod.log")],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.STDOUT,
+    )
+    try:
+        client = None
+        deadline = time.monotonic() + 30
+        while client is None and process.poll() is None and time.monotonic() < deadline:
+            client = _ping(f"mongodb://127.0.0.1:{port}")
+        if client is None:
+            _unavailable(f"mongod did not start; see {dbpath / 'mongod.log'}")
+        yield client
+        client.close()
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def _plan_stages(plan):
+    stages = [plan.get("stage")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages += _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += _plan_stages(child)
+    return stages
+
+
+def test_registered_indexes_serve_hot_queries(mongo_client):
+    client = mongo_client
+    name = f"trialmatch_index_test_{os.getpid()}"
+    test_db = client[name]
+    try:
+        db.ensure_indexes(test_db)
+        db.ensure_indexes(test_db)  # idempotent
+        test_db["patients"].insert_many(
+            [{"patient_id": f"p{i}", "created_at": f"2026-01-{i + 1:02d}"} for i in range(20)]
+        )
+        test_db["trials"].insert_many(
+            [{"nct_id": f"NCT{i}", "overall_status": "RECRUITING", "catalog_version": i}
+             for i in range(20)]
+        )
+        test_db["matches"].insert_many(
+            [{"patient_id": f"p{i % 5}", "created_at": f"2026-01-{i + 1:02d}"} for i in range(20)]
+        )
+
+        cursors = [
+            test_db["patients"].find({"patient_id": "p3"}),
+            test_db["patients"]
+            .find(patient_list_query(cursor=encode_cursor("2026-01-10", ObjectId())))
+            .sort([("created_at", -1), ("_id", -1)])
+            .limit(100),
+            test_db["trials"].find({"nct_id": "NCT3"}),
+            test_db["trials"].find({"overall_status": {"$in": ["RECRUITING"]}}),
+            test_db["trials"].find({"catalog_version": {"$gt": 10}}),
+            test_db["matches"].find({"patient_id": "p1"}).sort("created_at", -1).limit(1),
+        ]
+        for cursor in cursors:
+            stages = _plan_stages(cursor.explain()["queryPlanner"]["winningPlan"])
+            assert "COLLSCAN" not in stages
+            assert "IXSCAN" in stages or "IDHACK" in stages or "EXPRESS_IXSCAN" in stages
+
+        with pytest.raises(PyMongoError):
+            test_db["patients"].insert_one({"patient_id": "p3"})
+    finally:
+        client.drop_database(name)
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+from trialmatch.services import delta_matching
+from trialmatch.services.patient_matrix import PatientEmbeddingMatrix
+
+
+class FakeMatches:
+    def __init__(self, docs):
+        self.docs = {doc["_id"]: doc for doc in docs}
+
+    def aggregate(self, pipeline, allowDiskUse=False):
+        latest = {}
+        for doc in sorted(self.docs.values(), key=lambda d: d["created_at"], reverse=True):
+            latest.setdefault(doc["patient_id"], doc)
+        return [
+            {
+                "_id": pid,
+                "match_id": doc["_id"],
+                "mode": doc.get("mode"),
+                "top_k": doc.get("top_k"),
+                "catalog_version": doc.get("catalog_version"),
+            }
+            for pid, doc in latest.items()
+        ]
+
+    def find(self, query, projection=None):
+        return [self.docs[key] for key in query["_id"]["$in"] if key in self.docs]
+
+    def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            self.docs[op._filter["_id"]].update(op._doc["$set"])
+
+
+class FakePatients:
+    def __init__(self):
+        self.writes = []
+
+    def bulk_write(self, ops, ordered=True):
+        self.writes.extend(ops)
+
+
+def test_merge_trial_results_replaces_and_drops_updated_trials():
+    existing = [
+        {"nct_id": "NCT1", "title": "A", "score": 90.0},
+        {"nct_id": "NCT2", "title": "B", "score": 70.0},
+    ]
+
+    merged = delta_matching._merge_trial_results(
+        existing,
+        {
+            "NCT2": None,
+            "NCT3": {"nct_id": "NCT3", "title": "C", "score": 95.0},
+        },
+    )
+
+    assert [row["nct_id"] for row in merged] == ["NCT3", "NCT1"]
+
+
+def test_run_delta_matching_scores_only_trials_newer_than_each_match(monkeypatch):
+    matches = FakeMatches(
+        [
+            {"_id": "m1", "patient_id": "p1", "mode": "demo", "created_at": "2026-01-02",
+             "catalog_version": 1, "trials": [{"nct_id": "OLD", "title": "Old", "score": 60.0}]},
+            {"_id": "m2", "patient_id": "p2", "mode": "demo", "created_at": "2026-01-02",
+             "catalog_version": 2, "trials": []},
+            {"_id": "m3", "patient_id": "p3", "mode": "random", "created_at": "2026-01-02",
+             "catalog_version": 0, "trials": []},
+        ]
+    )
+    trials_df = pd.DataFrame(
+        [
+            {"nct_id": "NEW2", "brief_title": "Two", "catalog_version": 2},
+            {"nct_id": "NEW3", "brief_title": "Three", "catalog_version": 3},
+        ]
+    )
+    prepared = [
+        {
+            "nct_id": nct_id,
+            "brief_title": title,
+            "criteria_embeddings": {"inclusion": [[1.0, 0.0]], "exclusion": []},
+        }
+        for nct_id, title in (("NEW2", "Two"), ("NEW3", "Three"))
+    ]
+    seen_since = []
+
+    patients = FakePatients()
+    monkeypatch.setattr(delta_matching, "matches_collection", lambda: matches)
+    monkeypatch.setattr(delta_matching, "patients_collection", lambda: patients)
+    monkeypatch.setattr(delta_matching, "current_catalog_version", lambda: 3)
+    monkeypatch.setattr(
+        delta_matching,
+        "load_trials_changed_since",
+        lambda since: seen_since.append(since) or trials_df,
+    )
+    monkeypatch.setattr(delta_matching, "_prepare_trials", lambda df: prepared)
+    monkeypatch.setattr(
+        delta_matching,
+        "load_patient_embedding_matrix",
+        lambda ids: PatientEmbeddingMatrix(
+            patient_ids=["p1", "p2"],
+            embeddings=np.array([[1.0, 0.0], [1.0, 0.0]], dtype=np.float32),
+        ),
+    )
+
+    summary = delta_matching.run_delta_matching()
+
+    assert seen_since == [1]
+    assert summary["patients_updated"] == 2
+    assert [row["nct_id"] for row in matches.docs["m1"]["trials"]] == ["NEW2", "NEW3", "OLD"]
+    assert [row["nct_id"] for row in matches.docs["m2"]["trials"]] == ["NEW3"]
+    assert matches.docs["m1"]["catalog_version"] == 3
+    assert "updated_at" not in matches.docs["m3"]
+    assert {op._filter["latest_match._id"] for op in patients.writes} == {"m1", "m2"}
+    assert patients.writes[0]._doc["$set"]["latest_match.catalog_version"] == 3
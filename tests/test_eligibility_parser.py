@@ -1,3 +1,5 @@
+from types import SimpleNamespace
+
 from trialmatch.services import eligibility_parser
 
 
@@ -81,3 +83,38 @@ def test_falls_back_to_llm_when_sections_missing(monkeypatch):
         "inclusion": ["criterion a"],
         "exclusion": ["criterion b"],
     }
+
+
+def test_parse_many_sends_llm_criteria_in_one_batch(monkeypatch):
+    class BatchClient:
+        def __init__(self):
+            self.batches = []
+
+        def chat_completion_batch(self, conversations, max_tokens, temperature):
+            self.batches.append(conversations)
+            return [
+                SimpleNamespace(
+                    choices=[
+                        SimpleNamespace(
+                            message={"content": '{"inclusion": ["%d"], "exclusion": []}' % i}
+                        )
+                    ]
+                )
+                for i, _ in enumerate(conversations)
+            ]
+
+    client = BatchClient()
+    monkeypatch.setattr(eligibility_parser, "get_reasoning_client", lambda: client)
+
+    parsed = eligibility_parser.parse_eligibility_criteria_many(
+        ["Free text one.", "Inclusion Criteria:\n* adults\n", "Free text two."]
+    )
+
+    assert len(client.batches) == 1
+    prompts = [conversation[0]["content"] for conversation in client.batches[0]]
+    assert all(prompt.startswith(eligibility_parser.PROMPT_PREFIX) for prompt in prompts)
+    assert parsed == [
+        {"inclusion": ["0"], "exclusion": []},
+        {"inclusion": ["adults"], "exclusion": []},
+        {"inclusion": ["1"], "exclusion": []},
+    ]
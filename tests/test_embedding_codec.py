@@ -0,0 +1,87 @@
+import bson
+import numpy as np
+
+from trialmatch.services import embedding_migration
+from trialmatch.services.embedding_codec import (
+    decode_embedding,
+    decode_embedding_rows,
+    encode_embedding,
+)
+
+
+def test_encode_decode_roundtrip_is_exact_and_zero_copy():
+    rng = np.random.default_rng(3)
+    matrix = rng.normal(size=(4, 768)).astype(np.float32)
+
+    decoded = decode_embedding(encode_embedding(matrix))
+
+    assert decoded.shape == (4, 768)
+    assert np.array_equal(decoded, matrix)
+    assert not decoded.flags.owndata
+    assert decode_embedding_rows(encode_embedding(np.zeros((0, 0)))).shape == (0, 0)
+
+
+def test_legacy_lists_decode_and_binary_is_much_smaller():
+    rng = np.random.default_rng(4)
+    vector = rng.normal(size=768).astype(np.float32)
+
+    legacy = {"profile_embedding": vector.tolist()}
+    packed = {"profile_embedding": encode_embedding(vector)}
+
+    assert np.array_equal(decode_embedding(legacy["profile_embedding"]), vector)
+    assert decode_embedding_rows([vector.tolist()]).shape == (1, 768)
+    assert len(bson.encode(packed)) * 2 < len(bson.encode(legacy))
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+        self.writes = []
+
+    def find(self, query, projection=None):
+        return list(self.docs)
+
+    def bulk_write(self, ops, ordered=True):
+        self.writes.extend(ops)
+
+
+def test_migrate_embeddings_rewrites_legacy_arrays(monkeypatch):
+    vectors = FakeCollection(
+        [{"_id": "hash1", "criteria_embeddings": {"inclusion": [[1.0, 0.0]], "exclusion": []}}]
+    )
+    patients = FakeCollection([{"_id": 2, "profile_embedding": [0.5, 0.5]}])
+    monkeypatch.setattr(embedding_migration, "criteria_vectors_collection", lambda: vectors)
+    monkeypatch.setattr(embedding_migration, "patients_collection", lambda: patients)
+
+    summary = embedding_migration.migrate_embeddings_to_binary(batch_size=1)
+
+    assert summary == {"trials_migrated": 1, "patients_migrated": 1}
+    trial_update = vectors.writes[0]._doc["$set"]
+    assert decode_embedding_rows(trial_update["criteria_embeddings.inclusion"]).shape == (1, 2)
+    assert decode_embedding_rows(trial_update["criteria_embeddings.exclusion"]).shape == (0, 0)
+    patient_update = patients.writes[0]._doc["$set"]
+    assert np.array_equal(decode_embedding(patient_update["profile_embedding"]), [0.5, 0.5])
+
+
+def test_move_criteria_vectors_keeps_stored_sets_and_trials_without_a_hash(monkeypatch):
+    inline = {"inclusion": [[1.0, 0.0]], "exclusion": []}
+    trials = FakeCollection(
+        [
+            {"_id": 1, "criteria_hash": "hash1", "cache_version": {"v": "old"},
+             "criteria_embeddings": inline},
+            {"_id": 2, "criteria_hash": "hash1", "criteria_embeddings": inline},
+            {"_id": 3, "criteria_hash": "", "criteria_embeddings": inline},
+        ]
+    )
+    vectors = FakeCollection([])
+    monkeypatch.setattr(embedding_migration, "trials_collection", lambda: trials)
+    monkeypatch.setattr(embedding_migration, "criteria_vectors_collection", lambda: vectors)
+
+    summary = embedding_migration.move_criteria_vectors()
+
+    assert summary == {"trials_moved": 2, "vector_sets": 1}
+    [vector_op] = vectors.writes
+    # Only inserted when missing: a newer set written meanwhile is not overwritten.
+    assert vector_op._upsert and list(vector_op._doc) == ["$setOnInsert"]
+    assert vector_op._doc["$setOnInsert"]["cache_version"] == {"v": "old"}
+    assert [op._filter["_id"] for op in trials.writes] == [1, 2]
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from trialmatch.services import exclusion_index, matching_engine
+
+
+def _exhaustive_disqualified(patient, trials):
+    out = set()
+    for nct_id, exclusions in trials:
+        for values in exclusions:
+            criterion = matching_engine._as_embedding_array(values)
+            if matching_engine._cosine_similarity(patient, criterion) > 0.82:
+                out.add(nct_id)
+    return out
+
+
+def test_gate_matches_exhaustive_exclusion_check():
+    rng = np.random.default_rng(7)
+    patient = rng.normal(size=16).astype(np.float32)
+    trials = []
+    for i in range(40):
+        rows = rng.normal(size=(3, 16)).astype(np.float32)
+        if i % 5 == 0:
+            rows[0] = patient + 0.05 * rng.normal(size=16).astype(np.float32)
+        trials.append((f"NCT{i}", rows.tolist()))
+
+    index = exclusion_index.ExclusionGateIndex(trials, block_size=7)
+
+    expected = _exhaustive_disqualified(patient, trials)
+    assert expected
+    assert index.disqualified_trials(patient) == expected
+
+
+def test_gate_rechecks_similarities_at_the_threshold():
+    patient = np.array([1.0, 0.0], dtype=np.float32)
+    angle = np.arccos(0.82)
+    on_threshold = [float(np.cos(angle)), float(np.sin(angle))]
+    trials = [("NCT1", [on_threshold]), ("NCT2", [[1.0, 0.0]]), ("NCT3", [])]
+
+    index = exclusion_index.ExclusionGateIndex(trials)
+
+    assert index.disqualified_trials(patient) == _exhaustive_disqualified(patient, trials)
+    assert "NCT2" in index.disqualified_trials(patient)
+
+
+def _prepared(nct_id, exclusion, prepared_at="2026-01-01T00:00:00+00:00"):
+    return {
+        "nct_id": nct_id,
+        "criteria_hash": f"hash-{nct_id}",
+        "prepared_at": prepared_at,
+        "criteria_embeddings": {"inclusion": [[1.0, 0.0]], "exclusion": exclusion},
+    }
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    trials = []
+    loads = []
+
+    def load():
+        loads.append(1)
+        return list(trials)
+
+    monkeypatch.setattr(exclusion_index, "load_prepared_catalog", load)
+    monkeypatch.setattr(exclusion_index, "_cached_index", None)
+    return trials, loads
+
+
+def test_get_exclusion_gate_is_built_once_per_catalog_version(catalog):
+    trials, loads = catalog
+    trials.append(_prepared("NCT1", [[0.0, 1.0]]))
+
+    first = exclusion_index.get_exclusion_gate(3)
+    # A random-mode request sees a different trial set but the same catalog.
+    assert exclusion_index.get_exclusion_gate(3) is first
+    changed = exclusion_index.get_exclusion_gate(4)
+
+    assert changed is not first
+    assert len(loads) == 2
+
+
+def test_disqualified_by_gate_checks_only_candidate_rows(catalog):
+    trials, loads = catalog
+    trials += [_prepared("NCT1", [[1.0, 0.0]]), _prepared("NCT2", [[1.0, 0.0]]),
+               _prepared("NCT3", [[0.0, 1.0]])]
+    patient = np.array([1.0, 0.0], dtype=np.float32)
+
+    disqualified = exclusion_index.disqualified_by_gate(
+        [_prepared("NCT2", [[1.0, 0.0]]), _prepared("NCT3", [[0.0, 1.0]])], patient, 1
+    )
+
+    assert disqualified == {"NCT2"}
+    assert len(loads) == 1
+
+
+def test_disqualified_by_gate_uses_current_vectors_of_re_prepared_trials(catalog):
+    trials, loads = catalog
+    trials.append(_prepared("NCT1", [[0.0, 1.0]]))
+    patient = np.array([1.0, 0.0], dtype=np.float32)
+    exclusion_index.get_exclusion_gate(1)
+    # Same criteria, vectors rebuilt after the gate was built (e.g. new model).
+    rebuilt = _prepared("NCT1", [[1.0, 0.0]], prepared_at="2026-02-01T00:00:00+00:00")
+    # Prepared by this request: not in the catalog gate at all.
+    new = _prepared("NCT9", [[1.0, 0.0]])
+
+    disqualified = exclusion_index.disqualified_by_gate([rebuilt, new], patient, 1)
+
+    assert disqualified == {"NCT1", "NCT9"}
+    assert len(loads) == 1
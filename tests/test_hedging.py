@@ -0,0 +1,82 @@
+import time
+
+import pytest
+
+from trialmatch.services import llm_models
+from trialmatch.services.hedging import HedgedCaller
+
+
+def _backend(latency_s, value, calls, fail=False):
+    def call():
+        calls.append(value)
+        time.sleep(latency_s)
+        if fail:
+            raise RuntimeError(f"{value} down")
+        return value
+
+    return call
+
+
+def test_slow_primary_is_hedged_and_faster_backend_takes_over():
+    hedger = HedgedCaller(min_delay_s=0.01, max_delay_s=0.05)
+    calls = []
+
+    started = time.monotonic()
+    result = hedger.call(
+        {"primary": _backend(0.5, "primary", calls), "secondary": _backend(0.0, "secondary", calls)}
+    )
+
+    assert result == "secondary"
+    assert time.monotonic() - started < 0.4
+    assert hedger.stats()["hedged"] == 1
+
+    time.sleep(0.5)  # let the losing primary finish and record its latency
+    calls.clear()
+    assert hedger.call(
+        {"primary": _backend(0.5, "primary", calls), "secondary": _backend(0.0, "secondary", calls)}
+    ) == "secondary"
+    assert calls == ["secondary"]
+
+
+def test_fast_primary_is_not_hedged_and_failures_fall_through():
+    hedger = HedgedCaller(min_delay_s=0.05, max_delay_s=0.2)
+    calls = []
+
+    assert hedger.call(
+        {"primary": _backend(0.0, "primary", calls), "secondary": _backend(0.0, "secondary", calls)}
+    ) == "primary"
+    assert calls == ["primary"]
+
+    assert hedger.call(
+        {"primary": _backend(0.0, "primary", calls, fail=True), "secondary": _backend(0.0, "b", calls)}
+    ) == "b"
+    with pytest.raises(RuntimeError):
+        hedger.call({"primary": _backend(0.0, "primary", calls, fail=True)})
+
+
+def test_call_backend_without_hedging_uses_primary_only(monkeypatch):
+    monkeypatch.setattr(llm_models.settings, "hedge_enabled", False)
+
+    class Client:
+        def token_classification(self, text):
+            return [{"word": text}]
+
+    assert llm_models.call_backend("ner", Client(), lambda c: c.token_classification("x")) == [
+        {"word": "x"}
+    ]
+
+
+def test_embeddings_are_never_hedged_to_a_different_embedding_space(monkeypatch):
+    monkeypatch.setattr(llm_models.settings, "hedge_enabled", True)
+    monkeypatch.setattr(llm_models.settings, "dev_local_inference", False)
+    monkeypatch.setattr(llm_models, "_secondary_clients", {})
+    monkeypatch.setattr(llm_models, "_local_client", lambda role: f"local-{role}")
+
+    monkeypatch.setattr(llm_models.settings, "hedge_secondary_backend", "local")
+    assert llm_models.get_secondary_client("embedding") is None
+    assert llm_models.get_secondary_client("ner") == "local-ner"
+
+    # A local primary is not hedged to the hosted model either.
+    monkeypatch.setattr(llm_models.settings, "dev_local_inference", True)
+    monkeypatch.setattr(llm_models.settings, "hedge_secondary_backend", "hf-inference")
+    assert llm_models.get_secondary_client("embedding") is None
@@ -0,0 +1,73 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from trialmatch.services import http_transport
+from trialmatch.services.http_transport import httpx
+
+
+def _transport(responses, sleeps, monkeypatch, max_retries=3):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        result = responses.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(http_transport.time, "sleep", sleeps.append)
+    transport = http_transport.RetryTransport(
+        httpx.MockTransport(handler), max_retries=max_retries, backoff_base_s=0.5, backoff_max_s=20
+    )
+    return httpx.Client(transport=transport, base_url="https://router.test"), calls
+
+
+def test_retries_transient_failures_and_honors_retry_after(monkeypatch):
+    sleeps = []
+    client, calls = _transport(
+        [
+            httpx.Response(429, headers={"Retry-After": "7"}),
+            httpx.ConnectError("reset"),
+            httpx.Response(503),
+            httpx.Response(200, json=[0.1, 0.2]),
+        ],
+        sleeps,
+        monkeypatch,
+    )
+
+    response = client.post("/embed", json={"inputs": "text"})
+
+    assert response.status_code == 200
+    assert len(calls) == 4
+    assert sleeps[0] == 7.0
+    assert all(0 <= delay <= 20 for delay in sleeps)
+
+
+def test_gives_up_after_max_retries_and_passes_client_errors_through(monkeypatch):
+    sleeps = []
+    client, calls = _transport([httpx.Response(502)] * 3, sleeps, monkeypatch, max_retries=2)
+    assert client.post("/embed").status_code == 502
+    assert len(calls) == 3
+
+    client, calls = _transport([httpx.Response(400)], sleeps, monkeypatch)
+    assert client.post("/embed").status_code == 400
+    assert len(calls) == 1
+
+
+def test_parse_retry_after_accepts_seconds_and_http_dates():
+    now = datetime(2026, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+    assert http_transport.parse_retry_after("3") == 3.0
+    assert http_transport.parse_retry_after("Thu, 01 Jan 2026 12:00:30 GMT", now=now) == 30.0
+    assert http_transport.parse_retry_after("soon") is None
+    assert http_transport.parse_retry_after(None) is None
+
+
+def test_request_hook_tags_requests_and_honors_offline_mode(monkeypatch):
+    request = httpx.Request("POST", "https://router.test/embed")
+    http_transport.request_hook(request)
+    assert request.headers["X-Amzn-Trace-Id"]
+
+    monkeypatch.setattr(http_transport.constants, "HF_HUB_OFFLINE", True)
+    with pytest.raises(http_transport.OfflineModeIsEnabled):
+        http_transport.request_hook(httpx.Request("POST", "https://router.test/embed"))
@@ -1,5 +1,7 @@
+import numpy as np
+
 from trialmatch.config import settings
-from trialmatch.services import llm_models
+from trialmatch.services import llm_models, matching_engine
 
 
 def test_get_embedding_client_uses_configured_embedding_model(monkeypatch):
@@ -39,3 +41,70 @@ def test_get_reasoning_client_uses_configured_provider_and_model(monkeypatch):
     assert calls["provider"] == "auto"
     assert calls["model"] == "mistralai/Mistral-7B-Instruct-v0.2"
     assert calls["token"] == "hf_test"
+
+
+def test_json_object_closed_ignores_braces_in_strings():
+    assert not llm_models.json_object_closed('Answer: {"inclusion": ["a}"')
+    assert not llm_models.json_object_closed('{"a": {"b": 1}')
+    assert llm_models.json_object_closed('{"a": {"b": 1}} trailing')
+    assert llm_models.json_object_closed('{"a": "quoted \\" }"}')
+
+
+def test_common_prefix_length_stops_at_the_first_difference_or_shortest_row():
+    assert llm_models._common_prefix_length([[1, 2, 3, 4], [1, 2, 5], [1, 2, 3]]) == 2
+    assert llm_models._common_prefix_length([[1, 2], [1, 2, 3]]) == 2
+    assert llm_models._common_prefix_length([[7, 1], [8, 1]]) == 0
+
+
+def _reasoning_client_without_model():
+    client = object.__new__(llm_models._LocalReasoningClient)
+    client._prefix_cache = llm_models.OrderedDict()
+    client._last_prompt_ids = []
+    return client
+
+
+def test_shared_prefix_leaves_each_row_a_token_and_respects_the_minimum(monkeypatch):
+    monkeypatch.setattr(settings, "local_llm_min_prefix_tokens", 3)
+    client = _reasoning_client_without_model()
+
+    assert client._shared_prefix([[1, 2, 3, 4, 5], [1, 2, 3, 4, 6]]) == (1, 2, 3, 4)
+    assert client._shared_prefix([[1, 2, 3, 4], [1, 2, 3, 4]]) == (1, 2, 3)
+    assert client._shared_prefix([[1, 2, 3], [1, 2, 3]]) == ()
+    assert client._shared_prefix([[1, 2, 3, 4, 5]]) == ()
+    client._last_prompt_ids = [1, 2, 3, 9]
+    assert client._shared_prefix([[1, 2, 3, 4, 5]]) == (1, 2, 3)
+
+
+def test_shared_prefix_prefers_the_latest_cached_prefix_every_row_starts_with(monkeypatch):
+    monkeypatch.setattr(settings, "local_llm_min_prefix_tokens", 3)
+    client = _reasoning_client_without_model()
+    client._prefix_cache[(1, 2)] = "short"
+    client._prefix_cache[(1, 2, 3)] = "long"
+    client._prefix_cache[(1, 2, 3, 4, 5)] = "too long"
+
+    assert client._shared_prefix([[1, 2, 3, 4, 5], [1, 2, 3, 4, 6]]) == (1, 2, 3)
+    # Below the minimum, a cached prefix is still reused rather than rebuilt.
+    assert client._shared_prefix([[1, 2, 7], [1, 2, 8]]) == (1, 2)
+
+
+class PoolingClient:
+    def __init__(self):
+        self.batches = []
+
+    def feature_extraction(self, text):
+        raise AssertionError("batches should use feature_extraction_batch")
+
+    def feature_extraction_batch(self, texts):
+        self.batches.append(list(texts))
+        return np.array([[len(t), 1.0] for t in texts], dtype=np.float32)
+
+
+def test_embed_batch_uses_pooled_batch_method_of_local_backends(monkeypatch):
+    client = PoolingClient()
+    monkeypatch.setattr(matching_engine, "get_embedding_client", lambda: client)
+    monkeypatch.setattr(matching_engine.settings, "dev_local_inference", True)
+
+    rows = matching_engine.embed_batch(["ab", "abcd"])
+
+    assert client.batches == [["ab", "abcd"]]
+    assert [row.tolist() for row in rows] == [[2.0, 1.0], [4.0, 1.0]]
@@ -0,0 +1,128 @@
+from datetime import datetime, timezone
+import threading
+
+from pymongo import InsertOne
+
+from trialmatch.services import match_history
+
+
+def test_compaction_candidates_keeps_newest_runs_and_recent_days():
+    now = datetime(2026, 3, 31, tzinfo=timezone.utc)
+    runs = [
+        {"_id": "r1", "created_at": "2026-03-30T00:00:00+00:00"},
+        {"_id": "r2", "created_at": "2026-03-20T00:00:00+00:00"},
+        {"_id": "r3", "created_at": "2026-02-01T00:00:00+00:00"},
+        {"_id": "r4", "created_at": "2026-01-01T00:00:00+00:00", "compacted": True},
+        {"_id": "r5", "created_at": "2025-12-01T00:00:00+00:00"},
+    ]
+
+    assert match_history.compaction_candidates(runs, 2, 0, now=now) == ["r3", "r5"]
+    assert match_history.compaction_candidates(runs, 1, 30, now=now) == ["r3", "r5"]
+    assert match_history.compaction_candidates(runs, 0, 0, now=now) == ["r2", "r3", "r5"]
+    assert match_history.compaction_candidates(runs, 10, 0, now=now) == []
+
+
+class FakeCursor(list):
+    def sort(self, *args):
+        return self
+
+    def limit(self, n):
+        return FakeCursor(self[:n])
+
+
+class FakeCollection:
+    def __init__(self, docs=None):
+        self.docs = list(docs or [])
+        self.calls = []
+
+    def insert_one(self, doc):
+        doc.setdefault("_id", f"m{len(self.docs) + 1}")
+        self.docs.append(doc)
+
+    def update_one(self, query, update):
+        self.calls.append(("update_one", query, update))
+
+    def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            if isinstance(op, InsertOne):
+                self.insert_one(op._doc)
+            else:
+                self.update_one(op._filter, op._doc)
+
+    def find_one(self, query, projection=None):
+        return next((doc for doc in self.docs if doc.get("patient_id") == query["patient_id"]), None)
+
+    def find(self, query, projection=None):
+        return FakeCursor(
+            sorted(
+                (doc for doc in self.docs if doc.get("patient_id") == query["patient_id"]),
+                key=lambda doc: doc["created_at"],
+                reverse=True,
+            )
+        )
+
+
+def test_record_match_sets_pointer_and_compacts(monkeypatch):
+    matches = FakeCollection()
+    patients = FakeCollection()
+    compacted = []
+    monkeypatch.setattr(match_history, "matches_collection", lambda: matches)
+    monkeypatch.setattr(match_history, "patients_collection", lambda: patients)
+    monkeypatch.setattr(match_history, "compact_match_history", compacted.append)
+    monkeypatch.setattr(match_history.settings, "match_history_compaction", True)
+
+    doc = {"patient_id": "p1", "created_at": "2026-01-02", "trials": []}
+    match_history.record_match(doc)
+    # Write-behind is off: compaction runs on the background worker, not inline.
+    match_history._get_executor().submit(lambda: None).result(timeout=5)
+
+    _, query, update = patients.calls[0]
+    assert query["patient_id"] == "p1"
+    assert update["$set"]["latest_match"]["_id"] == matches.docs[0]["_id"] == doc["_id"]
+    assert compacted == ["p1"]
+
+
+def test_record_match_does_not_compact_inline(monkeypatch):
+    matches = FakeCollection()
+    patients = FakeCollection()
+    release = threading.Event()
+    compacted = []
+
+    def slow_compaction(patient_id):
+        release.wait(timeout=5)
+        compacted.append(patient_id)
+
+    monkeypatch.setattr(match_history, "matches_collection", lambda: matches)
+    monkeypatch.setattr(match_history, "patients_collection", lambda: patients)
+    monkeypatch.setattr(match_history, "compact_match_history", slow_compaction)
+    monkeypatch.setattr(match_history.settings, "match_history_compaction", True)
+
+    for day in ("2026-01-02", "2026-01-03", "2026-01-04"):
+        match_history.record_match({"patient_id": "p1", "created_at": day, "trials": []})
+
+    assert len(matches.docs) == 3 and compacted == []
+    release.set()
+    match_history._get_executor().submit(lambda: None).result(timeout=5)
+    # Runs recorded while a compaction was queued share it.
+    assert compacted in (["p1"], ["p1", "p1"])
+
+
+def test_latest_match_prefers_pointer_and_falls_back_to_history(monkeypatch):
+    patients = FakeCollection(
+        [
+            {"patient_id": "p1", "latest_match": {"_id": "m9", "trials": [{"nct_id": "NCT1"}]}},
+            {"patient_id": "p2"},
+        ]
+    )
+    matches = FakeCollection(
+        [
+            {"_id": "m1", "patient_id": "p2", "created_at": "2026-01-01"},
+            {"_id": "m2", "patient_id": "p2", "created_at": "2026-01-03"},
+        ]
+    )
+    monkeypatch.setattr(match_history, "matches_collection", lambda: matches)
+    monkeypatch.setattr(match_history, "patients_collection", lambda: patients)
+
+    assert match_history.latest_match_for_patient("p1")["_id"] == "m9"
+    assert match_history.latest_match_for_patient("p2")["_id"] == "m2"
+    assert match_history.latest_match_for_patient("p3") is None
@@ -61,3 +61,21 @@ def test_calculate_match_score_from_precomputed_penalizes_without_zeroing():
 
   assert 70.0 <= score < 100.0
 
+
+def test_calculate_match_scores_for_patients_matches_scalar_scoring():
+    rng = matching_engine.np.random.default_rng(3)
+    base = rng.normal(size=8)
+    patients = (base + rng.normal(scale=0.7, size=(50, 8))).astype(matching_engine.np.float32)
+    trial_criteria = {
+        "inclusion_embeddings": (base + rng.normal(scale=0.5, size=(4, 8))).tolist(),
+        "exclusion_embeddings": (base + rng.normal(scale=0.9, size=(2, 8))).tolist(),
+    }
+
+    scores = matching_engine.calculate_match_scores_for_patients(patients, trial_criteria)
+
+    expected = [
+        matching_engine.calculate_match_score_from_precomputed(row, trial_criteria)
+        for row in patients
+    ]
+    assert scores.tolist() == expected
+    assert len(set(expected)) > 2
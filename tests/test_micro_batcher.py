@@ -0,0 +1,102 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from trialmatch.services import matching_engine
+from trialmatch.services.micro_batcher import MicroBatcher
+
+
+def test_concurrent_submissions_share_batches_and_get_their_own_rows():
+    calls = []
+
+    def batch_fn(items):
+        calls.append(list(items))
+        return [item * 10 for item in items]
+
+    batcher = MicroBatcher(batch_fn, max_batch=8, max_wait_s=0.05)
+    results = {}
+    start = threading.Barrier(16)
+
+    def worker(n):
+        start.wait()
+        results[n] = batcher.submit(n).result(timeout=5)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {n: n * 10 for n in range(16)}
+    assert len(calls) < 16
+    assert max(len(batch) for batch in calls) <= 8
+    assert batcher.stats()["items"] == 16
+
+
+def test_failed_batch_is_retried_per_item():
+    def batch_fn(items):
+        if "bad" in items:
+            raise ValueError("bad input")
+        return [item.upper() for item in items]
+
+    batcher = MicroBatcher(batch_fn, max_batch=4, max_wait_s=0.05)
+    futures = batcher.submit_many(["a", "bad", "c"])
+
+    assert futures[0].result(timeout=5) == "A"
+    assert futures[2].result(timeout=5) == "C"
+    with pytest.raises(ValueError):
+        futures[1].result(timeout=5)
+
+
+def test_batches_run_concurrently_up_to_max_concurrency():
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def batch_fn(items):
+        with lock:
+            active.append(1)
+            peak.append(len(active))
+        time.sleep(0.1)
+        with lock:
+            active.pop()
+        return items
+
+    batcher = MicroBatcher(batch_fn, max_batch=32, max_wait_s=0.0, max_concurrency=4)
+    started = time.monotonic()
+    futures = []
+    for _ in range(8):
+        futures += batcher.submit_many(list(range(32)))
+        time.sleep(0.005)
+    for future in futures:
+        future.result(timeout=5)
+
+    assert max(peak) == 4
+    assert batcher.stats()["max_in_flight"] <= 4
+    assert time.monotonic() - started < 0.6
+
+
+class BatchingClient:
+    def __init__(self):
+        self.inputs = []
+
+    def feature_extraction(self, text):
+        self.inputs.append(text)
+        if isinstance(text, list):
+            return [[[len(t), 0.0], [len(t), 2.0]] for t in text]
+        return np.array([[len(text), 0.0], [len(text), 2.0]], dtype=np.float32)
+
+
+def test_embed_batch_sends_one_call_and_matches_single_text_pooling(monkeypatch):
+    client = BatchingClient()
+    monkeypatch.setattr(matching_engine, "get_embedding_client", lambda: client)
+    monkeypatch.setattr(matching_engine.settings, "dev_local_inference", False)
+
+    rows = matching_engine.embed_batch(["ab", "abcd"])
+    single = matching_engine.embed_batch(["ab"])
+
+    assert client.inputs == [["ab", "abcd"], "ab"]
+    assert [row.tolist() for row in rows] == [[2.0, 1.0], [4.0, 1.0]]
+    assert single[0].tolist() == rows[0].tolist()
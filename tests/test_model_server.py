@@ -0,0 +1,175 @@
+import os
+import socket
+import tempfile
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from trialmatch.services import llm_models
+from trialmatch.services.model_server import (
+    ModelServer,
+    ModelServerClient,
+    recv_message,
+    send_message,
+)
+
+
+class FakeReasoning:
+    def chat_completion(self, messages, max_tokens=512, temperature=0.1):
+        text = f"{messages[-1]['content']}:{max_tokens}"
+        return SimpleNamespace(choices=[SimpleNamespace(message={"content": text})])
+
+
+class FakeEmbedding:
+    def feature_extraction(self, text):
+        return np.full((2, 3), len(text), dtype=np.float32)
+
+
+class FakeNer:
+    def __init__(self):
+        self.batches = []
+
+    def token_classification_batch(self, texts):
+        self.batches.append(list(texts))
+        return [[{"word": text, "score": np.float32(0.5)}] for text in texts]
+
+
+@pytest.fixture
+def server():
+    ner = FakeNer()
+    socket_path = os.path.join(tempfile.mkdtemp(), "models.sock")
+    model_server = ModelServer(
+        socket_path,
+        loaders={"reasoning": FakeReasoning, "embedding": FakeEmbedding, "ner": lambda: ner},
+        max_wait_s=0.05,
+    )
+    model_server.bind()
+    thread = threading.Thread(target=model_server.serve_forever, daemon=True)
+    thread.start()
+    yield model_server, ner
+    model_server.shutdown()
+    thread.join(timeout=5)
+
+
+def test_client_matches_the_local_client_interfaces(server):
+    model_server, _ = server
+    client = ModelServerClient(model_server.socket_path, timeout_s=5)
+
+    response = client.chat_completion([{"role": "user", "content": "hi"}], max_tokens=7)
+    assert response.choices[0].message["content"] == "hi:7"
+    assert np.array(client.feature_extraction("abcd")).shape == (2, 3)
+    assert client.token_classification("tumor") == [{"word": "tumor", "score": 0.5}]
+    assert model_server.stats()["loaded"] == ["embedding", "ner", "reasoning"]
+
+
+def test_concurrent_workers_share_batched_model_calls(server):
+    model_server, ner = server
+    client = ModelServerClient(model_server.socket_path, timeout_s=5)
+    results = {}
+    start = threading.Barrier(8)
+
+    def worker(n):
+        start.wait()
+        results[n] = client.token_classification(f"text {n}")
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {n: [{"word": f"text {n}", "score": 0.5}] for n in range(8)}
+    assert len(ner.batches) < 8
+
+
+def test_model_errors_are_raised_in_the_client(server):
+    model_server, _ = server
+    client = ModelServerClient(model_server.socket_path, timeout_s=5)
+
+    with pytest.raises(RuntimeError, match="feature_extraction failed"):
+        client._call("feature_extraction", text="x", unexpected=1)
+    # The connection survives an error reply.
+    assert np.array(client.feature_extraction("ab")).shape == (2, 3)
+
+
+def test_client_does_not_resend_a_request_the_server_received():
+    socket_path = os.path.join(tempfile.mkdtemp(), "models.sock")
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    listener.listen()
+    received = []
+
+    def serve():
+        # The first request is read and dropped without a reply; the second is answered.
+        for _ in range(2):
+            conn, _ = listener.accept()
+            with conn:
+                request = recv_message(conn)
+                received.append(request["op"])
+                if len(received) > 1:
+                    send_message(conn, {"ok": True, "result": [1.0]})
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    client = ModelServerClient(socket_path, timeout_s=5)
+
+    with pytest.raises(ConnectionError):
+        client.feature_extraction("x")
+    assert received == ["feature_extraction"]
+    # The next call opens a fresh connection.
+    assert client.feature_extraction("x") == [1.0]
+    thread.join(timeout=5)
+    listener.close()
+
+
+def test_single_and_batch_calls_to_one_model_run_on_one_thread():
+    threads = set()
+
+    class ThreadRecordingEmbedding:
+        def feature_extraction(self, text):
+            threads.add(threading.get_ident())
+            return [float(len(text))]
+
+        def feature_extraction_batch(self, texts):
+            threads.add(threading.get_ident())
+            return [[float(len(text))] for text in texts]
+
+    socket_path = os.path.join(tempfile.mkdtemp(), "models.sock")
+    model_server = ModelServer(
+        socket_path, loaders={"embedding": ThreadRecordingEmbedding}, max_wait_s=0.05
+    )
+    start = threading.Barrier(8)
+    results = {}
+
+    def worker(n):
+        start.wait()
+        if n % 2:
+            results[n] = model_server.handle({"op": "feature_extraction", "args": {"text": "x" * n}})
+        else:
+            results[n] = model_server.handle(
+                {"op": "feature_extraction_batch", "args": {"texts": ["x" * n, "y"]}}
+            )
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    assert len(threads) == 1
+    assert results[3] == {"ok": True, "result": [3.0]}
+    assert results[4] == {"ok": True, "result": [[4.0], [1.0]]}
+    assert list(model_server.stats()["batchers"]) == ["embedding", "ner", "reasoning"]
+
+
+def test_local_inference_uses_the_model_server_when_configured(monkeypatch):
+    monkeypatch.setattr(llm_models.settings, "dev_local_inference", True)
+    monkeypatch.setattr(llm_models.settings, "model_server_socket", "/tmp/models.sock")
+    monkeypatch.setattr(llm_models, "_local_embedding_client", None)
+
+    client = llm_models.get_embedding_client()
+
+    assert isinstance(client, ModelServerClient)
+    assert client.socket_path == "/tmp/models.sock"
@@ -1,3 +1,7 @@
+import threading
+
+import pytest
+
 from trialmatch.services import patient_processor
 
 
@@ -42,3 +46,95 @@ def test_build_patient_profile_includes_demographics_and_condition_status(monkey
     assert "resolved condition Childhood asthma (disorder)" in profile["text_summary"]
     assert "active medication albuterol 0.83 MG/ML Inhalation Solution" in profile["text_summary"]
 
+
+
+def test_sentence_chunks_pack_sentences_and_wrap_run_ons():
+    text = "First sentence here. Second one. " + " ".join(["word"] * 30) + "."
+
+    chunks = patient_processor.sentence_chunks(text, max_chars=40)
+
+    assert chunks[0] == "First sentence here. Second one."
+    assert all(len(chunk) <= 40 for chunk in chunks)
+    assert " ".join(chunks) == text
+
+
+def test_bulk_profiles_share_one_batched_ner_call(monkeypatch):
+    class BatchNerClient:
+        def __init__(self):
+            self.batches = []
+
+        def token_classification_batch(self, texts):
+            self.batches.append(list(texts))
+            return [
+                [{"word": word.strip(".,")} for word in text.split() if word.istitle()]
+                for text in texts
+            ]
+
+    client = BatchNerClient()
+    monkeypatch.setattr(patient_processor, "get_ner_client", lambda: client)
+    monkeypatch.setattr(patient_processor.settings, "ner_chunk_max_chars", 60)
+
+    def patient(condition):
+        return {
+            "entry": [
+                {
+                    "resource": {
+                        "resourceType": "Condition",
+                        "code": {"text": condition},
+                        "clinicalStatus": {"coding": [{"code": "active"}]},
+                    }
+                }
+            ]
+        }
+
+    profiles = patient_processor.build_patient_profiles_from_json(
+        [patient("Asthma"), {"id": "no entries"}, patient("Hypertension")]
+    )
+
+    assert len(client.batches) == 1
+    assert len(client.batches[0]) > 2  # several chunks per summary
+    assert profiles[1] == {}
+    assert "Asthma" in profiles[0]["ner_entities"]
+    assert "Hypertension" not in profiles[0]["ner_entities"]
+    assert profiles[0]["ner_entities"].count("Patient") == 1
+    assert "Hypertension" in profiles[2]["ner_entities"]
+
+
+def test_hosted_ner_classifies_chunks_concurrently_in_order(monkeypatch):
+    state = {"in_flight": 0, "max_in_flight": 0}
+    lock = threading.Lock()
+    both_running = threading.Barrier(2, timeout=5)
+
+    class HostedNerClient:
+        def token_classification(self, text):
+            with lock:
+                state["in_flight"] += 1
+                state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+            both_running.wait()
+            with lock:
+                state["in_flight"] -= 1
+            return [{"word": text.split()[0]}]
+
+    monkeypatch.setattr(patient_processor, "get_ner_client", lambda: HostedNerClient())
+    monkeypatch.setattr(patient_processor.settings, "hedge_enabled", False)
+    monkeypatch.setattr(patient_processor.settings, "ner_max_workers", 2)
+    monkeypatch.setattr(patient_processor, "_ner_executor", None)
+
+    entities = patient_processor.extract_entities(["Alpha one.", "Beta two."])
+
+    assert entities == [["Alpha"], ["Beta"]]
+    assert state["max_in_flight"] == 2
+
+
+def test_extract_entities_rejects_too_many_chunks_before_calling_ner(monkeypatch):
+    class FailingNerClient:
+        def token_classification(self, _text):
+            raise AssertionError("NER must not run")
+
+    monkeypatch.setattr(patient_processor, "get_ner_client", lambda: FailingNerClient())
+    monkeypatch.setattr(patient_processor.settings, "ner_chunk_max_chars", 25)
+
+    with pytest.raises(ValueError, match="3 NER chunks"):
+        patient_processor.extract_entities(
+            ["First sentence here. Second sentence here.", "Third one here."], max_chunks=2
+        )
@@ -1,11 +1,12 @@
 from datetime import datetime, timedelta, timezone
-from unittest.mock import MagicMock, patch
+from unittest.mock import patch
 
 import jwt
 import pytest
 
 from app import app
 from trialmatch.config import settings
+from trialmatch.services.patient_repository import PatientReadModel
 
 
 @pytest.fixture
@@ -26,9 +27,8 @@ def _token() -> str:
     return jwt.encode(payload, "dummy_secret_for_testing", algorithm="HS256")
 
 
-@patch("app.latest_matches_for_patient")
-@patch("app.patients_collection")
-def test_patient_report_pdf_handles_long_profile_content(mock_patients_collection, mock_latest, client):
+@patch("app.load_patient_read_model")
+def test_patient_report_pdf_handles_long_profile_content(mock_read_model, client):
     long_conditions = [
         "Seasonal allergic rhinitis (disorder)",
         "Medication review due (situation)",
@@ -39,25 +39,23 @@ def test_patient_report_pdf_handles_long_profile_content(mock_patients_collectio
     ] * 18
     summary = " ".join([f"Patient has a condition of item {i}." for i in range(40)])
 
-    coll = MagicMock()
-    coll.find_one.return_value = {
-        "patient_id": "p1",
-        "profile": {
+    mock_read_model.return_value = PatientReadModel(
+        patient_id="p1",
+        profile={
             "conditions": long_conditions,
             "medications": long_meds,
             "text_summary": summary,
         },
-    }
-    mock_patients_collection.return_value = coll
-    mock_latest.return_value = {
-        "patient_id": "p1",
-        "mode": "random",
-        "created_at": "2026-01-01T00:00:00+00:00",
-        "trials": [
-            {"nct_id": "NCT1", "title": "Very long title " * 10, "score": 88.4},
-            {"nct_id": "NCT2", "title": "Another long title " * 8, "score": 75.2},
-        ],
-    }
+        latest_match={
+            "patient_id": "p1",
+            "mode": "random",
+            "created_at": "2026-01-01T00:00:00+00:00",
+            "trials": [
+                {"nct_id": "NCT1", "title": "Very long title " * 10, "score": 88.4},
+                {"nct_id": "NCT2", "title": "Another long title " * 8, "score": 75.2},
+            ],
+        },
+    )
 
     response = client.get(f"/api/patient_report_pdf?patient_id=p1&token={_token()}")
     assert response.status_code == 200
@@ -0,0 +1,159 @@
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from trialmatch.services import matching_orchestrator, patient_repository
+
+
+class FakeCursor:
+    def __init__(self, docs, log):
+        self.docs = docs
+        self.log = log
+
+    def sort(self, keys):
+        self.log["sort"] = keys
+        self.docs = sorted(self.docs, key=lambda d: (d["created_at"], d["_id"]), reverse=True)
+        return self
+
+    def limit(self, n):
+        self.log["limit"] = n
+        return iter(self.docs[:n])
+
+
+class FakePatients:
+    def __init__(self, docs):
+        self.docs = docs
+        self.log = {}
+
+    def find(self, query, projection):
+        self.log["query"] = query
+        self.log["projection"] = projection
+        after = None
+        if query:
+            clauses = query.get("$and", [query])
+            after = next((c["$or"][1] for c in clauses if "$or" in c), None)
+        docs = [
+            doc
+            for doc in self.docs
+            if after is None
+            or (doc["created_at"], doc["_id"]) < (after["created_at"], after["_id"]["$lt"])
+        ]
+        return FakeCursor(docs, self.log)
+
+
+def test_list_patients_page_walks_keyset_pages(monkeypatch):
+    ids = [ObjectId() for _ in range(5)]
+    docs = [
+        {"_id": ids[i], "patient_id": f"p{i}", "created_at": "2026-01-01" if i < 3 else "2026-01-02",
+         "profile": {"conditions": ["A", "B"]}}
+        for i in range(5)
+    ]
+    patients = FakePatients(docs)
+    monkeypatch.setattr(patient_repository, "patients_collection", lambda: patients)
+
+    seen = []
+    cursor = None
+    while True:
+        page = patient_repository.list_patients_page(limit=2, cursor=cursor)
+        seen += [row["patient_id"] for row in page["patients"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen == ["p4", "p3", "p2", "p1", "p0"]
+    assert patients.log["projection"]["profile.conditions"] == {"$slice": 4}
+    assert patients.log["sort"] == [("created_at", -1), ("_id", -1)]
+    assert patients.log["limit"] == 3
+
+
+def test_patient_list_query_filters_and_rejects_bad_input():
+    query = patient_repository.patient_list_query(
+        condition="diabetes (type 2)",
+        created_from="2026-01-01",
+        created_to="2026-02-01",
+    )
+
+    assert query["$and"][0] == {"created_at": {"$gte": "2026-01-01", "$lt": "2026-02-01"}}
+    assert query["$and"][1]["profile.conditions"]["$regex"] == r"diabetes\ \(type\ 2\)"
+    with pytest.raises(ValueError):
+        patient_repository.patient_list_query(cursor="not-a-cursor")
+    with pytest.raises(ValueError):
+        patient_repository.patient_list_query(created_from="yesterday")
+
+
+class FakeReadPatients:
+    def __init__(self, docs):
+        self.docs = docs
+        self.projections = []
+
+    def find_one(self, query, projection):
+        self.projections.append(projection)
+        doc = next((d for d in self.docs if d["patient_id"] == query["patient_id"]), None)
+        return {k: v for k, v in doc.items() if k in projection} if doc else None
+
+
+def test_load_patient_read_model_reads_once_and_falls_back_to_history(monkeypatch):
+    patients = FakeReadPatients(
+        [
+            {"patient_id": "p1", "profile": {"age": 40}, "latest_match": {"_id": ObjectId()},
+             "profile_embedding": [1.0, 0.0], "profile_embedding_hash": "h1",
+             "profile_embedding_version": {"embedding_model": "m1"}},
+            {"patient_id": "p2", "profile": {}},
+        ]
+    )
+    history = []
+    monkeypatch.setattr(patient_repository, "patients_collection", lambda: patients)
+    monkeypatch.setattr(
+        patient_repository, "newest_match_run",
+        lambda pid: history.append(pid) or {"_id": "m2", "patient_id": pid},
+    )
+
+    p1 = patient_repository.load_patient_read_model("p1")
+    assert p1.profile == {"age": 40}
+    assert isinstance(p1.latest_match["_id"], str)
+    assert p1.embedding.size == 0
+    assert "profile_embedding" not in patients.projections[-1]
+
+    p2 = patient_repository.load_patient_read_model("p2")
+    assert p2.latest_match["_id"] == "m2"
+    assert history == ["p2"]
+
+    matched = patient_repository.load_patient_read_model(
+        "p1", with_embedding=True, with_latest_match=False
+    )
+    assert matched.embedding_hash == "h1"
+    assert matched.embedding_version == {"embedding_model": "m1"}
+    assert matched.embedding.tolist() == [1.0, 0.0]
+    assert matched.latest_match is None
+    assert patient_repository.load_patient_read_model("p9") is None
+
+
+def test_stored_embedding_is_reused_only_for_the_same_summary_and_model(monkeypatch):
+    profile = {"text_summary": "stage II breast cancer"}
+    summary_hash = matching_orchestrator._patient_summary_hash(profile)
+    stored = np.array([1.0, 0.0], dtype=np.float32)
+    writes = []
+    monkeypatch.setattr(matching_orchestrator, "get_embedding", lambda text: np.ones(2))
+    monkeypatch.setattr(matching_orchestrator, "persist", lambda getter, ops: writes.extend(ops))
+    monkeypatch.setattr(
+        matching_orchestrator, "embedding_version", lambda: {"embedding_model": "m2"}
+    )
+
+    def patient(embedding_hash, version):
+        return patient_repository.PatientReadModel(
+            patient_id="p1",
+            profile=profile,
+            embedding_hash=embedding_hash,
+            embedding_version=version,
+            embedding=stored,
+        )
+
+    current = patient(summary_hash, {"embedding_model": "m2"})
+    assert matching_orchestrator._get_patient_embedding(current) is stored
+    assert not writes
+
+    for outdated in (patient(summary_hash, {"embedding_model": "m1"}), patient("old", {})):
+        assert matching_orchestrator._get_patient_embedding(outdated).tolist() == [1.0, 1.0]
+    update = writes[-1]._doc["$set"]
+    assert update["profile_embedding_hash"] == summary_hash
+    assert update["profile_embedding_version"] == {"embedding_model": "m2"}
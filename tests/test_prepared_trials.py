@@ -1,4 +1,7 @@
+import threading
+
 import numpy as np
+from pymongo import ReplaceOne
 
 from trialmatch.services import prepared_trials
 
@@ -14,8 +17,8 @@ def test_build_trial_cache_deduplicates_and_embeds(monkeypatch):
     )
     monkeypatch.setattr(
         prepared_trials,
-        "get_embedding",
-        lambda text: np.array([float(len(text)), 1.0], dtype=np.float32),
+        "get_embeddings",
+        lambda texts: [np.array([float(len(text)), 1.0], dtype=np.float32) for text in texts],
     )
 
     cache = prepared_trials.build_trial_cache("criteria text")
@@ -24,8 +27,9 @@ def test_build_trial_cache_deduplicates_and_embeds(monkeypatch):
         "inclusion": ["Age 18+", "Diabetes"],
         "exclusion": ["Pregnant"],
     }
-    assert len(cache["criteria_embeddings"]["inclusion"]) == 2
-    assert len(cache["criteria_embeddings"]["exclusion"]) == 1
+    matrices = prepared_trials.criteria_embedding_matrices(cache)
+    assert matrices["inclusion"].shape == (2, 2)
+    assert matrices["exclusion"].shape == (1, 2)
     assert cache["criteria_hash"]
     assert cache["prepared_at"]
 
@@ -48,6 +52,19 @@ def test_is_trial_cache_fresh_detects_matching_hash_and_version(monkeypatch):
     assert prepared_trials.is_trial_cache_fresh(trial_doc) is True
 
 
+def test_local_inference_version_distinguishes_int8_embeddings(monkeypatch):
+    monkeypatch.setattr(prepared_trials.settings, "dev_local_inference", False)
+    monkeypatch.setattr(prepared_trials.settings, "local_embedding_quantize", True)
+    assert prepared_trials._local_inference_version() == "false"
+
+    monkeypatch.setattr(prepared_trials.settings, "dev_local_inference", True)
+    assert prepared_trials._local_inference_version() == "int8"
+    assert prepared_trials._cache_version()["local_inference"] == "int8"
+
+    monkeypatch.setattr(prepared_trials.settings, "local_embedding_quantize", False)
+    assert prepared_trials._local_inference_version() == "true"
+
+
 def test_ensure_trial_prepared_reuses_fresh_cache(monkeypatch):
     trial_doc = {
         "nct_id": "NCT1",
@@ -64,3 +81,437 @@ def test_ensure_trial_prepared_reuses_fresh_cache(monkeypatch):
     monkeypatch.setattr(prepared_trials, "build_trial_cache", fail_build)
 
     assert prepared_trials.ensure_trial_prepared(trial_doc) == trial_doc
+
+
+class FakeCollection:
+    def __init__(self, docs=None, key="_id"):
+        self.docs = {doc[key]: dict(doc) for doc in docs or []}
+        self.key = key
+        self.updates = []
+
+    def find(self, query, projection=None):
+        wanted = query[self.key]["$in"]
+        docs = [self.docs[key] for key in wanted if key in self.docs]
+        if "criteria_embeddings" in query:
+            docs = [doc for doc in docs if "criteria_embeddings" in doc]
+        return docs
+
+    def replace_one(self, query, doc, upsert=False):
+        self.docs[query["_id"]] = dict(doc)
+
+    def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            if isinstance(op, ReplaceOne):
+                self.replace_one(op._filter, op._doc, upsert=True)
+            else:
+                self.update_one(op._filter, op._doc)
+
+    def update_one(self, query, update):
+        self.updates.append((query, update))
+        doc = self.docs.get(query[self.key])
+        if doc is not None:
+            doc.update(update.get("$set", {}))
+            for field in update.get("$unset", {}):
+                doc.pop(field, None)
+
+
+def _fake_store(monkeypatch, vectors=None, trials=None):
+    vectors_coll = FakeCollection(vectors)
+    trials_coll = FakeCollection(trials, key="nct_id")
+    monkeypatch.setattr(prepared_trials, "criteria_vectors_collection", lambda: vectors_coll)
+    monkeypatch.setattr(prepared_trials, "trials_collection", lambda: trials_coll)
+    return vectors_coll, trials_coll
+
+
+def test_ensure_trials_prepared_shares_vectors_for_identical_criteria(monkeypatch):
+    vectors, trials = _fake_store(monkeypatch)
+    builds = []
+
+    def fake_build(text):
+        builds.append(text)
+        return {
+            "criteria_hash": prepared_trials._criteria_hash(text),
+            "cache_version": prepared_trials._cache_version(),
+            "parsed_criteria": {"inclusion": ["A"], "exclusion": []},
+            "criteria_embeddings": {"inclusion": [[1.0, 0.0]], "exclusion": []},
+            "prepared_at": "now",
+        }
+
+    monkeypatch.setattr(prepared_trials, "build_trial_cache", fake_build)
+
+    docs = [
+        {"nct_id": "NCT1", "criteria": "same text"},
+        {"nct_id": "NCT2", "criteria": "same text"},
+    ]
+    prepared = prepared_trials.ensure_trials_prepared(docs)
+
+    assert builds == ["same text"]
+    assert list(vectors.docs) == [prepared_trials._criteria_hash("same text")]
+    for doc in prepared:
+        assert prepared_trials.criteria_embedding_matrices(doc)["inclusion"].shape == (1, 2)
+    # Trial documents get metadata only; vectors are never written to them.
+    for _, update in trials.updates:
+        assert "criteria_embeddings" not in update["$set"]
+        assert update["$unset"] == {"criteria_embeddings": ""}
+
+
+def test_ensure_trials_prepared_reuses_stored_vectors_and_adopts_inline_ones(monkeypatch):
+    fresh = {
+        "criteria_hash": prepared_trials._criteria_hash("stored"),
+        "cache_version": prepared_trials._cache_version(),
+        "parsed_criteria": {"inclusion": ["A"], "exclusion": []},
+    }
+    legacy = {
+        "nct_id": "NCT2",
+        "criteria": "legacy",
+        "criteria_hash": prepared_trials._criteria_hash("legacy"),
+        "cache_version": prepared_trials._cache_version(),
+        "parsed_criteria": {"inclusion": ["B"], "exclusion": []},
+    }
+    vectors, trials = _fake_store(
+        monkeypatch,
+        vectors=[{"_id": fresh["criteria_hash"], "cache_version": fresh["cache_version"],
+                  "parsed_criteria": fresh["parsed_criteria"],
+                  "criteria_embeddings": {"inclusion": [[1.0]], "exclusion": []}}],
+        trials=[{**legacy, "criteria_embeddings": {"inclusion": [[2.0]], "exclusion": []}}],
+    )
+
+    def fail_build(_text):
+        raise AssertionError("stored or inline vectors should be reused")
+
+    monkeypatch.setattr(prepared_trials, "build_trial_cache", fail_build)
+
+    prepared = prepared_trials.ensure_trials_prepared(
+        [{"nct_id": "NCT1", "criteria": "stored", **fresh}, legacy]
+    )
+
+    firsts = [prepared_trials.criteria_embedding_matrices(doc)["inclusion"][0, 0] for doc in prepared]
+    assert firsts == [1.0, 2.0]
+    assert legacy["criteria_hash"] in vectors.docs
+    assert "criteria_embeddings" not in trials.docs["NCT2"]
+
+
+def test_vector_sets_are_stored_inline_before_inline_vectors_are_removed(monkeypatch):
+    legacy = {
+        "nct_id": "NCT2",
+        "criteria": "legacy",
+        "criteria_hash": prepared_trials._criteria_hash("legacy"),
+        "cache_version": prepared_trials._cache_version(),
+        "parsed_criteria": {"inclusion": ["B"], "exclusion": []},
+    }
+    vectors, trials = _fake_store(
+        monkeypatch,
+        trials=[{**legacy, "criteria_embeddings": {"inclusion": [[2.0]], "exclusion": []}}],
+    )
+    # Write-behind that never flushes: queued writes must not be relied on.
+    queued = []
+    monkeypatch.setattr(
+        prepared_trials, "persist", lambda getter, ops, then=None: queued.append(ops)
+    )
+    vectors_when_unset = []
+    update_one = trials.update_one
+
+    def record_update(query, update):
+        vectors_when_unset.append(legacy["criteria_hash"] in vectors.docs)
+        update_one(query, update)
+
+    trials.update_one = record_update
+
+    prepared_trials.ensure_trials_prepared([legacy])
+
+    assert vectors_when_unset == [True]
+    assert "criteria_embeddings" not in trials.docs["NCT2"]
+
+
+def test_ensure_trials_prepared_skips_builds_after_the_deadline(monkeypatch):
+    stored_hash = prepared_trials._criteria_hash("stored")
+    vectors, _ = _fake_store(
+        monkeypatch,
+        vectors=[{"_id": stored_hash, "cache_version": prepared_trials._cache_version(),
+                  "parsed_criteria": {"inclusion": ["A"], "exclusion": []},
+                  "criteria_embeddings": {"inclusion": [[1.0]], "exclusion": []}}],
+    )
+
+    def fail_build(_text):
+        raise AssertionError("no budget left to build vectors")
+
+    monkeypatch.setattr(prepared_trials, "build_trial_cache", fail_build)
+
+    skipped = []
+    prepared = prepared_trials.ensure_trials_prepared(
+        [{"nct_id": "NCT9", "criteria": "needs a parse"}, {"nct_id": "NCT1", "criteria": "stored"}],
+        deadline=prepared_trials.time.monotonic() - 1,
+        skipped=skipped,
+    )
+
+    assert skipped == ["NCT9"]
+    assert "criteria_embeddings" not in prepared[0]
+    assert prepared_trials.criteria_embedding_matrices(prepared[1])["inclusion"].shape == (1, 1)
+
+
+def test_ensure_trials_prepared_stops_waiting_for_running_builds_at_the_deadline(monkeypatch):
+    vectors, _ = _fake_store(monkeypatch)
+    release = threading.Event()
+
+    def slow_build(text):
+        release.wait(timeout=5)
+        return {
+            "criteria_hash": prepared_trials._criteria_hash(text),
+            "cache_version": prepared_trials._cache_version(),
+            "parsed_criteria": {"inclusion": ["A"], "exclusion": []},
+            "criteria_embeddings": {"inclusion": [[1.0]], "exclusion": []},
+            "prepared_at": "now",
+        }
+
+    monkeypatch.setattr(prepared_trials, "build_trial_cache", slow_build)
+    docs = [{"nct_id": "NCT1", "criteria": "slow parse"}]
+
+    # The first request starts the build; a second one joins it as a follower.
+    started = prepared_trials.time.monotonic()
+    skipped_first, skipped_second = [], []
+    prepared_trials.ensure_trials_prepared(
+        docs, deadline=prepared_trials.time.monotonic() + 0.1, skipped=skipped_first
+    )
+    prepared_trials.ensure_trials_prepared(
+        docs, deadline=prepared_trials.time.monotonic() + 0.1, skipped=skipped_second
+    )
+
+    assert prepared_trials.time.monotonic() - started < 1.0
+    assert skipped_first == skipped_second == ["NCT1"]
+    # The build keeps running and stores its vectors for the next request.
+    assert not vectors.docs
+    release.set()
+    deadline = prepared_trials.time.monotonic() + 5
+    while not vectors.docs and prepared_trials.time.monotonic() < deadline:
+        prepared_trials.time.sleep(0.01)
+    assert list(vectors.docs) == [prepared_trials._criteria_hash("slow parse")]
+
+
+def test_ensure_trials_prepared_skips_failed_builds(monkeypatch):
+    _fake_store(monkeypatch)
+
+    def build(text):
+        if text == "broken":
+            raise RuntimeError("parser unavailable")
+        return {
+            "criteria_hash": prepared_trials._criteria_hash(text),
+            "cache_version": prepared_trials._cache_version(),
+            "parsed_criteria": {"inclusion": ["A"], "exclusion": []},
+            "criteria_embeddings": {"inclusion": [[1.0]], "exclusion": []},
+            "prepared_at": "now",
+        }
+
+    monkeypatch.setattr(prepared_trials, "build_trial_cache", build)
+
+    skipped = []
+    prepared = prepared_trials.ensure_trials_prepared(
+        [{"nct_id": "NCT1", "criteria": "broken"}, {"nct_id": "NCT2", "criteria": "fine"}],
+        deadline=prepared_trials.time.monotonic() + 5,
+        skipped=skipped,
+    )
+
+    assert skipped == ["NCT1"]
+    assert "criteria_embeddings" not in prepared[0]
+    assert prepared_trials.criteria_embedding_matrices(prepared[1])["inclusion"].shape == (1, 1)
+
+
+def test_ensure_trials_prepared_serves_stale_vectors_until_refreshed(monkeypatch):
+    text_hash = prepared_trials._criteria_hash("criteria text")
+    old_version = {**prepared_trials._cache_version(), "reasoning_model": "old-model"}
+    vectors, trials = _fake_store(
+        monkeypatch,
+        vectors=[{"_id": text_hash, "cache_version": old_version,
+                  "parsed_criteria": {"inclusion": ["A"], "exclusion": []},
+                  "criteria_embeddings": {"inclusion": [[1.0]], "exclusion": []},
+                  "prepared_at": "before"}],
+        trials=[{"nct_id": "NCT1", "criteria": "criteria text"}],
+    )
+    queued = []
+    monkeypatch.setattr(prepared_trials, "queue_trial_preparation", queued.extend)
+    builds = []
+
+    def fake_build(text):
+        builds.append(text)
+        return {
+            "criteria_hash": prepared_trials._criteria_hash(text),
+            "cache_version": prepared_trials._cache_version(),
+            "parsed_criteria": {"inclusion": ["B"], "exclusion": []},
+            "criteria_embeddings": {"inclusion": [[2.0]], "exclusion": []},
+            "prepared_at": "after",
+        }
+
+    monkeypatch.setattr(prepared_trials, "build_trial_cache", fake_build)
+    trial = {"nct_id": "NCT1", "criteria": "criteria text"}
+
+    [served] = prepared_trials.ensure_trials_prepared([trial], allow_stale=True)
+    assert served["stale"] is True
+    assert served["parsed_criteria"]["inclusion"] == ["A"]
+    assert builds == [] and trials.updates == []
+    assert queued == ["NCT1"]
+
+    # The background refresh rebuilds and swaps the vector set in.
+    [refreshed] = prepared_trials.ensure_trials_prepared([trial], allow_stale=False)
+    assert builds == ["criteria text"]
+    assert "stale" not in refreshed
+    assert vectors.docs[text_hash]["cache_version"] == prepared_trials._cache_version()
+    assert vectors.docs[text_hash]["parsed_criteria"]["inclusion"] == ["B"]
+
+
+def test_ensure_trials_prepared_rebuilds_when_the_embedding_model_changed(monkeypatch):
+    text_hash = prepared_trials._criteria_hash("criteria text")
+    old_version = {**prepared_trials._cache_version(), "embedding_model": "old-embedder"}
+    _fake_store(
+        monkeypatch,
+        vectors=[{"_id": text_hash, "cache_version": old_version,
+                  "parsed_criteria": {"inclusion": ["A"], "exclusion": []},
+                  "criteria_embeddings": {"inclusion": [[1.0]], "exclusion": []}}],
+    )
+    builds = []
+
+    def fake_build(text):
+        builds.append(text)
+        return {
+            "criteria_hash": prepared_trials._criteria_hash(text),
+            "cache_version": prepared_trials._cache_version(),
+            "parsed_criteria": {"inclusion": ["B"], "exclusion": []},
+            "criteria_embeddings": {"inclusion": [[2.0]], "exclusion": []},
+            "prepared_at": "after",
+        }
+
+    monkeypatch.setattr(prepared_trials, "build_trial_cache", fake_build)
+
+    [prepared] = prepared_trials.ensure_trials_prepared(
+        [{"nct_id": "NCT1", "criteria": "criteria text"}], allow_stale=True
+    )
+
+    assert builds == ["criteria text"]
+    assert "stale" not in prepared
+
+
+def test_prepare_catalog_builds_outdated_trials_in_batches(monkeypatch):
+    fresh_hash = prepared_trials._criteria_hash("fresh")
+    _, trials = _fake_store(
+        monkeypatch,
+        vectors=[{"_id": fresh_hash, "cache_version": prepared_trials._cache_version(),
+                  "parsed_criteria": {"inclusion": ["A"], "exclusion": []},
+                  "criteria_embeddings": {"inclusion": [[1.0]], "exclusion": []}}],
+        trials=[
+            {"nct_id": "NCT1", "criteria": "fresh", "criteria_hash": fresh_hash,
+             "cache_version": prepared_trials._cache_version()},
+            {"nct_id": "NCT2", "criteria": "new one"},
+            {"nct_id": "NCT3", "criteria": "new two"},
+            {"nct_id": "NCT4", "criteria": ""},
+        ],
+    )
+    scans = []
+
+    def find(query, projection=None):
+        if query:
+            return FakeCollection.find(trials, query, projection)
+        scans.append(1)
+        return list(trials.docs.values())
+
+    trials.find = find
+    batches = []
+
+    def fake_build_many(texts):
+        batches.append(list(texts))
+        return [
+            {
+                "criteria_hash": prepared_trials._criteria_hash(text),
+                "cache_version": prepared_trials._cache_version(),
+                "parsed_criteria": {"inclusion": [text], "exclusion": []},
+                "criteria_embeddings": {"inclusion": [[2.0]], "exclusion": []},
+                "prepared_at": "now",
+            }
+            for text in texts
+        ]
+
+    monkeypatch.setattr(prepared_trials, "build_trial_caches", fake_build_many)
+
+    summary = prepared_trials.prepare_catalog(batch_size=10)
+
+    assert summary == {"trials": 4, "prepared": 2}
+    assert scans == [1]
+    assert batches == [["new one", "new two"]]
+    assert trials.docs["NCT2"]["parsed_criteria"]["inclusion"] == ["new one"]
+    assert trials.docs["NCT3"]["criteria_hash"] == prepared_trials._criteria_hash("new two")
+
+
+def test_prepare_criteria_many_joins_builds_already_in_flight(monkeypatch):
+    vectors, _ = _fake_store(monkeypatch)
+    entered = threading.Event()
+    release = threading.Event()
+    single_builds = []
+    batch_builds = []
+
+    def payload(text):
+        return {
+            "criteria_hash": prepared_trials._criteria_hash(text),
+            "cache_version": prepared_trials._cache_version(),
+            "parsed_criteria": {"inclusion": [text], "exclusion": []},
+            "criteria_embeddings": {"inclusion": [[1.0]], "exclusion": []},
+            "prepared_at": "now",
+        }
+
+    def slow_build(text):
+        single_builds.append(text)
+        entered.set()
+        release.wait(timeout=5)
+        return payload(text)
+
+    def build_many(texts):
+        batch_builds.append(list(texts))
+        return [payload(text) for text in texts]
+
+    monkeypatch.setattr(prepared_trials, "build_trial_cache", slow_build)
+    monkeypatch.setattr(prepared_trials, "build_trial_caches", build_many)
+
+    running = prepared_trials.prepare_criteria_async("shared")
+    assert entered.wait(timeout=5)
+    result = []
+    batch = threading.Thread(
+        target=lambda: result.extend(
+            prepared_trials.prepare_criteria_many(["shared", "one", "two", "one"])
+        )
+    )
+    batch.start()
+    while not batch_builds:
+        prepared_trials.time.sleep(0.01)
+    release.set()
+    batch.join(timeout=5)
+
+    assert running.result(timeout=5)["parsed_criteria"]["inclusion"] == ["shared"]
+    assert single_builds == ["shared"]
+    assert batch_builds == [["one", "two"]]
+    assert [payload["parsed_criteria"]["inclusion"] for payload in result] == [
+        ["shared"], ["one"], ["two"], ["one"]
+    ]
+    assert len(vectors.docs) == 3
+
+
+def test_load_prepared_catalog_returns_trials_with_fresh_vector_sets(monkeypatch):
+    version = prepared_trials._cache_version()
+    fresh_hash = prepared_trials._criteria_hash("fresh")
+    old_hash = prepared_trials._criteria_hash("old")
+    vectors, trials = _fake_store(
+        monkeypatch,
+        vectors=[
+            {"_id": fresh_hash, "cache_version": version, "prepared_at": "t1",
+             "parsed_criteria": {}, "criteria_embeddings": {"inclusion": [[1.0]]}},
+            {"_id": old_hash, "cache_version": {**version, "embedding_model": "previous"},
+             "parsed_criteria": {}, "criteria_embeddings": {"inclusion": [[2.0]]}},
+        ],
+        trials=[
+            {"nct_id": "NCT1", "criteria": "fresh"},
+            {"nct_id": "NCT2", "criteria": "old"},
+            {"nct_id": "NCT3", "criteria": "never prepared"},
+            {"nct_id": "NCT4", "criteria": ""},
+        ],
+    )
+    trials.find = lambda query, projection=None: list(trials.docs.values())
+
+    catalog = prepared_trials.load_prepared_catalog(batch_size=2)
+
+    assert [trial["nct_id"] for trial in catalog] == ["NCT1"]
+    assert prepared_trials.vectors_signature(catalog[0]) == (fresh_hash, "t1")
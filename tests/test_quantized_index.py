@@ -0,0 +1,179 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from trialmatch.services import matching_engine, quantized_index
+from trialmatch.services.quantized_index import QuantizedCriteriaIndex
+
+
+def _criterion_at(rng, patient, cosine):
+    unit = patient / np.linalg.norm(patient)
+    noise = rng.normal(size=patient.shape)
+    noise -= noise.dot(unit) * unit
+    noise /= np.linalg.norm(noise)
+    return (cosine * unit + np.sqrt(1 - cosine**2) * noise).astype(np.float32)
+
+
+@pytest.mark.parametrize("dtype", ["int8", "float16"])
+def test_quantized_scores_match_float32_path_near_thresholds(dtype):
+    rng = np.random.default_rng(11)
+    patient = rng.normal(size=64).astype(np.float32)
+    # Cosines clustered around every cut-off, where quantization error matters most.
+    targets = [0.6, 0.68, 0.82]
+    trials = []
+    for i in range(60):
+        inclusion = np.vstack(
+            [
+                _criterion_at(rng, patient, rng.choice(targets) + rng.uniform(-0.01, 0.01))
+                for _ in range(rng.integers(0, 5))
+            ]
+            or [np.zeros((0, 64), dtype=np.float32)]
+        )
+        exclusion = np.vstack(
+            [
+                _criterion_at(rng, patient, 0.82 + rng.uniform(-0.01, 0.01))
+                for _ in range(rng.integers(0, 2))
+            ]
+            or [np.zeros((0, 64), dtype=np.float32)]
+        )
+        trials.append((f"NCT{i}", inclusion, exclusion))
+
+    fetched = []
+    by_id = {nct_id: (inclusion, exclusion) for nct_id, inclusion, exclusion in trials}
+
+    def row_source(nct_id):
+        fetched.append(nct_id)
+        return by_id[nct_id]
+
+    stats = {}
+    scores = QuantizedCriteriaIndex(trials, dtype=dtype).score_trials(
+        patient, row_source, stats=stats
+    )
+
+    for nct_id, inclusion, exclusion in trials:
+        expected = matching_engine.calculate_match_score_from_precomputed(
+            patient,
+            {"inclusion_embeddings": inclusion, "exclusion_embeddings": exclusion},
+        )
+        assert scores[nct_id] == expected
+    assert 0 < stats["rescored"] <= stats["rows"]
+    # Float32 rows are fetched only for trials with a row to rescore, once each.
+    assert len(fetched) == len(set(fetched)) <= stats["rescored"]
+
+
+def test_quantized_index_is_smaller_than_float32():
+    rng = np.random.default_rng(5)
+    trials = [
+        (f"NCT{i}", rng.normal(size=(4, 768)).astype(np.float32), np.zeros((0, 768), np.float32))
+        for i in range(10)
+    ]
+
+    int8_index = QuantizedCriteriaIndex(trials, dtype="int8")
+    float16_index = QuantizedCriteriaIndex(trials, dtype="float16")
+
+    assert int8_index.nbytes * 3 < int8_index.float32_nbytes
+    assert float16_index.nbytes * 1.9 < float16_index.float32_nbytes
+    with pytest.raises(ValueError):
+        QuantizedCriteriaIndex(trials, dtype="int4")
+
+
+def test_index_keeps_no_float32_rows_resident():
+    rng = np.random.default_rng(3)
+    trials = [
+        (
+            f"NCT{i}",
+            rng.normal(size=(6, 256)).astype(np.float32),
+            rng.normal(size=(2, 256)).astype(np.float32),
+        )
+        for i in range(50)
+    ]
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    index = QuantizedCriteriaIndex(trials, dtype="int8")
+    resident = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    assert resident < index.float32_nbytes / 2
+    assert resident <= index.nbytes * 1.5
+
+
+def test_score_trials_reads_only_the_selected_trials():
+    rng = np.random.default_rng(9)
+    patient = rng.normal(size=32).astype(np.float32)
+    trials = [
+        (f"NCT{i}", rng.normal(size=(3, 32)).astype(np.float32), np.zeros((0, 32), np.float32))
+        for i in range(20)
+    ]
+    index = QuantizedCriteriaIndex(trials, dtype="int8")
+    by_id = {nct_id: (inclusion, exclusion) for nct_id, inclusion, exclusion in trials}
+    full = index.score_trials(patient, by_id.__getitem__)
+
+    stats = {}
+    scores = index.score_trials(
+        patient, by_id.__getitem__, stats=stats, nct_ids=["NCT4", "NCT11", "NCT99"]
+    )
+
+    assert scores == {"NCT4": full["NCT4"], "NCT11": full["NCT11"]}
+    assert stats["rows"] == 6
+
+
+def _prepared(nct_id, inclusion, prepared_at="2026-01-01T00:00:00+00:00"):
+    return {
+        "nct_id": nct_id,
+        "criteria_hash": f"hash-{nct_id}",
+        "prepared_at": prepared_at,
+        "criteria_embeddings": {"inclusion": inclusion, "exclusion": []},
+    }
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    trials = []
+    loads = []
+
+    def load():
+        loads.append(1)
+        return list(trials)
+
+    monkeypatch.setattr(quantized_index, "load_prepared_catalog", load)
+    monkeypatch.setattr(quantized_index, "_cached_index", None)
+    return trials, loads
+
+
+def test_get_quantized_index_is_built_once_per_catalog_version(catalog):
+    trials, loads = catalog
+    trials.append(_prepared("NCT1", [[1.0, 0.0]]))
+
+    first = quantized_index.get_quantized_index(3, "int8")
+    # A random-mode request sees a different trial set but the same catalog.
+    assert quantized_index.get_quantized_index(3, "int8") is first
+    assert quantized_index.get_quantized_index(3, "float16") is not first
+    assert quantized_index.get_quantized_index(4, "float16") is not first
+    assert len(loads) == 3
+
+
+def test_quantized_scores_match_float32_for_held_and_new_trials(catalog):
+    trials, loads = catalog
+    trials += [_prepared("NCT1", [[1.0, 0.0]]), _prepared("NCT2", [[0.0, 1.0]])]
+    patient = np.array([1.0, 0.0], dtype=np.float32)
+    # NCT2 was re-prepared after the index was built; NCT9 is not in the catalog.
+    candidates = [
+        _prepared("NCT1", [[1.0, 0.0]]),
+        _prepared("NCT2", [[1.0, 0.0]], prepared_at="2026-02-01T00:00:00+00:00"),
+        _prepared("NCT9", [[0.0, 1.0]]),
+    ]
+
+    scores = quantized_index.quantized_scores(candidates, patient, 1, "int8")
+
+    for trial in candidates:
+        expected = matching_engine.calculate_match_score_from_precomputed(
+            patient,
+            {
+                "inclusion_embeddings": trial["criteria_embeddings"]["inclusion"],
+                "exclusion_embeddings": [],
+            },
+        )
+        assert scores[trial["nct_id"]] == expected
+    assert len(loads) == 1
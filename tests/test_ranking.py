@@ -0,0 +1,65 @@
+import numpy as np
+
+from trialmatch.services import matching_engine, ranking
+
+
+def _exhaustive(patient, trials):
+    results = []
+    for trial in trials:
+        score = matching_engine.calculate_match_score_from_precomputed(patient, trial)
+        if score <= 0:
+            continue
+        results.append({"nct_id": trial["nct_id"], "title": trial["title"], "score": float(round(score, 2))})
+    results.sort(key=lambda x: x["score"], reverse=True)
+    return results
+
+
+def _random_trials(rng, patient, count):
+    trials = []
+    for i in range(count):
+        rows = []
+        for _ in range(int(rng.integers(1, 6))):
+            # Mix near-duplicates of the patient with noise to spread scores over bands.
+            noise = rng.normal(scale=float(rng.choice([0.3, 0.8, 2.0])), size=patient.shape)
+            rows.append((patient + noise).astype(np.float32).tolist())
+        exclusions = [rng.normal(size=patient.shape).tolist()] if i % 7 == 0 else []
+        trials.append(
+            {
+                "nct_id": f"NCT{i:04d}",
+                "title": f"Trial {i}",
+                "inclusion_embeddings": rows,
+                "exclusion_embeddings": exclusions,
+            }
+        )
+    return trials
+
+
+def test_rank_trials_top_k_matches_exhaustive_ranking():
+    rng = np.random.default_rng(11)
+    patient = rng.normal(size=12).astype(np.float32)
+    trials = _random_trials(rng, patient, 120)
+
+    expected = _exhaustive(patient, trials)
+
+    assert ranking.rank_trials(patient, trials) == expected
+    for top_k in (1, 5, 15, 200):
+        assert ranking.rank_trials(patient, trials, top_k=top_k) == expected[:top_k]
+
+
+def test_prune_at_returns_bound_without_finishing_evaluation():
+    patient = np.array([1.0, 0.0], dtype=np.float32)
+    criteria = {
+        "inclusion_embeddings": [[0.0, 1.0], [0.0, 1.0], [1.0, 0.0]],
+        "exclusion_embeddings": [],
+    }
+
+    exact = matching_engine.calculate_match_score_from_precomputed(patient, criteria)
+    bound = matching_engine.calculate_match_score_from_precomputed(
+        patient, criteria, prune_at=85.0
+    )
+
+    assert exact == 70.0
+    assert bound == 85.0
+    assert matching_engine.calculate_match_score_from_precomputed(
+        patient, criteria, prune_at=60.0
+    ) == exact
@@ -0,0 +1,176 @@
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from trialmatch.services import rerank
+from trialmatch.services.score_cache import PairCache
+
+
+class FakeReasoningClient:
+    def __init__(self, scores):
+        self.scores = scores
+        self.prompts = []
+
+    def chat_completion(self, messages, max_tokens=512, temperature=0.1):
+        prompt = messages[0]["content"]
+        self.prompts.append(prompt)
+        nct_id = next(nct_id for nct_id in self.scores if f"Trial {nct_id}" in prompt)
+        content = json.dumps(
+            {"verdict": "eligible", "score": self.scores[nct_id], "reason": f"fits {nct_id}"}
+        )
+        return SimpleNamespace(choices=[SimpleNamespace(message={"content": content})])
+
+
+def _trial(nct_id):
+    return {
+        "nct_id": nct_id,
+        "brief_title": f"Trial {nct_id}",
+        "criteria_hash": f"hash-{nct_id}",
+        "cache_version": {"reasoning_model": "m"},
+        "parsed_criteria": {"inclusion": ["Adults with diabetes"], "exclusion": ["Pregnancy"]},
+    }
+
+
+@pytest.fixture
+def rerank_env(monkeypatch):
+    monkeypatch.setattr(rerank.settings, "score_cache_enabled", True)
+    monkeypatch.setattr(
+        rerank,
+        "_verdict_cache",
+        PairCache(lambda: None, max_memory_entries=100, max_persisted_entries=0),
+    )
+
+    def install(scores):
+        client = FakeReasoningClient(scores)
+        monkeypatch.setattr(rerank, "get_reasoning_client", lambda: client)
+        return client
+
+    return install
+
+
+def test_budget_from_request_applies_defaults_and_validates():
+    budget = rerank.RerankBudget.from_request({"k": 3, "time_budget_ms": 500, "policy": "replace"})
+
+    assert budget.k == 3
+    assert budget.time_budget_s == 0.5
+    assert budget.policy == "replace"
+    assert budget.max_tokens == rerank.settings.rerank_max_tokens
+    assert rerank.RerankBudget.from_request(True).k == rerank.settings.rerank_k
+    for invalid in ("yes", {"k": 0}, {"k": True}, {"policy": "vote"}, {"weight": 2}):
+        with pytest.raises(ValueError):
+            rerank.RerankBudget.from_request(invalid)
+
+
+def test_parse_verdict_clamps_score_and_rejects_garbage():
+    verdict = rerank.parse_verdict('Sure: {"verdict": "Eligible", "score": 140, "reason": "ok"}')
+
+    assert verdict == {"verdict": "eligible", "score": 100.0, "reason": "ok"}
+    assert rerank.parse_verdict("no json here") is None
+    assert rerank.parse_verdict('{"verdict": "eligible"}') is None
+
+
+def test_rerank_blends_shortlist_and_merges_by_final_score(rerank_env):
+    client = rerank_env({"NCT1": 10.0, "NCT2": 90.0, "NCT3": 100.0})
+    results = [
+        {"nct_id": "NCT1", "title": "A", "score": 80.0},
+        {"nct_id": "NCT2", "title": "B", "score": 70.0},
+        {"nct_id": "NCT3", "title": "C", "score": 60.0},
+    ]
+    trials = {nct_id: _trial(nct_id) for nct_id in ("NCT1", "NCT2", "NCT3")}
+    budget = rerank.RerankBudget(k=2, max_tokens=100000, time_budget_s=5.0)
+    stats = {}
+
+    reranked = rerank.rerank_shortlist(results, trials, "Adult with diabetes.", "p", budget, stats)
+
+    # NCT1 is marked down below the unjudged NCT3.
+    assert [row["nct_id"] for row in reranked] == ["NCT2", "NCT3", "NCT1"]
+    assert [row["score"] for row in reranked] == [80.0, 60.0, 45.0]
+    assert reranked[0]["semantic_score"] == 70.0
+    assert reranked[0]["llm_verdict"] == "eligible"
+    assert "llm_score" not in reranked[1]
+    assert len(client.prompts) == 2
+    assert stats["judged"] == 2 and stats["cached"] == 0
+
+    reranked_again = rerank.rerank_shortlist(results, trials, "Adult with diabetes.", "p", budget, stats)
+
+    assert reranked_again == reranked
+    assert len(client.prompts) == 2
+    assert stats["cached"] == 2 and stats["judged"] == 0
+
+
+def test_rerank_token_budget_limits_judged_trials(rerank_env):
+    client = rerank_env({"NCT1": 0.0, "NCT2": 100.0})
+    results = [
+        {"nct_id": "NCT1", "title": "A", "score": 50.0},
+        {"nct_id": "NCT2", "title": "B", "score": 50.0},
+    ]
+    trials = {nct_id: _trial(nct_id) for nct_id in ("NCT1", "NCT2")}
+    one_prompt = rerank.estimate_tokens(rerank.build_prompt("Adult.", trials["NCT1"]))
+    budget = rerank.RerankBudget(
+        k=2, max_tokens=one_prompt, time_budget_s=5.0, policy="tiebreak"
+    )
+    stats = {}
+
+    reranked = rerank.rerank_shortlist(results, trials, "Adult.", "p", budget, stats)
+
+    assert len(client.prompts) == 1
+    assert stats["skipped"] == 1
+    # Tiebreak keeps the semantic score; the judged trial wins the tie.
+    assert [row["score"] for row in reranked] == [50.0, 50.0]
+    assert reranked[0]["nct_id"] == "NCT1"
+    assert reranked[0]["llm_score"] == 0.0
+
+
+def test_rerank_without_time_left_uses_cached_verdicts_and_calls_no_model(rerank_env):
+    client = rerank_env({"NCT1": 10.0, "NCT2": 100.0})
+    results = [
+        {"nct_id": "NCT1", "title": "A", "score": 80.0},
+        {"nct_id": "NCT2", "title": "B", "score": 70.0},
+    ]
+    trials = {nct_id: _trial(nct_id) for nct_id in ("NCT1", "NCT2")}
+    budget = rerank.RerankBudget(k=2, max_tokens=100000, time_budget_s=5.0)
+    rerank.rerank_shortlist(results[1:], trials, "Adult.", "p", budget)
+    assert len(client.prompts) == 1
+
+    stats = {}
+    expired = rerank.RerankBudget(k=2, max_tokens=100000, time_budget_s=0.0)
+    reranked = rerank.rerank_shortlist(results, trials, "Adult.", "p", expired, stats)
+
+    assert len(client.prompts) == 1
+    assert stats["cached"] == 1 and stats["judged"] == 0 and stats["skipped"] == 1
+    assert [row["nct_id"] for row in reranked] == ["NCT2", "NCT1"]
+
+
+class BatchReasoningClient(FakeReasoningClient):
+    def __init__(self, scores, slow):
+        super().__init__(scores)
+        self.slow = slow
+        self.batches = []
+
+    def chat_completion_batch(self, conversations, max_tokens=512, temperature=0.1):
+        self.batches.append(len(conversations))
+        completions = [self.chat_completion(messages) for messages in conversations]
+        if any(f"Trial {self.slow}" in messages[0]["content"] for messages in conversations):
+            time.sleep(0.5)
+        return completions
+
+
+def test_rerank_batches_are_bounded_so_a_slow_prompt_loses_only_its_group(
+    rerank_env, monkeypatch
+):
+    scores = {f"NCT{i}": 100.0 for i in range(1, 5)}
+    client = BatchReasoningClient(scores, slow="NCT4")
+    monkeypatch.setattr(rerank, "get_reasoning_client", lambda: client)
+    monkeypatch.setattr(rerank.settings, "rerank_batch_size", 2)
+    results = [{"nct_id": n, "title": n, "score": 50.0} for n in scores]
+    trials = {n: _trial(n) for n in scores}
+    budget = rerank.RerankBudget(k=4, max_tokens=100000, time_budget_s=0.25)
+    stats = {}
+
+    reranked = rerank.rerank_shortlist(results, trials, "Adult.", "p", budget, stats)
+
+    assert client.batches == [2, 2]
+    assert stats["judged"] == 2 and stats["skipped"] == 2
+    assert {row["nct_id"] for row in reranked if "llm_score" in row} == {"NCT1", "NCT2"}
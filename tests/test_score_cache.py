@@ -0,0 +1,98 @@
+from trialmatch.services import score_cache
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self._docs = list(docs)
+
+    def sort(self, key, direction):
+        self._docs.sort(key=lambda doc: doc.get(key), reverse=direction < 0)
+        return self
+
+    def limit(self, n):
+        self._docs = self._docs[:n]
+        return self
+
+    def __iter__(self):
+        return iter(self._docs)
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = {}
+        self.finds = 0
+
+    def find(self, query, projection=None):
+        self.finds += 1
+        ids = (query.get("_id") or {}).get("$in")
+        docs = [dict(doc) for key, doc in self.docs.items() if ids is None or key in ids]
+        return FakeCursor(docs)
+
+    def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            key = op._filter["_id"]
+            self.docs.setdefault(key, {"_id": key}).update(op._doc["$set"])
+
+    def estimated_document_count(self):
+        return len(self.docs)
+
+    def delete_many(self, query):
+        for key in query["_id"]["$in"]:
+            self.docs.pop(key, None)
+
+
+def test_pair_cache_key_changes_with_versions():
+    base = score_cache.pair_cache_key("p", "c", {"embedding_model": "a"})
+
+    assert base == score_cache.pair_cache_key("p", "c", {"embedding_model": "a"})
+    assert base != score_cache.pair_cache_key("p", "c", {"embedding_model": "b"})
+    assert base != score_cache.pair_cache_key("p", "c", {"embedding_model": "a"}, "2")
+
+
+def test_pair_cache_reads_through_memory_then_collection():
+    coll = FakeCollection()
+    cache = score_cache.PairCache(lambda: coll, max_memory_entries=10, max_persisted_entries=10)
+
+    cache.put_many({"k1": 92.0, "k2": 0.0})
+    cache.clear_memory()
+
+    assert cache.get_many(["k1", "k2", "k3"]) == {"k1": 92.0, "k2": 0.0}
+    finds = coll.finds
+    assert cache.get_many(["k1", "k2"]) == {"k1": 92.0, "k2": 0.0}
+    assert coll.finds == finds
+
+
+def test_pair_cache_bounds_memory_and_persisted_entries():
+    coll = FakeCollection()
+    cache = score_cache.PairCache(lambda: coll, max_memory_entries=2, max_persisted_entries=3)
+
+    for i in range(5):
+        cache.put_many({f"k{i}": float(i)})
+
+    assert len(cache._memory) == 2
+    assert len(coll.docs) == 3
+    assert set(coll.docs) == {"k2", "k3", "k4"}
+
+
+def test_pair_cache_trims_at_most_once_per_interval(monkeypatch):
+    coll = FakeCollection()
+    counts = []
+    count = coll.estimated_document_count
+    coll.estimated_document_count = lambda: counts.append(1) or count()
+    clock = [100.0]
+    monkeypatch.setattr(score_cache.time, "monotonic", lambda: clock[0])
+    cache = score_cache.PairCache(
+        lambda: coll, max_memory_entries=0, max_persisted_entries=2, trim_interval_s=60
+    )
+
+    for i in range(4):
+        cache.put_many({f"k{i}": float(i)})
+
+    assert len(counts) == 1
+    assert len(coll.docs) == 4  # over the limit until the next trim
+
+    clock[0] += 60
+    cache.put_many({"k4": 4.0})
+
+    assert len(counts) == 2
+    assert set(coll.docs) == {"k3", "k4"}
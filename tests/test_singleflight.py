@@ -0,0 +1,84 @@
+from concurrent.futures import Future
+import threading
+
+import pytest
+
+from trialmatch.services.singleflight import SingleFlight
+
+
+def test_concurrent_calls_for_one_key_run_once_and_share_the_result():
+    flights = SingleFlight()
+    entered = threading.Event()
+    release = threading.Event()
+    runs = []
+
+    def compute():
+        runs.append(1)
+        entered.set()
+        release.wait(timeout=5)
+        return {"value": 42}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do("k", compute)))
+    leader.start()
+    entered.wait(timeout=5)
+    followers = [
+        threading.Thread(target=lambda: results.append(flights.do("k", compute))) for _ in range(3)
+    ]
+    for thread in followers:
+        thread.start()
+    while flights.stats()["coalesced"] < 3:
+        pass
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join()
+
+    assert runs == [1]
+    assert len(results) == 4 and all(result is results[0] for result in results)
+    assert flights.stats()["in_flight"] == 0
+    assert flights.do("k", lambda: "fresh") == "fresh"
+
+
+def test_errors_are_shared_and_not_remembered():
+    flights = SingleFlight()
+
+    with pytest.raises(RuntimeError):
+        flights.do("k", lambda: (_ for _ in ()).throw(RuntimeError("boom")))
+    assert flights.do("k", lambda: "ok") == "ok"
+
+
+def test_share_returns_the_pending_future_until_it_completes():
+    flights = SingleFlight()
+    started = []
+
+    def start():
+        started.append(Future())
+        return started[-1]
+
+    first = flights.share("k", start)
+    second = flights.share("k", start)
+    assert first is second and len(started) == 1
+
+    first.set_result("row")
+    assert flights.share("k", start) is not first
+    assert len(started) == 2
+
+
+def test_do_many_computes_new_keys_together_and_joins_keys_in_flight():
+    flights = SingleFlight()
+    pending = flights.share("a", Future)
+    calls = []
+
+    def compute(keys):
+        calls.append(keys)
+        return {key: key.upper() for key in keys}
+
+    joiner = threading.Thread(target=lambda: calls.append(flights.do_many(["a", "b", "c", "b"], compute)))
+    joiner.start()
+    while flights.stats()["coalesced"] < 1:
+        pass
+    pending.set_result("A from share")
+    joiner.join(timeout=5)
+
+    assert calls == [["b", "c"], {"b": "B", "c": "C", "a": "A from share"}]
+    assert flights.stats()["in_flight"] == 0
@@ -1,10 +1,26 @@
-import pandas as pd
+import random
 
 from trialmatch.services import trial_repository
 
 
+class FakeTrials:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def aggregate(self, pipeline):
+        match = pipeline[0]["$match"]
+        docs = [
+            doc
+            for doc in self.docs
+            if "overall_status" not in match
+            or doc.get("overall_status") in match["overall_status"]["$in"]
+        ]
+        size = min(pipeline[1]["$sample"]["size"], len(docs))
+        return random.sample(docs, size)
+
+
 def test_load_random_trials_data_prefers_active_trials(monkeypatch):
-    trials_df = pd.DataFrame(
+    trials = FakeTrials(
         [
             {"nct_id": "NCT1", "overall_status": "COMPLETED"},
             {"nct_id": "NCT2", "overall_status": "RECRUITING"},
@@ -12,7 +28,7 @@ def test_load_random_trials_data_prefers_active_trials(monkeypatch):
         ]
     )
 
-    monkeypatch.setattr(trial_repository, "_load_trials_from_mongo", lambda limit=None: trials_df)
+    monkeypatch.setattr(trial_repository, "trials_collection", lambda: trials)
 
     sampled = trial_repository.load_random_trials_data(2)
 
@@ -21,14 +37,14 @@ def test_load_random_trials_data_prefers_active_trials(monkeypatch):
 
 
 def test_load_random_trials_data_falls_back_when_status_missing(monkeypatch):
-    trials_df = pd.DataFrame(
+    trials = FakeTrials(
         [
             {"nct_id": "NCT1"},
             {"nct_id": "NCT2"},
         ]
     )
 
-    monkeypatch.setattr(trial_repository, "_load_trials_from_mongo", lambda limit=None: trials_df)
+    monkeypatch.setattr(trial_repository, "trials_collection", lambda: trials)
 
     sampled = trial_repository.load_random_trials_data(1)
 
@@ -0,0 +1,136 @@
+import threading
+
+import pytest
+from pymongo import UpdateOne
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from trialmatch.services import write_behind
+
+
+class FakeCollection:
+    def __init__(self, fail=False, gate=None):
+        self.batches = []
+        self.fail = fail
+        self.gate = gate
+
+    def bulk_write(self, ops, ordered=True):
+        if self.gate is not None:
+            self.gate.wait(timeout=5)
+        if self.fail:
+            raise AutoReconnect("connection closed")
+        self.batches.append([op._filter["k"] for op in ops])
+
+
+def _op(k):
+    return UpdateOne({"k": k}, {"$set": {"v": k}})
+
+
+def test_buffer_batches_in_order_and_runs_callbacks_after_write():
+    coll = FakeCollection()
+    done = []
+    buffer = write_behind.WriteBehindBuffer(max_queue=100, batch_size=50, flush_interval_s=0.05)
+
+    for k in range(5):
+        buffer.enqueue(lambda: coll, [_op(k)])
+    buffer.enqueue(lambda: coll, [_op(5)], then=lambda: done.append(sum(coll.batches, [])))
+
+    assert buffer.close(timeout=5)
+    assert sum(coll.batches, []) == [0, 1, 2, 3, 4, 5]
+    assert done == [[0, 1, 2, 3, 4, 5]]
+    stats = buffer.stats()
+    assert stats["written"] == 6 and stats["pending"] == 0
+
+
+def test_full_queue_blocks_behind_older_writes_and_failures_are_counted(monkeypatch):
+    monkeypatch.setattr(write_behind.time, "sleep", lambda _s: None)
+    gate = threading.Event()
+    coll = FakeCollection(gate=gate)
+    buffer = write_behind.WriteBehindBuffer(
+        max_queue=1, batch_size=1, flush_interval_s=0, enqueue_timeout_s=5
+    )
+
+    buffer.enqueue(lambda: coll, [_op(0)])  # taken by the writer, blocked on the gate
+    while buffer.stats()["pending"]:
+        pass
+    buffer.enqueue(lambda: coll, [_op(1)])  # fills the queue
+    blocked = threading.Thread(target=buffer.enqueue, args=(lambda: coll, [_op(2)]))
+    blocked.start()
+    while not buffer.stats()["queue_full_waits"]:
+        pass
+    gate.set()
+    blocked.join(timeout=5)
+    assert buffer.close(timeout=5)
+    assert sum(coll.batches, []) == [0, 1, 2]
+
+    stuck = threading.Event()
+    slow = FakeCollection(gate=stuck)
+    full = write_behind.WriteBehindBuffer(
+        max_queue=1, batch_size=1, flush_interval_s=0, enqueue_timeout_s=0.05
+    )
+    full.enqueue(lambda: slow, [_op(0)])
+    while full.stats()["pending"]:
+        pass
+    full.enqueue(lambda: slow, [_op(1)])
+    with pytest.raises(write_behind.WriteBehindFull):
+        full.enqueue(lambda: slow, [_op(2)])
+    assert full.stats()["rejected"] == 1
+    stuck.set()
+    full.close(timeout=5)
+
+    broken = FakeCollection(fail=True)
+    failing = write_behind.WriteBehindBuffer(max_queue=10, batch_size=10, flush_interval_s=0)
+    failing.enqueue(lambda: broken, [_op(0), _op(1)])
+    failing.close(timeout=5)
+    stats = failing.stats()
+    assert stats["failed"] == 2 and stats["written"] == 0
+    assert "connection closed" in stats["last_error"]
+
+
+class PartialFailureCollection:
+    """Fails given keys with given error codes, once per code list entry."""
+
+    def __init__(self, failures):
+        self.failures = {k: list(codes) for k, codes in failures.items()}
+        self.calls = []
+
+    def bulk_write(self, ops, ordered=True):
+        assert ordered is False
+        keys = [op._filter["k"] for op in ops]
+        self.calls.append(keys)
+        errors = []
+        for index, k in enumerate(keys):
+            codes = self.failures.get(k)
+            if codes:
+                errors.append({"index": index, "code": codes.pop(0), "errmsg": f"fail {k}"})
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": 0})
+
+
+def test_only_transiently_failed_ops_are_retried_and_callbacks_skip_failed_writes(monkeypatch):
+    monkeypatch.setattr(write_behind.time, "sleep", lambda _s: None)
+    coll = PartialFailureCollection({1: [112], 2: [write_behind.DUPLICATE_KEY]})
+    done = []
+    buffer = write_behind.WriteBehindBuffer(max_queue=10, batch_size=10, flush_interval_s=0.05)
+
+    getter = lambda: coll  # noqa: E731 - one getter, so one grouped bulk write
+    for k in range(3):
+        buffer.enqueue(getter, [_op(k)], then=lambda k=k: done.append(k))
+    assert buffer.close(timeout=5)
+
+    # Write conflict on 1 is retried alone; the duplicate key on 2 is final.
+    assert coll.calls == [[0, 1, 2], [1]]
+    assert done == [0, 1]
+    stats = buffer.stats()
+    assert stats["written"] == 2 and stats["failed"] == 1
+    assert stats["retried"] == 1 and stats["callbacks_skipped"] == 1
+
+
+def test_persist_writes_inline_when_disabled(monkeypatch):
+    monkeypatch.setattr(write_behind.settings, "write_behind_enabled", False)
+    coll = FakeCollection()
+    after = []
+
+    write_behind.persist(lambda: coll, [_op(1)], then=lambda: after.append(True))
+
+    assert coll.batches == [[1]]
+    assert after == [True]
@@ -0,0 +1,174 @@
+"""
+Command-line entry points for batch and maintenance jobs.
+
+Run from the repo root (``.env`` is loaded the same way as ``app.py``):
+
+    python -m trialmatch.cli screen-trial NCT01234567 --page-size 20
+    python -m trialmatch.cli match-delta
+    python -m trialmatch.cli migrate-embeddings
+    python -m trialmatch.cli ensure-indexes
+    python -m trialmatch.cli compact-matches
+    python -m trialmatch.cli prepare-catalog --batch-size 32
+    python -m trialmatch.cli model-server --socket /run/trialmatch/models.sock
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+
+def _screen_trial(args: argparse.Namespace) -> int:
+    from trialmatch.services.cohort_screening import screen_trial
+
+    try:
+        cohort = screen_trial(
+            args.nct_id,
+            page=args.page,
+            page_size=args.page_size,
+            min_score=args.min_score,
+        )
+    except ValueError as exc:
+        print(str(exc), file=sys.stderr)
+        return 1
+    print(json.dumps(cohort, indent=2))
+    return 0
+
+
+def _match_delta(args: argparse.Namespace) -> int:
+    from trialmatch.services.delta_matching import run_delta_matching
+
+    print(json.dumps(run_delta_matching(), indent=2))
+    return 0
+
+
+def _migrate_embeddings(args: argparse.Namespace) -> int:
+    from trialmatch.services.embedding_migration import (
+        migrate_embeddings_to_binary,
+        move_criteria_vectors,
+    )
+
+    summary = move_criteria_vectors(batch_size=args.batch_size)
+    summary.update(migrate_embeddings_to_binary(batch_size=args.batch_size))
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+def _ensure_indexes(args: argparse.Namespace) -> int:
+    from trialmatch.services.db import INDEXES, ensure_indexes
+
+    applied = ensure_indexes()
+    print(json.dumps(applied, indent=2))
+    return 0 if len(applied) == len(INDEXES) else 1
+
+
+def _compact_matches(args: argparse.Namespace) -> int:
+    from trialmatch.services.match_history import backfill_match_history
+
+    print(json.dumps(backfill_match_history(), indent=2))
+    return 0
+
+
+def _prepare_catalog(args: argparse.Namespace) -> int:
+    from trialmatch.services.prepared_trials import prepare_catalog
+
+    print(json.dumps(prepare_catalog(batch_size=args.batch_size), indent=2))
+    return 0
+
+
+def _model_server(args: argparse.Namespace) -> int:
+    from trialmatch.config import settings
+    from trialmatch.services.model_server import ModelServer
+
+    socket_path = args.socket or settings.model_server_socket
+    if not socket_path:
+        print("Pass --socket or set MODEL_SERVER_SOCKET.", file=sys.stderr)
+        return 1
+    server = ModelServer(
+        socket_path,
+        max_batch=args.max_batch,
+        max_wait_s=args.max_wait_ms / 1000.0,
+    )
+    if args.preload:
+        server.preload()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m trialmatch.cli")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    screen = commands.add_parser("screen-trial", help="Rank stored patients for one trial.")
+    screen.add_argument("nct_id")
+    screen.add_argument("--page", type=int, default=1)
+    screen.add_argument("--page-size", type=int, default=50)
+    screen.add_argument("--min-score", type=float, default=0.0)
+    screen.set_defaults(handler=_screen_trial)
+
+    delta = commands.add_parser(
+        "match-delta",
+        help="Merge trials changed since each patient's latest demo match into it.",
+    )
+    delta.set_defaults(handler=_match_delta)
+
+    migrate = commands.add_parser(
+        "migrate-embeddings",
+        help=(
+            "Move trial criterion vectors to criteria_vectors and re-encode legacy "
+            "array embeddings as packed binary."
+        ),
+    )
+    migrate.add_argument("--batch-size", type=int, default=500)
+    migrate.set_defaults(handler=_migrate_embeddings)
+
+    indexes = commands.add_parser(
+        "ensure-indexes",
+        help="Create the MongoDB indexes declared in trialmatch.services.db.INDEXES.",
+    )
+    indexes.set_defaults(handler=_ensure_indexes)
+
+    compact = commands.add_parser(
+        "compact-matches",
+        help="Set latest_match pointers and apply match history retention to all patients.",
+    )
+    compact.set_defaults(handler=_compact_matches)
+
+    prepare = commands.add_parser(
+        "prepare-catalog",
+        help="Parse and embed the criteria of every trial whose cache is missing or outdated.",
+    )
+    prepare.add_argument("--batch-size", type=int, default=32)
+    prepare.set_defaults(handler=_prepare_catalog)
+
+    model_server = commands.add_parser(
+        "model-server",
+        help="Serve the local reasoning/embedding/NER models to web workers on a Unix socket.",
+    )
+    model_server.add_argument("--socket", default="", help="Defaults to MODEL_SERVER_SOCKET.")
+    model_server.add_argument("--max-batch", type=int, default=32)
+    model_server.add_argument("--max-wait-ms", type=float, default=5.0)
+    model_server.add_argument(
+        "--preload", action="store_true", help="Load every model before accepting requests."
+    )
+    model_server.set_defaults(handler=_model_server)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    load_dotenv()
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -30,6 +30,46 @@ class Settings:
         os.getenv("HF_EMBEDDING_MODEL", "").strip()
         or "NeuML/pubmedbert-base-embeddings"
     )
+    # Hosted inference HTTP transport: per-call timeout, keep-alive pool size, and
+    # retries of 429/5xx/connection errors with jittered exponential backoff.
+    hf_timeout_s: float = float(os.getenv("HF_TIMEOUT_S", "60"))
+    hf_pool_connections: int = int(os.getenv("HF_POOL_CONNECTIONS", "32"))
+    hf_max_retries: int = int(os.getenv("HF_MAX_RETRIES", "4"))
+    hf_backoff_base_s: float = float(os.getenv("HF_BACKOFF_BASE_S", "0.5"))
+    hf_backoff_max_s: float = float(os.getenv("HF_BACKOFF_MAX_S", "20"))
+    # Adaptive (AIMD) limit on in-flight hosted inference calls per provider.
+    adaptive_concurrency_enabled: bool = _env_flag("ADAPTIVE_CONCURRENCY_ENABLED", True)
+    adaptive_concurrency_initial: int = int(os.getenv("ADAPTIVE_CONCURRENCY_INITIAL", "4"))
+    adaptive_concurrency_max: int = int(os.getenv("ADAPTIVE_CONCURRENCY_MAX", "64"))
+    adaptive_concurrency_latency_tolerance: float = float(
+        os.getenv("ADAPTIVE_CONCURRENCY_LATENCY_TOLERANCE", "2.0")
+    )
+    # Max NCT ids waiting for background preparation (deadline-bound matching).
+    background_preparation_max_queue: int = int(
+        os.getenv("BACKGROUND_PREPARATION_MAX_QUEUE", "10000")
+    )
+    # Concurrent criteria builds (LLM parse + embeddings) of deadline-bound requests.
+    preparation_workers: int = int(os.getenv("PREPARATION_WORKERS", "8"))
+    # Keep scoring with outdated trial caches (same embedding model) while a
+    # background refresh rebuilds them, instead of rebuilding inline.
+    trial_cache_serve_stale: bool = _env_flag("TRIAL_CACHE_SERVE_STALE", True)
+    # Micro-batching of concurrent embedding requests into one backend call.
+    embedding_batching: bool = _env_flag("EMBEDDING_BATCHING", True)
+    embedding_batch_max: int = int(os.getenv("EMBEDDING_BATCH_MAX", "32"))
+    embedding_batch_wait_ms: float = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+    # Hosted embedding batches in flight at once (0 = HF_POOL_CONNECTIONS; local
+    # models always run one batch at a time), and how long a caller waits for its
+    # row before giving up.
+    embedding_batch_concurrency: int = int(os.getenv("EMBEDDING_BATCH_CONCURRENCY", "0"))
+    embedding_result_timeout_s: float = float(os.getenv("EMBEDDING_RESULT_TIMEOUT_S", "300"))
+    # Hedged embedding/NER calls: after the primary's p95 latency (clamped to the
+    # min/max delay) the call is duplicated to HEDGE_SECONDARY_BACKEND ("local" or
+    # an Inference Providers name) and the first answer wins. Embeddings are only
+    # hedged between hosted providers of the same model (never local).
+    hedge_enabled: bool = _env_flag("HEDGE_ENABLED", False)
+    hedge_secondary_backend: str = os.getenv("HEDGE_SECONDARY_BACKEND", "local").strip()
+    hedge_min_delay_ms: float = float(os.getenv("HEDGE_MIN_DELAY_MS", "50"))
+    hedge_max_delay_ms: float = float(os.getenv("HEDGE_MAX_DELAY_MS", "2000"))
     # Dev-only switch: use local Transformers inference instead of HF hosted APIs.
     # Defaults to False so production behavior is unchanged.
     dev_local_inference: bool = _env_flag("DEV_LOCAL_INFERENCE", False)
@@ -38,6 +78,36 @@ class Settings:
         os.getenv("DEV_LOCAL_REASONING_MODEL", "").strip()
         or "microsoft/Phi-3-mini-4k-instruct"
     )
+    # CPU tuning of the local embedding model: dynamic int8 quantization of its
+    # linear layers, torch intra-op threads (0 = torch default), texts per forward pass.
+    local_embedding_quantize: bool = _env_flag("LOCAL_EMBEDDING_QUANTIZE", False)
+    local_torch_threads: int = int(os.getenv("LOCAL_TORCH_THREADS", "0"))
+    local_embedding_batch_size: int = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "32"))
+    # Local reasoning model: prompts per generate() batch, cached prompt-prefix
+    # key/value sets, and the shortest shared prefix (tokens) worth caching.
+    local_llm_batch_size: int = int(os.getenv("LOCAL_LLM_BATCH_SIZE", "8"))
+    local_llm_prefix_cache_size: int = int(os.getenv("LOCAL_LLM_PREFIX_CACHE_SIZE", "4"))
+    local_llm_min_prefix_tokens: int = int(os.getenv("LOCAL_LLM_MIN_PREFIX_TOKENS", "16"))
+    # Optional LLM rerank of the embedding shortlist (per-request ``rerank``):
+    # defaults for shortlist size, estimated token and time budget, blending.
+    rerank_k: int = int(os.getenv("RERANK_K", "10"))
+    rerank_max_k: int = int(os.getenv("RERANK_MAX_K", "50"))
+    rerank_max_tokens: int = int(os.getenv("RERANK_MAX_TOKENS", "20000"))
+    rerank_time_budget_ms: float = float(os.getenv("RERANK_TIME_BUDGET_MS", "8000"))
+    rerank_policy: str = os.getenv("RERANK_POLICY", "blend").strip() or "blend"
+    rerank_blend_weight: float = float(os.getenv("RERANK_BLEND_WEIGHT", "0.5"))
+    rerank_max_workers: int = int(os.getenv("RERANK_MAX_WORKERS", "4"))
+    rerank_batch_size: int = int(os.getenv("RERANK_BATCH_SIZE", "4"))
+    # Patient NER: summaries are split into sentence chunks of at most this many
+    # characters (below the NER model's 512-token limit); local batch size;
+    # concurrent hosted NER requests (one chunk each) per call.
+    ner_chunk_max_chars: int = int(os.getenv("NER_CHUNK_MAX_CHARS", "800"))
+    ner_batch_size: int = int(os.getenv("NER_BATCH_SIZE", "16"))
+    ner_max_workers: int = int(os.getenv("NER_MAX_WORKERS", "8"))
+    # Unix socket of a shared local model server (``python -m trialmatch.cli
+    # model-server``); when set with DEV_LOCAL_INFERENCE, workers load no models.
+    model_server_socket: str = os.getenv("MODEL_SERVER_SOCKET", "").strip()
+    model_server_timeout_s: float = float(os.getenv("MODEL_SERVER_TIMEOUT_S", "120"))
 
     # Local Synthea directory if used outside the API upload flow
     synthea_data_dir: str = os.getenv("SYNTHEA_DATA_DIR", "./synthea_data/json")
@@ -45,9 +115,37 @@ class Settings:
     # MongoDB
     mongodb_uri: str = os.getenv("MONGODB_URI", "")
     mongodb_db: str = os.getenv("MONGODB_DB", "trialmatch")
+    # Create the indexes in ``db.INDEXES`` when the app starts (idempotent).
+    mongodb_ensure_indexes: bool = _env_flag("MONGODB_ENSURE_INDEXES", True)
 
     # Matching
     num_random_trials: int = int(os.getenv("NUM_RANDOM_TRIALS", "5"))
+    # Pair-level score cache (patient summary hash x trial criteria hash).
+    score_cache_enabled: bool = _env_flag("SCORE_CACHE_ENABLED", True)
+    score_cache_memory_entries: int = int(os.getenv("SCORE_CACHE_MEMORY_ENTRIES", "50000"))
+    score_cache_max_entries: int = int(os.getenv("SCORE_CACHE_MAX_ENTRIES", "1000000"))
+    score_cache_trim_interval_s: float = float(os.getenv("SCORE_CACHE_TRIM_INTERVAL_S", "60"))
+    # Match history retention: runs outside both the newest KEEP_RUNS runs and the
+    # last KEEP_DAYS days are compacted to summaries (0 disables that window).
+    match_history_compaction: bool = _env_flag("MATCH_HISTORY_COMPACTION", True)
+    match_history_keep_runs: int = int(os.getenv("MATCH_HISTORY_KEEP_RUNS", "10"))
+    match_history_keep_days: float = float(os.getenv("MATCH_HISTORY_KEEP_DAYS", "30"))
+    # Optional quantized first pass over trial criterion embeddings: "int8", "float16",
+    # or empty for plain float32. Scores are identical either way.
+    embedding_quantization: str = os.getenv("EMBEDDING_QUANTIZATION", "").strip().lower()
+    # Write-behind persistence: match runs, patient embeddings and trial metadata are
+    # written in batches by a background thread instead of inside the request.
+    write_behind_enabled: bool = _env_flag("WRITE_BEHIND_ENABLED", False)
+    write_behind_max_queue: int = int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "10000"))
+    write_behind_batch_size: int = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "500"))
+    write_behind_flush_interval_ms: float = float(
+        os.getenv("WRITE_BEHIND_FLUSH_INTERVAL_MS", "50")
+    )
+    write_behind_enqueue_timeout_s: float = float(
+        os.getenv("WRITE_BEHIND_ENQUEUE_TIMEOUT_S", "5")
+    )
+    # Seconds the in-memory patient embedding matrix used by cohort screening is reused.
+    cohort_matrix_ttl_s: float = float(os.getenv("COHORT_MATRIX_TTL_S", "300"))
 
     # Supabase Auth (backend verifies JWTs from the Supabase JS client)
     # URL: optional here; frontend uses VITE_SUPABASE_URL. Backend accepts either env name.
@@ -0,0 +1,123 @@
+"""
+Background preparation of trials that a request could not afford to prepare.
+
+Deadline-bound matching (and stale-while-revalidate serving) hand the NCT ids of
+trials whose criteria still need parsing/embedding to ``queue_trial_preparation``.
+One daemon thread reads those trials and runs ``ensure_trials_prepared`` on them
+in small batches, so a later request finds them ready. Ids already queued are not
+queued twice, and the queue is bounded: ids offered while it is full are dropped
+(the next request that needs them queues them again).
+"""
+
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from trialmatch.config import settings
+from trialmatch.services.db import trials_collection
+from trialmatch.services.trial_repository import TRIAL_METADATA_PROJECTION
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 16
+
+
+class PreparationQueue:
+    """
+    Deduplicating bounded queue of NCT ids prepared by a daemon thread.
+    """
+
+    def __init__(self, max_queue: int) -> None:
+        self._queue: "queue.Queue[str]" = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._queued: Set[str] = set()
+        self._lock = threading.Lock()
+        self._stats = {"queued": 0, "prepared": 0, "dropped": 0, "failed": 0}
+        self._thread = threading.Thread(target=self._run, name="trial-preparation", daemon=True)
+        self._thread.start()
+
+    def offer(self, nct_ids: Iterable[str]) -> int:
+        """Queue ids not already waiting; returns how many were added."""
+        added = 0
+        for nct_id in nct_ids:
+            with self._lock:
+                if nct_id in self._queued:
+                    continue
+                try:
+                    self._queue.put_nowait(nct_id)
+                except queue.Full:
+                    self._stats["dropped"] += 1
+                    continue
+                self._queued.add(nct_id)
+                self._stats["queued"] += 1
+            added += 1
+        return added
+
+    def _take_batch(self) -> List[str]:
+        batch = [self._queue.get()]
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        with self._lock:
+            self._queued.difference_update(batch)
+        return batch
+
+    def _prepare(self, nct_ids: List[str]) -> None:
+        # Imported here: prepared_trials pulls in the inference stack.
+        from trialmatch.services.prepared_trials import ensure_trials_prepared
+
+        docs = list(
+            trials_collection().find({"nct_id": {"$in": nct_ids}}, TRIAL_METADATA_PROJECTION)
+        )
+        # Never serve stale here: this is the refresh that replaces stale sets.
+        ensure_trials_prepared(docs, allow_stale=False)
+        with self._lock:
+            self._stats["prepared"] += len(docs)
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take_batch()
+            try:
+                self._prepare(batch)
+            except Exception as exc:  # noqa: BLE001 - keep the worker alive
+                with self._lock:
+                    self._stats["failed"] += len(batch)
+                logger.warning("preparation:failed trials=%s error=%s", len(batch), exc)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def join(self) -> None:
+        """Block until every queued id has been processed (tests, CLI)."""
+        self._queue.join()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._stats)
+        out["pending"] = self._queue.qsize()
+        return out
+
+
+_preparation_queue: Optional[PreparationQueue] = None
+_preparation_queue_lock = threading.Lock()
+
+
+def get_preparation_queue() -> PreparationQueue:
+    """Lazy getter for the process-wide preparation queue."""
+    global _preparation_queue
+    with _preparation_queue_lock:
+        if _preparation_queue is None:
+            _preparation_queue = PreparationQueue(settings.background_preparation_max_queue)
+    return _preparation_queue
+
+
+def queue_trial_preparation(nct_ids: Iterable[str]) -> int:
+    """Queue trials for background preparation; returns how many were newly queued."""
+    ids = [str(nct_id) for nct_id in nct_ids if nct_id]
+    if not ids:
+        return 0
+    return get_preparation_queue().offer(ids)
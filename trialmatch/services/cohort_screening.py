@@ -0,0 +1,129 @@
+"""
+Reverse matching: screen one trial against every stored patient.
+
+The patients' ``profile_embedding`` vectors are kept as one row-normalized matrix in
+process memory (reloaded after ``COHORT_MATRIX_TTL_S`` seconds), so screening a trial
+is a single vectorized pass over its criteria with the same scoring rules as
+patient-to-trial matching.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from trialmatch.config import settings
+from trialmatch.services.db import trials_collection
+from trialmatch.services.matching_engine import calculate_match_scores_for_patients, unit_rows
+from trialmatch.services.patient_matrix import PatientEmbeddingMatrix, load_patient_embedding_matrix
+from trialmatch.services.prepared_trials import criteria_embedding_matrices, ensure_trial_prepared
+from trialmatch.services.trial_repository import TRIAL_METADATA_PROJECTION
+
+logger = logging.getLogger(__name__)
+
+_matrix_lock = threading.Lock()
+_matrix: Optional[Tuple[PatientEmbeddingMatrix, np.ndarray, float]] = None
+
+
+def get_patient_matrix(force_reload: bool = False) -> Tuple[PatientEmbeddingMatrix, np.ndarray]:
+    """
+    Return the cached patient embedding matrix and its row-normalized copy.
+    """
+    global _matrix
+    with _matrix_lock:
+        cached = _matrix
+        fresh = cached is not None and (
+            time.monotonic() - cached[2] < settings.cohort_matrix_ttl_s
+        )
+        if force_reload or not fresh:
+            t0 = time.perf_counter()
+            matrix = load_patient_embedding_matrix()
+            unit = unit_rows(matrix.embeddings) if len(matrix) else matrix.embeddings
+            cached = (matrix, unit, time.monotonic())
+            _matrix = cached
+            logger.info(
+                "cohort:matrix_loaded patients=%s elapsed_s=%.2f",
+                len(matrix),
+                time.perf_counter() - t0,
+            )
+    return cached[0], cached[1]
+
+
+def screen_trial(
+    nct_id: str,
+    page: int = 1,
+    page_size: int = 50,
+    min_score: float = 0.0,
+) -> Dict[str, Any]:
+    """
+    Rank stored patients by their match score for trial ``nct_id``.
+
+    Returns:
+    {
+        "nct_id": "...", "title": "...", "screened": int, "total": int,
+        "page": int, "page_size": int,
+        "patients": [{"patient_id": "...", "score": 0-100}, ...],
+    }
+
+    Only patients scoring above ``min_score`` (and above 0, as in patient matching)
+    are counted; ties keep the patients' storage order.
+    """
+    trial_doc = trials_collection().find_one({"nct_id": nct_id}, TRIAL_METADATA_PROJECTION)
+    if not trial_doc:
+        raise ValueError(f"Trial '{nct_id}' not found.")
+
+    started = time.perf_counter()
+    prepared = ensure_trial_prepared(trial_doc)
+    page = max(1, int(page))
+    page_size = max(1, int(page_size))
+    response: Dict[str, Any] = {
+        "nct_id": nct_id,
+        "title": prepared.get("brief_title") or nct_id,
+        "screened": 0,
+        "total": 0,
+        "page": page,
+        "page_size": page_size,
+        "patients": [],
+    }
+
+    criteria_embeddings = criteria_embedding_matrices(prepared)
+    inclusion = criteria_embeddings["inclusion"]
+    # Same rule as patient matching: trials without inclusion criteria are not ranked.
+    if len(inclusion) == 0:
+        return response
+
+    matrix, unit = get_patient_matrix()
+    response["screened"] = len(matrix)
+    if not len(matrix):
+        return response
+
+    scores = calculate_match_scores_for_patients(
+        matrix.embeddings,
+        {
+            "inclusion_embeddings": inclusion,
+            "exclusion_embeddings": criteria_embeddings["exclusion"],
+        },
+        unit_patients=unit,
+    )
+    rounded = np.round(scores, 2)
+    eligible = np.flatnonzero((rounded > 0) & (rounded > min_score))
+    order = eligible[np.argsort(-rounded[eligible], kind="stable")]
+    response["total"] = int(order.size)
+
+    start = (page - 1) * page_size
+    response["patients"] = [
+        {"patient_id": matrix.patient_ids[idx], "score": float(rounded[idx])}
+        for idx in order[start : start + page_size]
+    ]
+    logger.info(
+        "cohort:screen:done nct_id=%s screened=%s eligible=%s elapsed_s=%.3f",
+        nct_id,
+        len(matrix),
+        order.size,
+        time.perf_counter() - started,
+    )
+    return response
@@ -0,0 +1,180 @@
+"""
+Adaptive concurrency limits for hosted inference providers.
+
+``AdaptiveLimiter`` bounds how many calls to one provider are in flight and moves
+that bound with AIMD (additive increase, multiplicative decrease): while calls
+complete at close to the best latency seen, the limit grows by about one per
+limit's worth of completions; when a call is throttled (429/503, timeouts) or the
+smoothed latency exceeds ``ADAPTIVE_CONCURRENCY_LATENCY_TOLERANCE`` times the
+baseline, the limit is cut by ``backoff_ratio``. Throughput therefore settles near what the
+provider actually sustains without hand-tuned worker counts. At most one cut is
+applied per baseline latency, so a burst of failures from the same overload is
+counted once.
+"""
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+import logging
+import math
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional
+
+from trialmatch.config import settings
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_STATUS_CODES = frozenset({429, 503})
+
+
+def is_throttle_error(exc: BaseException) -> bool:
+    """True for provider overload signals: 429/503 responses and timeouts."""
+    response = getattr(exc, "response", None)
+    if getattr(response, "status_code", None) in THROTTLE_STATUS_CODES:
+        return True
+    return isinstance(exc, TimeoutError) or "Timeout" in type(exc).__name__
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for one provider; use ``slot()`` around each call.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial_limit: int,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        backoff_ratio: float = 0.5,
+        latency_tolerance: float = 2.0,
+        min_latency_delta_s: float = 0.05,
+    ) -> None:
+        self.name = name
+        self._min_limit = max(1, int(min_limit))
+        self._max_limit = max(self._min_limit, int(max_limit))
+        self._limit = float(min(self._max_limit, max(self._min_limit, int(initial_limit))))
+        self._backoff_ratio = min(0.95, max(0.05, float(backoff_ratio)))
+        self._latency_tolerance = max(1.0, float(latency_tolerance))
+        # Ignore ratios on tiny absolute differences (jitter on very fast calls).
+        self._min_latency_delta_s = max(0.0, float(min_latency_delta_s))
+        self._in_flight = 0
+        self._baseline_s: Optional[float] = None
+        self._recent_s: Optional[float] = None
+        self._last_cut = 0.0
+        self._stats = {"calls": 0, "throttled": 0, "slow": 0, "cuts": 0}
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def _acquire(self) -> None:
+        with self._cond:
+            while self._in_flight >= int(self._limit):
+                self._cond.wait()
+            self._in_flight += 1
+
+    def _release(self, latency_s: float, throttled: bool) -> None:
+        with self._cond:
+            saturated = self._in_flight >= int(self._limit)
+            self._in_flight -= 1
+            self._stats["calls"] += 1
+            if self._baseline_s is None:
+                self._baseline_s = self._recent_s = latency_s
+            # Smoothed so one long request does not read as overload.
+            self._recent_s += 0.2 * (latency_s - self._recent_s)
+            slow = (
+                self._recent_s > self._baseline_s * self._latency_tolerance
+                and self._recent_s - self._baseline_s > self._min_latency_delta_s
+            )
+            if throttled or slow:
+                self._stats["throttled" if throttled else "slow"] += 1
+                self._cut()
+            else:
+                # Drift the baseline towards the typical fast latency.
+                self._baseline_s = min(
+                    latency_s, self._baseline_s + 0.05 * (latency_s - self._baseline_s)
+                )
+                if saturated:
+                    self._limit = min(float(self._max_limit), self._limit + 1.0 / self._limit)
+            self._cond.notify_all()
+
+    def _cut(self) -> None:
+        now = time.monotonic()
+        if now - self._last_cut < (self._baseline_s or 0.0):
+            return
+        self._last_cut = now
+        previous = self.limit
+        self._limit = max(float(self._min_limit), math.floor(self._limit * self._backoff_ratio))
+        self._stats["cuts"] += 1
+        if self.limit != previous:
+            logger.info("limiter:decrease name=%s limit=%s", self.name, self.limit)
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Hold one in-flight slot for the duration of a provider call."""
+        self._acquire()
+        started = time.monotonic()
+        throttled = False
+        try:
+            yield
+        except BaseException as exc:
+            throttled = is_throttle_error(exc)
+            raise
+        finally:
+            self._release(time.monotonic() - started, throttled)
+
+    def stats(self) -> Dict[str, Any]:
+        """Current limit and in-flight count plus counters since start."""
+        with self._cond:
+            out: Dict[str, Any] = dict(self._stats)
+            out.update(
+                name=self.name,
+                limit=self.limit,
+                in_flight=self._in_flight,
+                baseline_s=self._baseline_s,
+                recent_s=self._recent_s,
+            )
+        return out
+
+
+_limiters: Dict[str, AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+@contextmanager
+def _unlimited() -> Iterator[None]:
+    yield
+
+
+def get_limiter(name: str) -> AdaptiveLimiter:
+    """Process-wide limiter for provider ``name`` (created on first use)."""
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = _limiters[name] = AdaptiveLimiter(
+                name,
+                initial_limit=settings.adaptive_concurrency_initial,
+                max_limit=settings.adaptive_concurrency_max,
+                latency_tolerance=settings.adaptive_concurrency_latency_tolerance,
+            )
+    return limiter
+
+
+def provider_slot(name: Optional[str]):
+    """
+    ``slot()`` of the limiter for ``name``; a no-op when ``name`` is empty or
+    limiting is disabled.
+    """
+    if not name or not settings.adaptive_concurrency_enabled:
+        return _unlimited()
+    return get_limiter(name).slot()
+
+
+def limiter_stats() -> Dict[str, Dict[str, Any]]:
+    """``stats()`` of every provider limiter created so far."""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
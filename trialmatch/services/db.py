@@ -1,20 +1,24 @@
 """
 MongoDB helper utilities.
 
-Provides a cached client + DB handle and convenience functions
-for accessing the `patients` and `matches` collections.
+Provides a cached client + DB handle, convenience functions
+for accessing the `patients` and `matches` collections, and the
+index registry applied by ``ensure_indexes``.
 """
 
 from __future__ import annotations
 
+import logging
 import os
-from typing import Any
+from typing import Any, Dict, List
 
-from pymongo import MongoClient
+from pymongo import ASCENDING, DESCENDING, IndexModel, MongoClient
+from pymongo.errors import OperationFailure
 
 from trialmatch.config import settings
 
 _client: MongoClient | None = None
+logger = logging.getLogger(__name__)
 
 
 def get_client() -> MongoClient:
@@ -45,3 +49,72 @@ def matches_collection():
 def trials_collection():
     return get_db()["trials"]
 
+
+def score_cache_collection():
+    return get_db()["score_cache"]
+
+
+def rerank_cache_collection():
+    return get_db()["rerank_cache"]
+
+
+def meta_collection():
+    return get_db()["meta"]
+
+
+def criteria_vectors_collection():
+    return get_db()["criteria_vectors"]
+
+
+# Every index the app relies on, per collection, next to the queries it serves.
+# ``ensure_indexes`` creates them; creating an existing index is a no-op.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "patients": [
+        # find_one / update_one by patient_id on every patient route.
+        IndexModel([("patient_id", ASCENDING)], name="patient_id_unique", unique=True),
+        # /api/patients_index: keyset pages sorted by (created_at, _id) descending.
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at_id_desc"),
+    ],
+    "trials": [
+        # Upload upserts and cohort lookups by nct_id.
+        IndexModel([("nct_id", ASCENDING)], name="nct_id_unique", unique=True),
+        # Random mode samples recruiting-style trials by status.
+        IndexModel([("overall_status", ASCENDING)], name="overall_status"),
+        # Delta matching loads trials changed after a catalog version.
+        IndexModel([("catalog_version", ASCENDING)], name="catalog_version"),
+    ],
+    "matches": [
+        # latest_matches_for_patient: find({"patient_id"}).sort("created_at", -1).limit(1).
+        IndexModel(
+            [("patient_id", ASCENDING), ("created_at", DESCENDING)],
+            name="patient_id_created_at",
+        ),
+    ],
+    "score_cache": [
+        # Trimming evicts the oldest entries first.
+        IndexModel([("cached_at", ASCENDING)], name="cached_at"),
+    ],
+    "rerank_cache": [
+        # Same trimming as score_cache (LLM rerank verdicts).
+        IndexModel([("cached_at", ASCENDING)], name="cached_at"),
+    ],
+}
+
+
+def ensure_indexes(db: Any = None) -> Dict[str, List[str]]:
+    """
+    Create every index in ``INDEXES`` (idempotent).
+
+    Returns ``{collection: [index names]}`` for the collections that succeeded. A
+    collection whose index cannot be built (e.g. duplicate ``patient_id`` values
+    blocking a unique index) is logged and skipped so the others still apply.
+    """
+    db = get_db() if db is None else db
+    applied: Dict[str, List[str]] = {}
+    for name, indexes in INDEXES.items():
+        try:
+            applied[name] = list(db[name].create_indexes(indexes))
+        except OperationFailure as exc:
+            logger.error("db:ensure_indexes:failed collection=%s error=%s", name, exc)
+    logger.info("db:ensure_indexes:done collections=%s", sorted(applied))
+    return applied
@@ -0,0 +1,189 @@
+"""
+Incremental (delta) matching after trial uploads.
+
+Every upload that adds or changes trials bumps the catalog version and stamps those
+trials with it, and every match document records the catalog version it reflects.
+Delta matching scores only the trials changed since a patient's latest ``demo`` match
+(one vectorized column per trial over the patient embedding matrix) and merges the
+results into that match document instead of re-running the whole catalog.
+
+``random`` matches are samples rather than catalog-wide rankings, and ``top_k``
+matches cannot be refilled from trials beyond their cut-off, so both are left alone;
+they pick up new trials on their next full run.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime, timezone
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from trialmatch.services.db import matches_collection, patients_collection
+from trialmatch.services.matching_engine import calculate_match_scores_for_patients, unit_rows
+from trialmatch.services.matching_orchestrator import _prepare_trials
+from trialmatch.services.patient_matrix import load_patient_embedding_matrix
+from trialmatch.services.prepared_trials import criteria_embedding_matrices
+from trialmatch.services.trial_repository import (
+    current_catalog_version,
+    load_trials_changed_since,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _latest_match_heads() -> List[Dict[str, Any]]:
+    """
+    One small row per patient describing their newest match document.
+    """
+    pipeline = [
+        {"$sort": {"patient_id": 1, "created_at": -1}},
+        {
+            "$group": {
+                "_id": "$patient_id",
+                "match_id": {"$first": "$_id"},
+                "mode": {"$first": "$mode"},
+                "top_k": {"$first": "$top_k"},
+                "catalog_version": {"$first": "$catalog_version"},
+            }
+        },
+    ]
+    return list(matches_collection().aggregate(pipeline, allowDiskUse=True))
+
+
+def _merge_trial_results(
+    existing: List[Dict[str, Any]],
+    updates: Dict[str, Optional[Dict[str, Any]]],
+) -> List[Dict[str, Any]]:
+    """
+    Replace the rows of updated trials (``None`` drops a trial that no longer
+    scores) and keep the list sorted by descending score.
+    """
+    merged = [row for row in existing or [] if row.get("nct_id") not in updates]
+    merged.extend(row for row in updates.values() if row is not None)
+    merged.sort(key=lambda x: x["score"], reverse=True)
+    return merged
+
+
+def run_delta_matching(batch_size: int = 500) -> Dict[str, Any]:
+    """
+    Bring every patient's latest ``demo`` match up to the current catalog version.
+
+    Returns a summary:
+    {"catalog_version": int, "trials_scored": int, "patients_updated": int,
+     "patients_skipped": int}
+    """
+    started = time.perf_counter()
+    current = current_catalog_version()
+    summary: Dict[str, Any] = {
+        "catalog_version": current,
+        "trials_scored": 0,
+        "patients_updated": 0,
+        "patients_skipped": 0,
+    }
+
+    heads = [
+        head
+        for head in _latest_match_heads()
+        if head.get("mode") == "demo"
+        and head.get("top_k") is None
+        and int(head.get("catalog_version") or 0) < current
+    ]
+    if not heads:
+        return summary
+
+    since = min(int(head.get("catalog_version") or 0) for head in heads)
+    trials_df = load_trials_changed_since(since)
+    changed: List[Dict[str, Any]] = []
+    if trials_df is not None and not trials_df.empty:
+        changed = [
+            {
+                "nct_id": str(row["nct_id"]),
+                "catalog_version": int(row.get("catalog_version") or 0),
+            }
+            for row in trials_df.to_dict("records")
+        ]
+    prepared = {str(trial["nct_id"]): trial for trial in _prepare_trials(trials_df)} if changed else {}
+
+    matrix = load_patient_embedding_matrix(head["_id"] for head in heads)
+    row_of = {pid: idx for idx, pid in enumerate(matrix.patient_ids)}
+    columns: Dict[str, Any] = {}
+    if len(matrix):
+        unit = unit_rows(matrix.embeddings)
+        for nct_id, trial in prepared.items():
+            criteria_embeddings = criteria_embedding_matrices(trial)
+            columns[nct_id] = calculate_match_scores_for_patients(
+                matrix.embeddings,
+                {
+                    "inclusion_embeddings": criteria_embeddings["inclusion"],
+                    "exclusion_embeddings": criteria_embeddings["exclusion"],
+                },
+                unit_patients=unit,
+            )
+    summary["trials_scored"] = len(columns)
+
+    now = datetime.now(timezone.utc).isoformat()
+    coll = matches_collection()
+    for start in range(0, len(heads), batch_size):
+        batch = heads[start : start + batch_size]
+        existing = {
+            doc["_id"]: doc.get("trials") or []
+            for doc in coll.find(
+                {"_id": {"$in": [head["match_id"] for head in batch]}},
+                {"trials": 1},
+            )
+        }
+        ops = []
+        pointer_ops = []
+        for head in batch:
+            row = row_of.get(str(head["_id"]))
+            if row is None:
+                summary["patients_skipped"] += 1
+                continue
+            patient_version = int(head.get("catalog_version") or 0)
+            updates: Dict[str, Optional[Dict[str, Any]]] = {}
+            for trial in changed:
+                nct_id = trial["nct_id"]
+                if trial["catalog_version"] <= patient_version:
+                    continue
+                column = columns.get(nct_id)
+                score = float(column[row]) if column is not None else 0.0
+                updates[nct_id] = (
+                    {
+                        "nct_id": nct_id,
+                        "title": prepared[nct_id].get("brief_title") or nct_id,
+                        "score": float(round(score, 2)),
+                    }
+                    if score > 0
+                    else None
+                )
+            fields = {
+                "trials": _merge_trial_results(existing.get(head["match_id"]), updates),
+                "catalog_version": current,
+                "updated_at": now,
+            }
+            ops.append(UpdateOne({"_id": head["match_id"]}, {"$set": fields}))
+            # Keep the patient's latest_match copy in step with the merged run.
+            pointer_ops.append(
+                UpdateOne(
+                    {"patient_id": str(head["_id"]), "latest_match._id": head["match_id"]},
+                    {"$set": {f"latest_match.{key}": value for key, value in fields.items()}},
+                )
+            )
+        if ops:
+            coll.bulk_write(ops, ordered=False)
+            patients_collection().bulk_write(pointer_ops, ordered=False)
+            summary["patients_updated"] += len(ops)
+
+    logger.info(
+        "matching:delta:done catalog_version=%s trials_scored=%s patients_updated=%s "
+        "patients_skipped=%s elapsed_s=%.2f",
+        current,
+        summary["trials_scored"],
+        summary["patients_updated"],
+        summary["patients_skipped"],
+        time.perf_counter() - started,
+    )
+    return summary
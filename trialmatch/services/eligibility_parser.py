@@ -7,15 +7,20 @@ criteria into:
     "inclusion": [...],
     "exclusion": [...]
 }
+
+Every prompt starts with the same instruction preamble (``PROMPT_PREFIX``) so a
+backend can reuse its encoding; ``parse_eligibility_criteria_many`` sends all
+criteria needing the LLM to a backend that offers ``chat_completion_batch`` in
+one call.
 """
 
 from __future__ import annotations
 
 import json
 import re
-from typing import Any, Dict
+from typing import Any, Dict, List, Sequence
 
-from trialmatch.services.llm_models import get_reasoning_client
+from trialmatch.services.llm_models import get_reasoning_client, inference_slot
 
 
 _SECTION_SPLIT_RE = re.compile(
@@ -83,31 +88,22 @@ def _fast_parse_eligibility_criteria(criteria_text: str) -> Dict[str, Any] | Non
     return {"inclusion": inclusion, "exclusion": exclusion}
 
 
-def parse_eligibility_criteria(criteria_text: str) -> Dict[str, Any]:
-    """
-    Parse free-text eligibility criteria into inclusion / exclusion lists via
-    ``InferenceClient.chat_completion`` (Inference Providers, not legacy hf-inference).
-    """
-    fast_parsed = _fast_parse_eligibility_criteria(criteria_text)
-    if fast_parsed is not None:
-        return fast_parsed
+PROMPT_PREFIX = (
+    "Read the following clinical trial eligibility criteria. Extract the main "
+    'inclusion and exclusion rules as a JSON object with keys "inclusion" and '
+    '"exclusion", each an array of short strings (one criterion per element). '
+    "Respond with valid JSON only — no markdown fences or explanation.\n\n"
+    "Criteria:\n"
+)
+_MAX_TOKENS = 192
+
 
+def _messages(criteria_text: str) -> list[dict[str, str]]:
     criteria_trimmed = (criteria_text or "")[:8000]
-    user_message = (
-        "Read the following clinical trial eligibility criteria. Extract the main "
-        'inclusion and exclusion rules as a JSON object with keys "inclusion" and '
-        '"exclusion", each an array of short strings (one criterion per element). '
-        "Respond with valid JSON only — no markdown fences or explanation.\n\n"
-        f"Criteria:\n{criteria_trimmed}"
-    )
+    return [{"role": "user", "content": PROMPT_PREFIX + criteria_trimmed}]
 
-    client = get_reasoning_client()
-    completion = client.chat_completion(
-        messages=[{"role": "user", "content": user_message}],
-        max_tokens=192,
-        temperature=0.0,
-    )
 
+def _parse_completion(completion: Any) -> Dict[str, Any]:
     choices = getattr(completion, "choices", None) or []
     if not choices:
         return {"inclusion": [], "exclusion": []}
@@ -129,3 +125,48 @@ def parse_eligibility_criteria(criteria_text: str) -> Dict[str, Any]:
     except json.JSONDecodeError:
         return {"inclusion": [], "exclusion": []}
 
+
+def parse_eligibility_criteria_many(criteria_texts: Sequence[str]) -> List[Dict[str, Any]]:
+    """
+    ``parse_eligibility_criteria`` for several texts; those that need the LLM go
+    to the backend in one ``chat_completion_batch`` call when it has one.
+    """
+    parsed: List[Dict[str, Any] | None] = [
+        _fast_parse_eligibility_criteria(text) for text in criteria_texts
+    ]
+    pending = [index for index, result in enumerate(parsed) if result is None]
+    if not pending:
+        return parsed  # type: ignore[return-value]
+
+    client = get_reasoning_client()
+    batch = getattr(client, "chat_completion_batch", None)
+    if batch is not None and len(pending) > 1:
+        with inference_slot("reasoning"):
+            completions = batch(
+                [_messages(criteria_texts[index]) for index in pending],
+                max_tokens=_MAX_TOKENS,
+                temperature=0.0,
+            )
+    else:
+        completions = []
+        for index in pending:
+            with inference_slot("reasoning"):
+                completions.append(
+                    client.chat_completion(
+                        messages=_messages(criteria_texts[index]),
+                        max_tokens=_MAX_TOKENS,
+                        temperature=0.0,
+                    )
+                )
+    for index, completion in zip(pending, completions):
+        parsed[index] = _parse_completion(completion)
+    return parsed  # type: ignore[return-value]
+
+
+def parse_eligibility_criteria(criteria_text: str) -> Dict[str, Any]:
+    """
+    Parse free-text eligibility criteria into inclusion / exclusion lists via
+    ``InferenceClient.chat_completion`` (Inference Providers, not legacy hf-inference).
+    """
+    return parse_eligibility_criteria_many([criteria_text])[0]
+
@@ -0,0 +1,80 @@
+"""
+Compact binary storage for embedding vectors.
+
+Embeddings are stored as BSON Binary (user-defined subtype ``0x80``) holding a small
+header followed by packed little-endian values:
+
+    b"TMEB" | dtype code (u8) | ndim (u8) | 2 pad bytes | ndim x u32 shape | data
+
+The header is a multiple of 4 bytes so ``np.frombuffer`` can decode in place without
+copying. Legacy documents that still hold plain arrays of doubles decode through the
+same functions, so readers never need to know which format a document uses.
+"""
+
+from __future__ import annotations
+
+import struct
+from typing import Any
+
+import numpy as np
+from bson.binary import Binary
+
+EMBEDDING_BINARY_SUBTYPE = 0x80
+
+_MAGIC = b"TMEB"
+_HEADER = struct.Struct("<4sBB2x")
+_DTYPES = {1: np.dtype("<f4"), 2: np.dtype("<f2")}
+_DTYPE_CODES = {dtype: code for code, dtype in _DTYPES.items()}
+
+
+def encode_embedding(values: Any, dtype: str = "<f4") -> Binary:
+    """
+    Pack a vector or ``(rows, dim)`` matrix into a BSON Binary.
+    """
+    target = np.dtype(dtype)
+    if target not in _DTYPE_CODES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+    arr = np.ascontiguousarray(np.asarray(values, dtype=target))
+    if arr.ndim == 2 and arr.shape[0] == 0:
+        arr = arr.reshape(0, 0)
+    header = _HEADER.pack(_MAGIC, _DTYPE_CODES[target], arr.ndim)
+    shape = struct.pack(f"<{arr.ndim}I", *arr.shape)
+    return Binary(header + shape + arr.tobytes(), EMBEDDING_BINARY_SUBTYPE)
+
+
+def is_encoded_embedding(value: Any) -> bool:
+    return isinstance(value, (bytes, bytearray)) and bytes(value[:4]) == _MAGIC
+
+
+def decode_embedding(value: Any) -> np.ndarray:
+    """
+    Decode a stored embedding (binary or legacy list) into a float32 array.
+
+    Binary values are decoded with ``np.frombuffer`` and share memory with the
+    stored bytes, so the result is read-only.
+    """
+    if value is None:
+        return np.zeros(0, dtype=np.float32)
+    if not is_encoded_embedding(value):
+        return np.asarray(value, dtype=np.float32)
+
+    _, code, ndim = _HEADER.unpack_from(value, 0)
+    offset = _HEADER.size
+    shape = struct.unpack_from(f"<{ndim}I", value, offset)
+    offset += 4 * ndim
+    dtype = _DTYPES.get(code)
+    if dtype is None:
+        raise ValueError(f"Unknown embedding dtype code: {code}")
+    count = int(np.prod(shape)) if shape else 1
+    arr = np.frombuffer(value, dtype=dtype, count=count, offset=offset).reshape(shape)
+    return arr if dtype == np.float32 else arr.astype(np.float32)
+
+
+def decode_embedding_rows(value: Any) -> np.ndarray:
+    """
+    Decode a stored list of criterion embeddings into a ``(rows, dim)`` matrix.
+    """
+    arr = decode_embedding(value)
+    if arr.size == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    return arr.reshape(1, -1) if arr.ndim == 1 else arr
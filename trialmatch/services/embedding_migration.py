@@ -0,0 +1,157 @@
+"""
+One-off migrations of stored embeddings.
+
+- ``move_criteria_vectors``: criterion vectors embedded in trial documents move to the
+  ``criteria_vectors`` collection (keyed by ``criteria_hash``).
+- ``migrate_embeddings_to_binary``: BSON arrays of doubles become packed binary.
+
+Readers handle every intermediate state, so both can run while the app is serving;
+they only rewrite documents that still need it and are safe to re-run.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Any, Dict, List
+
+from pymongo import UpdateOne
+
+from trialmatch.services.db import (
+    criteria_vectors_collection,
+    patients_collection,
+    trials_collection,
+)
+from trialmatch.services.embedding_codec import (
+    decode_embedding,
+    decode_embedding_rows,
+    encode_embedding,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _flush(coll, ops: List[UpdateOne]) -> int:
+    if not ops:
+        return 0
+    coll.bulk_write(ops, ordered=False)
+    count = len(ops)
+    ops.clear()
+    return count
+
+
+def _binary_rows(value: Any) -> Any:
+    return encode_embedding(decode_embedding_rows(value)) if isinstance(value, list) else value
+
+
+def move_criteria_vectors(batch_size: int = 500) -> Dict[str, Any]:
+    """
+    Move inline ``criteria_embeddings`` from trial documents to ``criteria_vectors``.
+
+    A vector set already stored under the hash (possibly newer, written by live
+    preparation) is kept. Trials without a ``criteria_hash`` are left alone, since
+    their vectors have nowhere to go.
+
+    Returns {"trials_moved": int, "vector_sets": int}.
+    """
+    trials = trials_collection()
+    vectors = criteria_vectors_collection()
+    summary = {"trials_moved": 0, "vector_sets": 0}
+    vector_ops: List[UpdateOne] = []
+    trial_ops: List[UpdateOne] = []
+    seen = set()
+    cursor = trials.find(
+        {"criteria_embeddings": {"$exists": True}},
+        {"criteria_hash": 1, "cache_version": 1, "parsed_criteria": 1,
+         "prepared_at": 1, "criteria_embeddings": 1},
+    )
+    for doc in cursor:
+        criteria_hash = str(doc.get("criteria_hash") or "")
+        embeddings = doc.get("criteria_embeddings") or {}
+        if not criteria_hash:
+            continue
+        if criteria_hash not in seen:
+            seen.add(criteria_hash)
+            vector_ops.append(
+                UpdateOne(
+                    {"_id": criteria_hash},
+                    {
+                        "$setOnInsert": {
+                            "cache_version": doc.get("cache_version") or {},
+                            "parsed_criteria": doc.get("parsed_criteria") or {},
+                            "criteria_embeddings": {
+                                kind: _binary_rows(embeddings.get(kind) or [])
+                                for kind in ("inclusion", "exclusion")
+                            },
+                            "prepared_at": doc.get("prepared_at"),
+                        }
+                    },
+                    upsert=True,
+                )
+            )
+        trial_ops.append(UpdateOne({"_id": doc["_id"]}, {"$unset": {"criteria_embeddings": ""}}))
+        if len(trial_ops) >= batch_size:
+            # Vector sets first, so no trial is ever left without its vectors.
+            summary["vector_sets"] += _flush(vectors, vector_ops)
+            summary["trials_moved"] += _flush(trials, trial_ops)
+    summary["vector_sets"] += _flush(vectors, vector_ops)
+    summary["trials_moved"] += _flush(trials, trial_ops)
+
+    logger.info(
+        "embeddings:criteria_vectors_moved trials=%s vector_sets=%s",
+        summary["trials_moved"],
+        summary["vector_sets"],
+    )
+    return summary
+
+
+def migrate_embeddings_to_binary(batch_size: int = 500) -> Dict[str, Any]:
+    """
+    Re-encode legacy array embeddings in ``criteria_vectors`` and on patients.
+
+    Returns {"trials_migrated": int, "patients_migrated": int}, where
+    ``trials_migrated`` counts re-encoded vector sets.
+    """
+    summary = {"trials_migrated": 0, "patients_migrated": 0}
+
+    trials = criteria_vectors_collection()
+    ops: List[UpdateOne] = []
+    cursor = trials.find(
+        {
+            "$or": [
+                {"criteria_embeddings.inclusion": {"$type": "array"}},
+                {"criteria_embeddings.exclusion": {"$type": "array"}},
+            ]
+        },
+        {"criteria_embeddings": 1},
+    )
+    for doc in cursor:
+        embeddings = doc.get("criteria_embeddings") or {}
+        update = {
+            f"criteria_embeddings.{kind}": _binary_rows(embeddings[kind])
+            for kind in ("inclusion", "exclusion")
+            if isinstance(embeddings.get(kind), list)
+        }
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+        if len(ops) >= batch_size:
+            summary["trials_migrated"] += _flush(trials, ops)
+    summary["trials_migrated"] += _flush(trials, ops)
+
+    patients = patients_collection()
+    cursor = patients.find({"profile_embedding": {"$type": "array"}}, {"profile_embedding": 1})
+    for doc in cursor:
+        ops.append(
+            UpdateOne(
+                {"_id": doc["_id"]},
+                {"$set": {"profile_embedding": encode_embedding(decode_embedding(doc["profile_embedding"]))}},
+            )
+        )
+        if len(ops) >= batch_size:
+            summary["patients_migrated"] += _flush(patients, ops)
+    summary["patients_migrated"] += _flush(patients, ops)
+
+    logger.info(
+        "embeddings:migrated trials=%s patients=%s",
+        summary["trials_migrated"],
+        summary["patients_migrated"],
+    )
+    return summary
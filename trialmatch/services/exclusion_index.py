@@ -0,0 +1,181 @@
+"""
+Catalog-wide exclusion gate.
+
+Every exclusion criterion embedding across the prepared catalog is stacked into
+one row-normalized matrix, so "which exclusion vectors exceed the cut-off for this
+patient" is answered with a few blocked matrix-vector products instead of one
+cosine call per criterion per trial. Trials returned by the gate are disqualified
+before any inclusion scoring runs.
+
+The gate is built once per catalog version and cache version (``get_exclusion_gate``)
+and each request checks only the rows of its own candidate trials.
+``disqualified_by_gate`` uses the catalog gate for candidates whose vector set it
+holds and a small per-request gate for the rest (trials re-prepared since the
+build, or prepared by this very request).
+"""
+
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from trialmatch.services.matching_engine import (
+    EXCLUSION_THRESHOLD,
+    _as_embedding_array,
+    _cosine_similarity,
+)
+from trialmatch.services.prepared_trials import (
+    cache_version_key,
+    criteria_embedding_matrices,
+    load_prepared_catalog,
+    vectors_signature,
+)
+from trialmatch.services.singleflight import SingleFlight
+
+# Similarities this close to the threshold are re-checked with the exact per-pair
+# cosine so the gate agrees with ``calculate_match_score_from_precomputed`` bit for bit.
+_RECHECK_MARGIN = 1e-4
+_DEFAULT_BLOCK_SIZE = 4096
+
+
+class ExclusionGateIndex:
+    """
+    Normalized matrix of exclusion embeddings with a row -> trial ownership map.
+    """
+
+    def __init__(
+        self,
+        trials: Iterable[Tuple[str, Sequence[Sequence[float]]]],
+        block_size: int = _DEFAULT_BLOCK_SIZE,
+    ) -> None:
+        rows: List[np.ndarray] = []
+        owners: List[str] = []
+        # nct_id -> its rows' [start, stop) range; each trial's rows are contiguous.
+        self._ranges: Dict[str, Tuple[int, int]] = {}
+        # nct_id -> ``vectors_signature`` of the vector set indexed, when known.
+        self.signatures: Dict[str, Tuple[str, str]] = {}
+        for nct_id, embeddings in trials:
+            start = len(rows)
+            for values in embeddings if embeddings is not None else []:
+                rows.append(_as_embedding_array(values))
+                owners.append(str(nct_id))
+            self._ranges[str(nct_id)] = (start, len(rows))
+
+        self._block_size = max(1, int(block_size))
+        self._owners = np.array(owners, dtype=object)
+        if rows:
+            self._raw = np.vstack(rows).astype(np.float32, copy=False)
+        else:
+            self._raw = np.zeros((0, 0), dtype=np.float32)
+        norms = np.linalg.norm(self._raw, axis=1, keepdims=True) if rows else None
+        self._unit = self._raw / (norms + 1e-12) if rows else self._raw
+
+    @classmethod
+    def from_prepared_trials(cls, prepared_trials: Iterable[Dict[str, Any]]) -> "ExclusionGateIndex":
+        signatures: Dict[str, Tuple[str, str]] = {}
+
+        def rows():
+            for trial in prepared_trials:
+                signatures[str(trial["nct_id"])] = vectors_signature(trial)
+                yield str(trial["nct_id"]), criteria_embedding_matrices(trial)["exclusion"]
+
+        index = cls(rows())
+        index.signatures = signatures
+        return index
+
+    def __len__(self) -> int:
+        return int(self._raw.shape[0])
+
+    def holds(self, prepared_trial: Dict[str, Any]) -> bool:
+        """True when the index holds exactly the vector set ``prepared_trial`` carries."""
+        signature = self.signatures.get(str(prepared_trial["nct_id"]))
+        return signature is not None and signature == vectors_signature(prepared_trial)
+
+    def _candidate_rows(self, nct_ids: Iterable[str]) -> np.ndarray:
+        ranges = [self._ranges.get(str(nct_id)) for nct_id in dict.fromkeys(nct_ids)]
+        parts = [np.arange(start, stop) for start, stop in filter(None, ranges)]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.intp)
+
+    def disqualified_trials(
+        self,
+        patient_embedding: np.ndarray,
+        threshold: float = EXCLUSION_THRESHOLD,
+        nct_ids: Optional[Iterable[str]] = None,
+    ) -> Set[str]:
+        """
+        Return the ids of trials with at least one exclusion criterion whose cosine
+        similarity to ``patient_embedding`` exceeds ``threshold``. With ``nct_ids``
+        only those trials' rows are checked.
+        """
+        rows = None if nct_ids is None else self._candidate_rows(nct_ids)
+        total = len(self) if rows is None else len(rows)
+        if total == 0:
+            return set()
+
+        patient = _as_embedding_array(patient_embedding)
+        unit_patient = patient / (np.linalg.norm(patient) + 1e-12)
+        disqualified: Set[str] = set()
+        for start in range(0, total, self._block_size):
+            stop = start + self._block_size
+            block = slice(start, stop) if rows is None else rows[start:stop]
+            sims = self._unit[block] @ unit_patient
+            for offset in np.flatnonzero(sims > threshold - _RECHECK_MARGIN):
+                row = start + int(offset) if rows is None else int(block[offset])
+                owner = self._owners[row]
+                if owner in disqualified:
+                    continue
+                if sims[offset] > threshold + _RECHECK_MARGIN or (
+                    _cosine_similarity(patient, self._raw[row]) > threshold
+                ):
+                    disqualified.add(owner)
+        return disqualified
+
+
+_cache_lock = threading.Lock()
+_cached_key: Optional[Tuple[int, str]] = None
+_cached_index: Optional[ExclusionGateIndex] = None
+_builds = SingleFlight()
+
+
+def get_exclusion_gate(catalog_version: int) -> ExclusionGateIndex:
+    """
+    Return the gate over the whole prepared catalog, built once per catalog
+    version and cache version (concurrent callers share one build).
+    """
+    global _cached_key, _cached_index
+    key = (int(catalog_version), cache_version_key())
+    with _cache_lock:
+        if _cached_index is not None and key == _cached_key:
+            return _cached_index
+    index = _builds.do(key, lambda: ExclusionGateIndex.from_prepared_trials(load_prepared_catalog()))
+    with _cache_lock:
+        _cached_key = key
+        _cached_index = index
+    return index
+
+
+def disqualified_by_gate(
+    prepared_trials: Sequence[Dict[str, Any]],
+    patient_embedding: np.ndarray,
+    catalog_version: int,
+) -> Set[str]:
+    """
+    Ids of ``prepared_trials`` disqualified by an exclusion criterion: candidates
+    held by the catalog gate are checked on its rows, the others on a gate built
+    for them alone.
+    """
+    gate = get_exclusion_gate(catalog_version)
+    held: List[str] = []
+    others: List[Dict[str, Any]] = []
+    for trial in prepared_trials:
+        if gate.holds(trial):
+            held.append(str(trial["nct_id"]))
+        else:
+            others.append(trial)
+    disqualified = gate.disqualified_trials(patient_embedding, nct_ids=held)
+    if others:
+        extra = ExclusionGateIndex.from_prepared_trials(others)
+        disqualified |= extra.disqualified_trials(patient_embedding)
+    return disqualified
@@ -0,0 +1,171 @@
+"""
+Hedged calls across interchangeable inference backends.
+
+``HedgedCaller.call`` starts the backend with the lowest latency EWMA first. If it
+has not answered after that backend's recent p95 latency (clamped to
+``HEDGE_MIN_DELAY_MS``..``HEDGE_MAX_DELAY_MS``), the same call is sent to the next
+backend and whichever answers first wins. A failure starts the next backend at
+once. Every completed attempt, including a losing one that finishes later, feeds
+its backend's latency statistics; failures count as ``max_delay_s``. A backend
+that is consistently faster therefore becomes the first choice.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import logging
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from trialmatch.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyStats:
+    """EWMA and windowed p95 of one backend's latencies."""
+
+    def __init__(self, alpha: float = 0.2, window: int = 200) -> None:
+        self._alpha = alpha
+        self._samples: Deque[float] = deque(maxlen=window)
+        self.ewma: Optional[float] = None
+
+    def record(self, latency_s: float) -> None:
+        self._samples.append(latency_s)
+        if self.ewma is None:
+            self.ewma = latency_s
+        else:
+            self.ewma += self._alpha * (latency_s - self.ewma)
+
+    def p95(self) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+
+class HedgedCaller:
+    """
+    Runs one logical call against named backends with latency-based hedging.
+    """
+
+    def __init__(self, min_delay_s: float, max_delay_s: float, max_workers: int = 16) -> None:
+        self._min_delay_s = max(0.0, float(min_delay_s))
+        self._max_delay_s = max(self._min_delay_s, float(max_delay_s))
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+        self._latency: Dict[str, LatencyStats] = {}
+        self._stats = {"calls": 0, "hedged": 0, "hedge_wins": 0}
+
+    def _order(self, names: List[str]) -> List[str]:
+        with self._lock:
+            ewma = {name: self._latency.setdefault(name, LatencyStats()).ewma for name in names}
+        # Unmeasured backends keep their given order, after measured faster ones.
+        return sorted(
+            names,
+            key=lambda name: (ewma[name] is None, ewma[name] or 0.0, names.index(name)),
+        )
+
+    def hedge_delay(self, name: str) -> float:
+        with self._lock:
+            p95 = self._latency.setdefault(name, LatencyStats()).p95()
+        if p95 is None:
+            return self._max_delay_s
+        return min(self._max_delay_s, max(self._min_delay_s, p95))
+
+    def _start(self, name: str, attempt: Callable[[], Any]) -> Future:
+        started = time.monotonic()
+
+        def run() -> Any:
+            try:
+                result = attempt()
+            except Exception:
+                self._record(name, self._max_delay_s)
+                raise
+            self._record(name, time.monotonic() - started)
+            return result
+
+        return self._executor.submit(run)
+
+    def _record(self, name: str, latency_s: float) -> None:
+        with self._lock:
+            self._latency.setdefault(name, LatencyStats()).record(latency_s)
+
+    def call(self, attempts: Dict[str, Callable[[], Any]]) -> Any:
+        """
+        ``attempts`` maps backend name to a zero-argument call; returns the first
+        successful result, or raises the last error when every backend failed.
+        """
+        order = self._order(list(attempts))
+        with self._lock:
+            self._stats["calls"] += 1
+        pending: Dict[Future, str] = {}
+        last_error: Optional[BaseException] = None
+
+        launched = 0
+
+        def launch() -> None:
+            nonlocal launched
+            name = order[launched]
+            launched += 1
+            pending[self._start(name, attempts[name])] = name
+
+        launch()
+        while pending:
+            can_hedge = launched < len(order)
+            timeout = self.hedge_delay(order[0]) if can_hedge else None
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # The call is slow: hedge with the next backend.
+                launch()
+                with self._lock:
+                    self._stats["hedged"] += 1
+                continue
+            for future in done:
+                name = pending.pop(future)
+                error = future.exception()
+                if error is None:
+                    for loser in pending:
+                        loser.cancel()
+                    if name != order[0]:
+                        with self._lock:
+                            self._stats["hedge_wins"] += 1
+                    return future.result()
+                last_error = error
+                logger.warning("hedge:attempt_failed backend=%s error=%s", name, error)
+            if not pending and launched < len(order):
+                launch()
+        raise last_error  # type: ignore[misc]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._stats)
+            out["backends"] = {
+                name: {"ewma_s": stats.ewma, "p95_s": stats.p95()}
+                for name, stats in self._latency.items()
+            }
+        return out
+
+
+_hedgers: Dict[str, HedgedCaller] = {}
+_hedgers_lock = threading.Lock()
+
+
+def get_hedger(role: str) -> HedgedCaller:
+    """Process-wide hedger for ``role`` ("embedding", "ner"), created on first use."""
+    with _hedgers_lock:
+        hedger = _hedgers.get(role)
+        if hedger is None:
+            hedger = _hedgers[role] = HedgedCaller(
+                min_delay_s=settings.hedge_min_delay_ms / 1000.0,
+                max_delay_s=settings.hedge_max_delay_ms / 1000.0,
+            )
+    return hedger
+
+
+def hedger_stats() -> Dict[str, Dict[str, Any]]:
+    with _hedgers_lock:
+        hedgers = dict(_hedgers)
+    return {role: hedger.stats() for role, hedger in hedgers.items()}
@@ -0,0 +1,167 @@
+"""
+Shared HTTP transport for the hosted inference clients.
+
+``huggingface_hub`` sends every ``InferenceClient`` request through one process-wide
+HTTP client built by a client factory. ``install_pooled_transport`` swaps in a
+factory whose client keeps a bounded pool of keep-alive connections (one TLS
+handshake per connection rather than per call) and retries individual HTTP calls
+that fail transiently: 429 and 5xx responses and connection/read errors. Retries
+use full-jitter exponential backoff and wait at least as long as a ``Retry-After``
+header asks, capped at ``HF_BACKOFF_MAX_S``.
+"""
+
+from __future__ import annotations
+
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import logging
+import random
+import threading
+import time
+from typing import Optional
+import uuid
+
+import huggingface_hub
+from huggingface_hub import constants
+from huggingface_hub.errors import OfflineModeIsEnabled
+
+try:  # huggingface_hub 2.x ships on the httpx2 fork, 1.x on httpx.
+    import httpx2 as httpx
+except ImportError:  # pragma: no cover - depends on the installed hub version
+    import httpx
+
+from trialmatch.config import settings
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+
+def parse_retry_after(value: Optional[str], now: Optional[datetime] = None) -> Optional[float]:
+    """Seconds requested by a ``Retry-After`` header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = now or datetime.now(timezone.utc)
+    return max(0.0, (when - now).total_seconds())
+
+
+def backoff_delay(
+    attempt: int,
+    base_s: float,
+    max_s: float,
+    retry_after_s: Optional[float] = None,
+) -> float:
+    """Full-jitter exponential delay before retry ``attempt`` (0-based)."""
+    delay = random.uniform(0.0, min(max_s, base_s * (2 ** attempt)))
+    if retry_after_s is not None:
+        delay = max(delay, min(max_s, retry_after_s))
+    return delay
+
+
+class RetryTransport(httpx.BaseTransport):
+    """
+    Wraps a transport and retries transient failures of single HTTP calls.
+    """
+
+    def __init__(
+        self,
+        inner: httpx.BaseTransport,
+        max_retries: int,
+        backoff_base_s: float,
+        backoff_max_s: float,
+    ) -> None:
+        self._inner = inner
+        self._max_retries = max(0, int(max_retries))
+        self._backoff_base_s = float(backoff_base_s)
+        self._backoff_max_s = float(backoff_max_s)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            try:
+                response = self._inner.handle_request(request)
+            except httpx.TransportError as exc:
+                if attempt >= self._max_retries:
+                    raise
+                delay = backoff_delay(attempt, self._backoff_base_s, self._backoff_max_s)
+                logger.warning(
+                    "http:retry url=%s attempt=%s error=%s delay_s=%.2f",
+                    request.url.path,
+                    attempt + 1,
+                    type(exc).__name__,
+                    delay,
+                )
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self._max_retries:
+                    return response
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                response.close()
+                delay = backoff_delay(
+                    attempt, self._backoff_base_s, self._backoff_max_s, retry_after
+                )
+                logger.warning(
+                    "http:retry url=%s attempt=%s status=%s delay_s=%.2f",
+                    request.url.path,
+                    attempt + 1,
+                    response.status_code,
+                    delay,
+                )
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self) -> None:
+        self._inner.close()
+
+
+def request_hook(request: httpx.Request) -> None:
+    """Honor ``HF_HUB_OFFLINE`` and tag each request with an id, like the hub's own client."""
+    if constants.HF_HUB_OFFLINE:
+        raise OfflineModeIsEnabled(f"Cannot reach {request.url}: offline mode is enabled.")
+    if "X-Amzn-Trace-Id" not in request.headers:
+        request.headers["X-Amzn-Trace-Id"] = request.headers.get("X-Request-Id") or str(
+            uuid.uuid4()
+        )
+
+
+def pooled_client_factory() -> httpx.Client:
+    """``huggingface_hub`` client factory: pooled keep-alive transport with retries."""
+    transport = RetryTransport(
+        httpx.HTTPTransport(
+            limits=httpx.Limits(
+                max_connections=settings.hf_pool_connections,
+                max_keepalive_connections=settings.hf_pool_connections,
+                keepalive_expiry=60.0,
+            ),
+        ),
+        max_retries=settings.hf_max_retries,
+        backoff_base_s=settings.hf_backoff_base_s,
+        backoff_max_s=settings.hf_backoff_max_s,
+    )
+    return httpx.Client(
+        transport=transport,
+        event_hooks={"request": [request_hook]},
+        follow_redirects=True,
+        timeout=httpx.Timeout(settings.hf_timeout_s, connect=10.0),
+    )
+
+
+_installed = False
+_install_lock = threading.Lock()
+
+
+def install_pooled_transport() -> None:
+    """Route all ``huggingface_hub`` HTTP calls through ``pooled_client_factory`` (once)."""
+    global _installed
+    with _install_lock:
+        if not _installed:
+            huggingface_hub.set_client_factory(pooled_client_factory)
+            _installed = True
@@ -7,14 +7,21 @@ We load:
 - d4data/biomedical-ner-all                          -> NER (hf-inference router)
 
 Models are expensive to load, so we lazily initialize them once per
-serverless container and cache them in module-level globals.
+serverless container and cache them in module-level globals (creation is
+serialized by a lock). Hosted clients share the pooled, retrying HTTP transport
+from ``trialmatch.services.http_transport``. With ``DEV_LOCAL_INFERENCE`` and
+``MODEL_SERVER_SOCKET`` set, local models are served by one shared process
+(``trialmatch.services.model_server``) instead of being loaded per worker.
 """
 
 from __future__ import annotations
 
+from collections import OrderedDict
+import copy
 import os
+import threading
 from types import SimpleNamespace
-from typing import Any
+from typing import Any, Callable, Dict, TypeVar
 
 # Legacy serverless host returns 410; NER/embeddings use the hf-inference router path.
 _DEFAULT_HF_INFERENCE_BASE = "https://router.huggingface.co/hf-inference"
@@ -22,8 +29,13 @@ if not os.environ.get("HF_INFERENCE_ENDPOINT", "").strip():
     os.environ["HF_INFERENCE_ENDPOINT"] = _DEFAULT_HF_INFERENCE_BASE
 
 from huggingface_hub import InferenceClient
+import numpy as np
 
 from trialmatch.config import settings
+from trialmatch.services.concurrency import provider_slot
+from trialmatch.services.hedging import get_hedger
+from trialmatch.services.http_transport import install_pooled_transport
+from trialmatch.services.model_server import ModelServerClient
 
 _reasoning_client: InferenceClient | None = None
 _embedding_client: InferenceClient | None = None
@@ -31,6 +43,11 @@ _ner_client: InferenceClient | None = None
 _local_reasoning_client: Any | None = None
 _local_embedding_client: Any | None = None
 _local_ner_client: Any | None = None
+_secondary_clients: Dict[str, Any] = {}
+_clients_lock = threading.RLock()
+
+NER_MODEL = "d4data/biomedical-ner-all"
+R = TypeVar("R")
 
 
 def _local_model_id(model_name: str) -> str:
@@ -44,26 +61,178 @@ def _local_model_id(model_name: str) -> str:
     return (model_name or "").strip().split(":", 1)[0]
 
 
+def json_object_closed(text: str) -> bool:
+    """True once the first JSON object in ``text`` has been closed."""
+    depth = 0
+    in_string = escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"' and depth:
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}" and depth:
+            depth -= 1
+            if depth == 0:
+                return True
+    return False
+
+
+def _common_prefix_length(rows: list[list[int]]) -> int:
+    length = min(len(row) for row in rows)
+    for column in range(length):
+        token = rows[0][column]
+        if any(row[column] != token for row in rows[1:]):
+            return column
+    return length
+
+
 class _LocalReasoningClient:
+    """
+    Local causal LM for eligibility parsing. Prompts are generated in batches
+    (``chat_completion_batch``); the attention keys/values of the prompt prefix
+    shared by a batch, or with the previous call, are computed once and kept in a
+    small LRU so the instruction preamble is not re-encoded for every trial.
+    Generation of a row stops once its JSON object closes.
+    """
+
     def __init__(self) -> None:
         try:
             import torch
-            from transformers import AutoTokenizer, pipeline
+            from transformers import AutoModelForCausalLM, AutoTokenizer, StoppingCriteria
         except ImportError as exc:
             raise RuntimeError(
                 "DEV_LOCAL_INFERENCE is enabled, but local inference dependencies are "
                 "missing. Install with: pip install transformers torch"
             ) from exc
 
+        self._torch = torch
+        if settings.local_torch_threads > 0:
+            torch.set_num_threads(settings.local_torch_threads)
         tok = settings.hf_token or None
         local_model_id = _local_model_id(settings.dev_local_reasoning_model)
-        self._pipeline = pipeline(
-            "text-generation",
-            model=local_model_id,
-            tokenizer=AutoTokenizer.from_pretrained(local_model_id, token=tok),
-            token=tok,
-            device=0 if torch.cuda.is_available() else -1,
+        self._tokenizer = AutoTokenizer.from_pretrained(local_model_id, token=tok)
+        if self._tokenizer.pad_token_id is None:
+            self._tokenizer.pad_token = self._tokenizer.eos_token
+        self._model = AutoModelForCausalLM.from_pretrained(local_model_id, token=tok)
+        self._model.to(torch.device("cuda" if torch.cuda.is_available() else "cpu"))
+        self._model.eval()
+        self._prefix_cache: "OrderedDict[tuple[int, ...], Any]" = OrderedDict()
+        self._last_prompt_ids: list[int] = []
+        # One generate() at a time: the model and prefix cache are shared.
+        self._lock = threading.Lock()
+
+        tokenizer = self._tokenizer
+
+        class JsonClosed(StoppingCriteria):
+            def __init__(self, prompt_length: int) -> None:
+                self.prompt_length = prompt_length
+
+            def __call__(self, input_ids: Any, scores: Any, **kwargs: Any) -> Any:
+                texts = tokenizer.batch_decode(
+                    input_ids[:, self.prompt_length:], skip_special_tokens=True
+                )
+                return torch.tensor(
+                    [json_object_closed(text) for text in texts], device=input_ids.device
+                )
+
+        self._stopping_criterion = JsonClosed
+
+    @staticmethod
+    def _prompt(messages: list[dict[str, str]]) -> str:
+        user_text = "\n".join(m.get("content", "") for m in messages if m.get("role") == "user")
+        return f"[INST]{user_text}[/INST]"
+
+    def _prefix_kv(self, prefix: tuple[int, ...]) -> Any:
+        """Key/value cache of ``prefix`` (computed once, LRU-bounded)."""
+        cached = self._prefix_cache.get(prefix)
+        if cached is not None:
+            self._prefix_cache.move_to_end(prefix)
+            return cached
+        from transformers import DynamicCache
+
+        cache = DynamicCache()
+        input_ids = self._torch.tensor([list(prefix)], device=self._model.device)
+        with self._torch.inference_mode():
+            self._model(input_ids=input_ids, past_key_values=cache, use_cache=True)
+        self._prefix_cache[prefix] = cache
+        while len(self._prefix_cache) > max(1, settings.local_llm_prefix_cache_size):
+            self._prefix_cache.popitem(last=False)
+        return cache
+
+    def _shared_prefix(self, rows: list[list[int]]) -> tuple[int, ...]:
+        # Reuse a cached prefix of every row, else the prefix the rows share with
+        # each other or with the previous call; each row keeps one token of its own.
+        limit = min(len(row) for row in rows) - 1
+        for prefix in reversed(self._prefix_cache):
+            if len(prefix) <= limit and all(tuple(row[: len(prefix)]) == prefix for row in rows):
+                return prefix
+        candidates = rows + ([self._last_prompt_ids] if self._last_prompt_ids else [])
+        length = min(_common_prefix_length(candidates), limit) if len(candidates) > 1 else 0
+        if length < settings.local_llm_min_prefix_tokens:
+            return ()
+        return tuple(rows[0][:length])
+
+    def _generate(self, prompts: list[str], max_tokens: int, temperature: float) -> list[str]:
+        torch = self._torch
+        rows = [self._tokenizer(prompt)["input_ids"] for prompt in prompts]
+        prefix = self._shared_prefix(rows)
+        self._last_prompt_ids = rows[-1]
+        # Suffixes are left-padded after the shared prefix; the mask hides the pads.
+        suffixes = [row[len(prefix):] for row in rows]
+        width = max(len(suffix) for suffix in suffixes)
+        pad = self._tokenizer.pad_token_id
+        input_ids = torch.tensor(
+            [list(prefix) + [pad] * (width - len(s)) + s for s in suffixes],
+            device=self._model.device,
+        )
+        attention_mask = torch.tensor(
+            [[1] * len(prefix) + [0] * (width - len(s)) + [1] * len(s) for s in suffixes],
+            device=self._model.device,
         )
+        kwargs: Dict[str, Any] = {
+            "max_new_tokens": max_tokens,
+            "do_sample": temperature > 0,
+            "pad_token_id": pad,
+            "stopping_criteria": [self._stopping_criterion(input_ids.shape[1])],
+        }
+        if temperature > 0:
+            kwargs["temperature"] = temperature
+        if prefix:
+            cache = copy.deepcopy(self._prefix_kv(prefix))
+            if len(rows) > 1:
+                cache.batch_repeat_interleave(len(rows))
+            kwargs["past_key_values"] = cache
+        with torch.inference_mode():
+            output = self._model.generate(
+                input_ids=input_ids, attention_mask=attention_mask, **kwargs
+            )
+        return self._tokenizer.batch_decode(
+            output[:, input_ids.shape[1]:], skip_special_tokens=True
+        )
+
+    def chat_completion_batch(
+        self,
+        conversations: list[list[dict[str, str]]],
+        max_tokens: int = 512,
+        temperature: float = 0.1,
+    ) -> list[Any]:
+        prompts = [self._prompt(messages) for messages in conversations]
+        texts: list[str] = []
+        step = max(1, settings.local_llm_batch_size)
+        with self._lock:
+            for start in range(0, len(prompts), step):
+                texts.extend(self._generate(prompts[start:start + step], max_tokens, temperature))
+        return [
+            SimpleNamespace(choices=[SimpleNamespace(message={"content": text})])
+            for text in texts
+        ]
 
     def chat_completion(
         self,
@@ -71,21 +240,17 @@ class _LocalReasoningClient:
         max_tokens: int = 512,
         temperature: float = 0.1,
     ) -> Any:
-        user_text = "\n".join(m.get("content", "") for m in messages if m.get("role") == "user")
-        prompt = f"[INST]{user_text}[/INST]"
-        outputs = self._pipeline(
-            prompt,
-            max_new_tokens=max_tokens,
-            do_sample=temperature > 0,
-            temperature=temperature if temperature > 0 else None,
-        )
-        text = outputs[0].get("generated_text", "") if outputs else ""
-        return SimpleNamespace(
-            choices=[SimpleNamespace(message={"content": text})]
-        )
+        return self.chat_completion_batch([messages], max_tokens, temperature)[0]
 
 
 class _LocalEmbeddingClient:
+    """
+    Local embedding model that mean-pools inside the wrapper (over the attention
+    mask, so padded batches pool like single texts) and returns float32 NumPy rows.
+    On CPU it optionally applies dynamic int8 quantization to the linear layers
+    (``LOCAL_EMBEDDING_QUANTIZE``) and uses ``LOCAL_TORCH_THREADS`` intra-op threads.
+    """
+
     def __init__(self) -> None:
         try:
             import torch
@@ -97,25 +262,54 @@ class _LocalEmbeddingClient:
             ) from exc
 
         self._torch = torch
+        if settings.local_torch_threads > 0:
+            torch.set_num_threads(settings.local_torch_threads)
         tok = settings.hf_token or None
         local_model_id = _local_model_id(settings.hf_embedding_model)
         self._tokenizer = AutoTokenizer.from_pretrained(local_model_id, token=tok)
-        self._model = AutoModel.from_pretrained(local_model_id, token=tok)
-        self._model.to(torch.device("cuda" if torch.cuda.is_available() else "cpu"))
-        self._model.eval()
+        model = AutoModel.from_pretrained(local_model_id, token=tok)
+        model.eval()
+        if torch.cuda.is_available():
+            model.to(torch.device("cuda"))
+        elif settings.local_embedding_quantize:
+            model = torch.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        self._model = model
+        self._device = next(model.parameters()).device
+
+    def embed(self, texts: list[str]) -> Any:
+        """``(len(texts), hidden)`` float32 array of masked mean-pooled embeddings."""
+        torch = self._torch
+        # Similar lengths share a forward pass, so little compute goes to padding.
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        out: list[Any] = [None] * len(texts)
+        step = max(1, settings.local_embedding_batch_size)
+        for start in range(0, len(order), step):
+            chunk = order[start:start + step]
+            inputs = self._tokenizer(
+                [texts[i] for i in chunk],
+                return_tensors="pt",
+                truncation=True,
+                padding=True,
+                max_length=512,
+            )
+            inputs = {k: v.to(self._device) for k, v in inputs.items()}
+            with torch.inference_mode():
+                hidden = self._model(**inputs).last_hidden_state
+                mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1.0)
+            for i, row in zip(chunk, pooled.float().cpu().numpy()):
+                out[i] = row
+        if not out:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack(out).astype(np.float32, copy=False)
 
     def feature_extraction(self, text: str) -> Any:
-        inputs = self._tokenizer(
-            text,
-            return_tensors="pt",
-            truncation=True,
-            padding=True,
-            max_length=512,
-        )
-        inputs = {k: v.to(self._model.device) for k, v in inputs.items()}
-        with self._torch.no_grad():
-            outputs = self._model(**inputs)
-        return outputs.last_hidden_state.detach().cpu().tolist()
+        return self.embed([text])[0]
+
+    def feature_extraction_batch(self, texts: list[str]) -> Any:
+        return self.embed(list(texts))
 
 
 class _LocalNerClient:
@@ -130,7 +324,7 @@ class _LocalNerClient:
             ) from exc
         self._pipeline = pipeline(
             "ner",
-            model="d4data/biomedical-ner-all",
+            model=NER_MODEL,
             token=settings.hf_token or None,
             aggregation_strategy="simple",
             device=0 if torch.cuda.is_available() else -1,
@@ -139,6 +333,24 @@ class _LocalNerClient:
     def token_classification(self, text: str) -> Any:
         return self._pipeline(text)
 
+    def token_classification_batch(self, texts: list[str]) -> list[Any]:
+        return self._pipeline(list(texts), batch_size=max(1, settings.ner_batch_size))
+
+
+def _local_client(role: str) -> Any:
+    """
+    Local model for ``role``: a shim to the shared model server when
+    ``MODEL_SERVER_SOCKET`` is set, otherwise the model loaded in this process.
+    """
+    if settings.model_server_socket:
+        return ModelServerClient(settings.model_server_socket, settings.model_server_timeout_s)
+    factories = {
+        "reasoning": _LocalReasoningClient,
+        "embedding": _LocalEmbeddingClient,
+        "ner": _LocalNerClient,
+    }
+    return factories[role]()
+
 
 def get_reasoning_client() -> InferenceClient:
     """
@@ -149,18 +361,21 @@ def get_reasoning_client() -> InferenceClient:
     ``HF_REASONING_MODEL`` / ``HF_LLM_PROVIDER`` in the environment instead.
     """
     global _reasoning_client, _local_reasoning_client
-    if settings.dev_local_inference:
-        if _local_reasoning_client is None:
-            _local_reasoning_client = _LocalReasoningClient()
-        return _local_reasoning_client
-    if _reasoning_client is None:
-        tok = settings.hf_token or None
-        _reasoning_client = InferenceClient(
-            provider=settings.hf_llm_provider,
-            model=settings.hf_reasoning_model,
-            token=tok,
-        )
-    return _reasoning_client
+    with _clients_lock:
+        if settings.dev_local_inference:
+            if _local_reasoning_client is None:
+                _local_reasoning_client = _local_client("reasoning")
+            return _local_reasoning_client
+        if _reasoning_client is None:
+            install_pooled_transport()
+            tok = settings.hf_token or None
+            _reasoning_client = InferenceClient(
+                provider=settings.hf_llm_provider,
+                model=settings.hf_reasoning_model,
+                token=tok,
+                timeout=settings.hf_timeout_s,
+            )
+        return _reasoning_client
 
 
 def get_embedding_client() -> InferenceClient:
@@ -168,17 +383,20 @@ def get_embedding_client() -> InferenceClient:
     Lazy getter for the biomedical feature-extraction client.
     """
     global _embedding_client, _local_embedding_client
-    if settings.dev_local_inference:
-        if _local_embedding_client is None:
-            _local_embedding_client = _LocalEmbeddingClient()
-        return _local_embedding_client
-    if _embedding_client is None:
-        _embedding_client = InferenceClient(
-            provider="hf-inference",
-            model=settings.hf_embedding_model,
-            token=settings.hf_token or None,
-        )
-    return _embedding_client
+    with _clients_lock:
+        if settings.dev_local_inference:
+            if _local_embedding_client is None:
+                _local_embedding_client = _local_client("embedding")
+            return _local_embedding_client
+        if _embedding_client is None:
+            install_pooled_transport()
+            _embedding_client = InferenceClient(
+                provider="hf-inference",
+                model=settings.hf_embedding_model,
+                token=settings.hf_token or None,
+                timeout=settings.hf_timeout_s,
+            )
+        return _embedding_client
 
 
 def get_ner_client() -> InferenceClient:
@@ -186,15 +404,90 @@ def get_ner_client() -> InferenceClient:
     Lazy getter for the biomedical NER client.
     """
     global _ner_client, _local_ner_client
+    with _clients_lock:
+        if settings.dev_local_inference:
+            if _local_ner_client is None:
+                _local_ner_client = _local_client("ner")
+            return _local_ner_client
+        if _ner_client is None:
+            install_pooled_transport()
+            _ner_client = InferenceClient(
+                provider="hf-inference",
+                model=NER_MODEL,
+                token=settings.hf_token or None,
+                timeout=settings.hf_timeout_s,
+            )
+        return _ner_client
+
+
+def inference_slot(role: str):
+    """
+    Context manager to hold around one hosted call for ``role`` ("reasoning",
+    "embedding" or "ner"). Calls to the same provider share one adaptive
+    concurrency limit; local inference is not limited.
+    """
     if settings.dev_local_inference:
-        if _local_ner_client is None:
-            _local_ner_client = _LocalNerClient()
-        return _local_ner_client
-    if _ner_client is None:
-        _ner_client = InferenceClient(
-            provider="hf-inference",
-            model="d4data/biomedical-ner-all",
-            token=settings.hf_token or None,
-        )
-    return _ner_client
+        return provider_slot(None)
+    provider = settings.hf_llm_provider if role == "reasoning" else "hf-inference"
+    return provider_slot(provider)
+
+
+def get_secondary_client(role: str) -> Any | None:
+    """
+    Hedge backend for ``role`` ("embedding" or "ner"): the local model when
+    ``HEDGE_SECONDARY_BACKEND=local``, otherwise the same model on that provider.
+    ``None`` when hedging is off or the secondary would equal the primary.
+
+    Embeddings are only hedged from the hosted model to the same model on another
+    hosted provider: local vectors (own pooling, optional int8) live in a different
+    space and would be persisted as trial and patient vectors under the hosted
+    cache version.
+    """
+    backend = settings.hedge_secondary_backend
+    if not settings.hedge_enabled or not backend or role not in ("embedding", "ner"):
+        return None
+    if role == "embedding" and (backend == "local" or settings.dev_local_inference):
+        return None
+    if backend == "local" and settings.dev_local_inference:
+        return None
+    if backend == "hf-inference" and not settings.dev_local_inference:
+        return None
+    with _clients_lock:
+        client = _secondary_clients.get(role)
+        if client is None:
+            if backend == "local":
+                client = _local_client(role)
+            else:
+                install_pooled_transport()
+                client = InferenceClient(
+                    provider=backend,
+                    model=settings.hf_embedding_model if role == "embedding" else NER_MODEL,
+                    token=settings.hf_token or None,
+                    timeout=settings.hf_timeout_s,
+                )
+            _secondary_clients[role] = client
+        return client
+
+
+def call_backend(role: str, client: Any, op: Callable[[Any], R], hedge: bool = True) -> R:
+    """
+    ``op(client)`` inside the role's concurrency slot. With hedging enabled (and
+    ``hedge`` true) a slow call is duplicated to ``get_secondary_client(role)``
+    and the first answer wins (see ``trialmatch.services.hedging``).
+    """
+    secondary = get_secondary_client(role) if hedge else None
+
+    def on_primary() -> R:
+        with inference_slot(role):
+            return op(client)
+
+    if secondary is None:
+        return on_primary()
+
+    backend = settings.hedge_secondary_backend
+
+    def on_secondary() -> R:
+        with provider_slot(None if backend == "local" else backend):
+            return op(secondary)
 
+    return get_hedger(role).call({"primary": on_primary, backend: on_secondary})
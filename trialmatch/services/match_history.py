@@ -0,0 +1,205 @@
+"""
+Match history: recording runs, the latest-match pointer and retention.
+
+Every run is still inserted into ``matches``, and a copy of it is written to the
+patient document as ``latest_match`` so detail pages and reports read the newest
+result without sorting the history. After each run the patient's older runs are
+compacted off the request path (after the write-behind flush, or on a background
+worker when write-behind is disabled): a run outside both the newest ``MATCH_HISTORY_KEEP_RUNS`` runs and the
+last ``MATCH_HISTORY_KEEP_DAYS`` days keeps its metadata, trial count and best few
+trials, and drops the full ``trials`` list. The newest run is never compacted.
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import partial
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import PyMongoError
+
+from trialmatch.config import settings
+from trialmatch.services.db import matches_collection, patients_collection
+from trialmatch.services.write_behind import get_write_behind, persist
+
+logger = logging.getLogger(__name__)
+
+# Trials kept on a compacted run, best first.
+SUMMARY_TOP_TRIALS = 3
+
+_executor: Optional[ThreadPoolExecutor] = None
+_pending: Set[str] = set()
+_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="match-compaction")
+    return _executor
+
+
+def _compact_in_background(patient_id: str) -> None:
+    """Queue the patient's compaction on the background worker (once while queued)."""
+    with _lock:
+        if patient_id in _pending:
+            return
+        _pending.add(patient_id)
+    _get_executor().submit(_run_compaction, patient_id)
+
+
+def _run_compaction(patient_id: str) -> None:
+    with _lock:
+        _pending.discard(patient_id)
+    try:
+        compact_match_history(patient_id)
+    except PyMongoError as exc:
+        logger.warning("matches:compaction_failed patient_id=%s error=%s", patient_id, exc)
+
+
+def public_match_doc(match_doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of ``match_doc`` with its ObjectId rendered as a string for JSON."""
+    doc = dict(match_doc)
+    if "_id" in doc:
+        doc["_id"] = str(doc["_id"])
+    return doc
+
+
+def record_match(match_doc: Dict[str, Any]) -> None:
+    """
+    Insert ``match_doc`` (its ``_id`` is set in place), point the patient's
+    ``latest_match`` at it and apply the retention policy. With write-behind
+    enabled this only queues the writes and compaction runs once they are written;
+    otherwise the writes are inline and compaction is left to a background worker.
+    """
+    match_doc.setdefault("_id", ObjectId())
+    patient_id = match_doc["patient_id"]
+    compact = None
+    if settings.match_history_compaction:
+        # After the flush on the writer thread; never inline on the request path.
+        inline = get_write_behind() is None
+        compact = partial(_compact_in_background if inline else compact_match_history, patient_id)
+    persist(matches_collection, [InsertOne(dict(match_doc))])
+    # Only move the pointer forward, in case an older run finishes last.
+    persist(
+        patients_collection,
+        [
+            UpdateOne(
+                {
+                    "patient_id": patient_id,
+                    "$or": [
+                        {"latest_match.created_at": {"$lte": match_doc["created_at"]}},
+                        {"latest_match": {"$exists": False}},
+                    ],
+                },
+                {"$set": {"latest_match": dict(match_doc)}},
+            )
+        ],
+        then=compact,
+    )
+
+
+def compaction_candidates(
+    runs: List[Dict[str, Any]],
+    keep_runs: int,
+    keep_days: float,
+    now: Optional[datetime] = None,
+) -> List[Any]:
+    """
+    Ids of ``runs`` (newest first, with ``_id``/``created_at``/``compacted``) that
+    fall outside both retention windows and are not compacted yet.
+    """
+    now = now or datetime.now(timezone.utc)
+    cutoff = (now - timedelta(days=keep_days)).isoformat() if keep_days > 0 else None
+    out = []
+    for rank, run in enumerate(runs):
+        if rank < max(1, keep_runs) or run.get("compacted"):
+            continue
+        if cutoff is not None and str(run.get("created_at") or "") >= cutoff:
+            continue
+        out.append(run["_id"])
+    return out
+
+
+def compact_match_history(patient_id: str) -> int:
+    """
+    Compact the patient's runs that fall outside the retention policy; returns how
+    many runs were compacted.
+    """
+    coll = matches_collection()
+    runs = list(
+        coll.find(
+            {"patient_id": patient_id},
+            {"_id": 1, "created_at": 1, "compacted": 1},
+        ).sort("created_at", -1)
+    )
+    ids = compaction_candidates(
+        runs,
+        keep_runs=settings.match_history_keep_runs,
+        keep_days=settings.match_history_keep_days,
+    )
+    if not ids:
+        return 0
+    # Pipeline update: summarized on the server, no trial lists are transferred.
+    coll.update_many(
+        {"_id": {"$in": ids}},
+        [
+            {
+                "$set": {
+                    "compacted": True,
+                    "trial_count": {"$size": {"$ifNull": ["$trials", []]}},
+                    "top_trials": {"$slice": [{"$ifNull": ["$trials", []]}, SUMMARY_TOP_TRIALS]},
+                }
+            },
+            {"$unset": "trials"},
+        ],
+    )
+    logger.info("matches:compacted patient_id=%s runs=%s", patient_id, len(ids))
+    return len(ids)
+
+
+def newest_match_run(patient_id: str) -> Optional[Dict[str, Any]]:
+    """Newest run from the history itself (for patients without ``latest_match``)."""
+    cursor = matches_collection().find({"patient_id": patient_id}).sort("created_at", -1).limit(1)
+    return next(iter(cursor), None)
+
+
+def latest_match_for_patient(patient_id: str) -> Optional[Dict[str, Any]]:
+    """
+    The patient's newest match document, read from the ``latest_match`` pointer.
+    Patients matched before the pointer existed fall back to the sorted history.
+    """
+    patient = patients_collection().find_one(
+        {"patient_id": patient_id},
+        {"_id": 0, "latest_match": 1},
+    )
+    if patient and patient.get("latest_match"):
+        return public_match_doc(patient["latest_match"])
+
+    latest = newest_match_run(patient_id)
+    return public_match_doc(latest) if latest else None
+
+
+def backfill_match_history() -> Dict[str, int]:
+    """
+    Set ``latest_match`` for patients matched before the pointer existed and apply
+    the retention policy to every patient's history.
+    """
+    summary = {"patients": 0, "pointers_set": 0, "runs_compacted": 0}
+    for patient_id in matches_collection().distinct("patient_id"):
+        summary["patients"] += 1
+        latest = newest_match_run(patient_id)
+        if latest:
+            result = patients_collection().update_one(
+                {"patient_id": patient_id, "latest_match": {"$exists": False}},
+                {"$set": {"latest_match": latest}},
+            )
+            summary["pointers_set"] += result.modified_count
+        summary["runs_compacted"] += compact_match_history(patient_id)
+    return summary
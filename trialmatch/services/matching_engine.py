@@ -9,20 +9,26 @@ This module centralizes:
 
 from __future__ import annotations
 
-from typing import Dict, Any, List, Sequence
+import hashlib
+import threading
+from typing import Dict, Any, List, Optional, Sequence
 
 import numpy as np
 
-from trialmatch.services.llm_models import get_embedding_client
+from trialmatch.config import settings
+from trialmatch.services.llm_models import call_backend, get_embedding_client
+from trialmatch.services.micro_batcher import MicroBatcher
+from trialmatch.services.singleflight import SingleFlight
 
+# Cosine cut-offs used by ``calculate_match_score_from_precomputed``.
+EXCLUSION_THRESHOLD = 0.82
+STRONG_INCLUSION_THRESHOLD = 0.68
+WEAK_INCLUSION_THRESHOLD = 0.6
+# Bump whenever thresholds or penalties change so cached pair scores are not reused.
+SCORING_VERSION = "1"
 
-def get_embedding(text: str) -> np.ndarray:
-    """
-    Compute a pooled embedding for the given text using BioLinkBERT via
-    the Hugging Face Inference API (feature-extraction).
-    """
-    client = get_embedding_client()
-    features = client.feature_extraction(text)
+
+def _pool_features(features: Any) -> np.ndarray:
     arr = np.array(features, dtype=np.float32)
     # Shape may be [seq_len, hidden] or [1, seq_len, hidden]; reduce to 1D
     if arr.ndim == 3:
@@ -32,8 +38,100 @@ def get_embedding(text: str) -> np.ndarray:
     return arr
 
 
+def embed_batch(texts: List[str]) -> List[np.ndarray]:
+    """
+    Pooled embeddings for ``texts`` from one feature-extraction call. Local
+    backends take the batch through ``feature_extraction_batch`` and pool over the
+    attention mask themselves; hosted ones take list input.
+    """
+    client = get_embedding_client()
+    if len(texts) == 1:
+        features = call_backend("embedding", client, lambda c: c.feature_extraction(texts[0]))
+        return [_pool_features(features)]
+
+    def extract(c: Any) -> Any:
+        batch = getattr(c, "feature_extraction_batch", None)
+        return batch(texts) if batch is not None else c.feature_extraction(texts)
+
+    features = call_backend("embedding", client, extract)
+    # One entry per input: [hidden] when the model pools, else [seq_len, hidden].
+    return [_pool_features(row) for row in features]
+
+
+_embedding_batcher: Optional[MicroBatcher] = None
+_embedding_batcher_lock = threading.Lock()
+# Identical texts requested while one is being embedded share that request.
+_embedding_flights = SingleFlight()
+
+
+def _text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def get_embedding_batcher() -> Optional[MicroBatcher]:
+    """
+    Lazy getter for the process-wide embedding micro-batcher; ``None`` when
+    ``EMBEDDING_BATCHING`` is off.
+    """
+    global _embedding_batcher
+    if not settings.embedding_batching:
+        return None
+    with _embedding_batcher_lock:
+        if _embedding_batcher is None:
+            _embedding_batcher = MicroBatcher(
+                embed_batch,
+                max_batch=settings.embedding_batch_max,
+                max_wait_s=settings.embedding_batch_wait_ms / 1000.0,
+                name="embedding-batcher",
+                max_concurrency=_embedding_batch_concurrency(),
+            )
+    return _embedding_batcher
+
+
+def _embedding_batch_concurrency() -> int:
+    # Local models (in-process or on the model server) must not run concurrently.
+    if settings.dev_local_inference:
+        return 1
+    return settings.embedding_batch_concurrency or settings.hf_pool_connections
+
+
+def get_embeddings(texts: Sequence[str]) -> List[np.ndarray]:
+    """
+    Pooled embeddings for several texts; they join the shared micro-batches so
+    concurrent callers are served by as few backend calls as possible.
+    """
+    texts = list(texts)
+    if not texts:
+        return []
+    batcher = get_embedding_batcher()
+    if batcher is None:
+        return [
+            _embedding_flights.do(_text_key(text), lambda text=text: embed_batch([text])[0])
+            for text in texts
+        ]
+    futures = [
+        _embedding_flights.share(_text_key(text), lambda text=text: batcher.submit(text))
+        for text in texts
+    ]
+    timeout = settings.embedding_result_timeout_s
+    return [future.result(timeout=timeout) for future in futures]
+
+
+def get_embedding(text: str) -> np.ndarray:
+    """
+    Compute a pooled embedding for the given text using BioLinkBERT via
+    the Hugging Face Inference API (feature-extraction).
+    """
+    return get_embeddings([text])[0]
+
+
 def _as_embedding_array(values: Sequence[float] | np.ndarray) -> np.ndarray:
-    return np.array(values, dtype=np.float32)
+    return np.asarray(values, dtype=np.float32)
+
+
+def _criterion_rows(values: Any) -> Sequence[Any]:
+    # Criterion embeddings arrive as lists of lists or as decoded (rows, dim) arrays.
+    return [] if values is None else values
 
 
 def _cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
@@ -41,45 +139,42 @@ def _cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
     return float(np.dot(a, b) / denom)
 
 
-def calculate_match_score_from_precomputed(
+def _has_exclusion_hit(
     patient_embedding: np.ndarray,
-    trial_criteria: Dict[str, Any],
-) -> float:
-    """
-    Calculate a 0-100 match score using a precomputed patient embedding and trial
-    criteria cache of the form:
-    {
-        "inclusion": [...],
-        "exclusion": [...],
-        "inclusion_embeddings": [[...], ...],
-        "exclusion_embeddings": [[...], ...],
-    }
-    """
-    score = 100.0
-
-    exclusions: List[Sequence[float]] = trial_criteria.get("exclusion_embeddings") or []
+    exclusions: Sequence[Any],
+) -> bool:
     for embedding_values in exclusions:
         criterion_embedding = _as_embedding_array(embedding_values)
         # Be conservative about semantic exclusions. Compact patient summaries can look
         # spuriously similar to broad exclusion bullets such as "pregnancy" or "COPD".
-        if _cosine_similarity(patient_embedding, criterion_embedding) > 0.82:
-            return 0.0
+        if _cosine_similarity(patient_embedding, criterion_embedding) > EXCLUSION_THRESHOLD:
+            return True
+    return False
 
-    inclusions: List[Sequence[float]] = trial_criteria.get("inclusion_embeddings") or []
-    if not inclusions:
+
+def _inclusion_score(
+    patient_embedding: np.ndarray,
+    inclusions: Sequence[Any],
+    prune_at: Optional[float],
+) -> float:
+    if len(inclusions) == 0:
         return 50.0
 
+    score = 100.0
     strong_matches = 0
     for embedding_values in inclusions:
         criterion_embedding = _as_embedding_array(embedding_values)
         similarity = _cosine_similarity(patient_embedding, criterion_embedding)
-        if similarity >= 0.68:
+        if similarity >= STRONG_INCLUSION_THRESHOLD:
             strong_matches += 1
             continue
-        if similarity >= 0.6:
+        if similarity >= WEAK_INCLUSION_THRESHOLD:
             score -= 8.0
         else:
             score -= 15.0
+        # Penalties only accumulate, so the running score bounds the final one.
+        if prune_at is not None and score <= prune_at:
+            return max(0.0, score)
 
     if strong_matches == 0:
         score -= 10.0
@@ -87,6 +182,115 @@ def calculate_match_score_from_precomputed(
     return max(0.0, min(100.0, score))
 
 
+def calculate_match_score_from_precomputed(
+    patient_embedding: np.ndarray,
+    trial_criteria: Dict[str, Any],
+    prune_at: Optional[float] = None,
+) -> float:
+    """
+    Calculate a 0-100 match score using a precomputed patient embedding and trial
+    criteria cache of the form:
+    {
+        "inclusion": [...],
+        "exclusion": [...],
+        "inclusion_embeddings": [[...], ...],
+        "exclusion_embeddings": [[...], ...],
+    }
+
+    With ``prune_at`` set, inclusions are evaluated first and scoring stops as soon
+    as the best achievable score falls to ``prune_at`` or below; that upper bound is
+    returned instead of the exact score. Scores above ``prune_at`` are always exact.
+    """
+    exclusions = _criterion_rows(trial_criteria.get("exclusion_embeddings"))
+    if prune_at is None and _has_exclusion_hit(patient_embedding, exclusions):
+        return 0.0
+
+    inclusions = _criterion_rows(trial_criteria.get("inclusion_embeddings"))
+    score = _inclusion_score(patient_embedding, inclusions, prune_at)
+    if prune_at is not None and score > prune_at:
+        if _has_exclusion_hit(patient_embedding, exclusions):
+            return 0.0
+    return score
+
+
+# Vectorized similarities within this distance of a cut-off are recomputed with the
+# scalar ``_cosine_similarity`` so bulk scoring classifies every pair exactly like
+# ``calculate_match_score_from_precomputed``.
+_THRESHOLD_RECHECK_MARGIN = 1e-4
+
+
+def _embedding_matrix(values: Any) -> np.ndarray:
+    if values is None or len(values) == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    matrix = np.asarray(values, dtype=np.float32)
+    return matrix.reshape(1, -1) if matrix.ndim == 1 else matrix
+
+
+def unit_rows(matrix: np.ndarray) -> np.ndarray:
+    """Row-normalize an ``(n, dim)`` embedding matrix."""
+    return matrix / (np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12)
+
+
+def _similarity_matrix(
+    patients: np.ndarray,
+    unit_patients: np.ndarray,
+    criteria: np.ndarray,
+) -> np.ndarray:
+    sims = unit_patients @ unit_rows(criteria).T
+    near = np.zeros(sims.shape, dtype=bool)
+    for threshold in (WEAK_INCLUSION_THRESHOLD, STRONG_INCLUSION_THRESHOLD, EXCLUSION_THRESHOLD):
+        near |= np.abs(sims - threshold) <= _THRESHOLD_RECHECK_MARGIN
+    for row, col in np.argwhere(near):
+        sims[row, col] = _cosine_similarity(patients[row], criteria[col])
+    return sims
+
+
+def calculate_match_scores_for_patients(
+    patient_embeddings: np.ndarray,
+    trial_criteria: Dict[str, Any],
+    unit_patients: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Score one trial against many patients at once.
+
+    ``patient_embeddings`` is an ``(n, dim)`` matrix; ``trial_criteria`` has the same
+    shape as for ``calculate_match_score_from_precomputed``. Callers that score many
+    trials against the same patients can pass ``unit_rows(patient_embeddings)`` as
+    ``unit_patients`` to skip re-normalizing. Returns ``n`` scores identical to calling
+    the scalar function once per patient row.
+    """
+    patients = _embedding_matrix(patient_embeddings)
+    count = patients.shape[0]
+    if count == 0:
+        return np.zeros(0, dtype=np.float64)
+    if unit_patients is None:
+        unit_patients = unit_rows(patients)
+
+    exclusions = _embedding_matrix(trial_criteria.get("exclusion_embeddings"))
+    inclusions = _embedding_matrix(trial_criteria.get("inclusion_embeddings"))
+    stacked = [block for block in (exclusions, inclusions) if block.size]
+    if not stacked:
+        return np.full(count, 50.0)
+    # One pass over all of the trial's criteria: exclusion columns first.
+    all_sims = _similarity_matrix(patients, unit_patients, np.vstack(stacked))
+    num_exclusions = exclusions.shape[0] if exclusions.size else 0
+
+    excluded = (all_sims[:, :num_exclusions] > EXCLUSION_THRESHOLD).any(axis=1)
+    if not inclusions.size:
+        scores = np.full(count, 50.0)
+    else:
+        sims = all_sims[:, num_exclusions:]
+        strong = sims >= STRONG_INCLUSION_THRESHOLD
+        weak = (sims >= WEAK_INCLUSION_THRESHOLD) & ~strong
+        missed = sims < WEAK_INCLUSION_THRESHOLD
+        scores = 100.0 - 8.0 * weak.sum(axis=1) - 15.0 * missed.sum(axis=1)
+        scores = scores - 10.0 * (strong.sum(axis=1) == 0)
+        scores = np.clip(scores, 0.0, 100.0)
+
+    scores[excluded] = 0.0
+    return scores
+
+
 def calculate_match_score(patient_profile: Dict[str, Any], trial_criteria: Dict[str, Any]) -> float:
     """
     Calculate a 0–100 match score between a patient profile and parsed trial criteria.
@@ -10,35 +10,49 @@ This module ties together:
 
 from __future__ import annotations
 
+from dataclasses import replace
 from datetime import datetime, timezone
 import hashlib
 import logging
 import time
 from typing import Dict, Any, List, Literal, Optional
 
-from trialmatch.services.db import patients_collection, matches_collection
+from pymongo import UpdateOne
+
+from trialmatch.services.db import patients_collection
 from trialmatch.services.trial_repository import (
+    current_catalog_version,
     load_random_trials_data,
     load_target_trials_data,
 )
 from trialmatch.services.matching_engine import (
-    calculate_match_score_from_precomputed,
     get_embedding,
     np,
 )
-from trialmatch.services.prepared_trials import ensure_trial_prepared
+from trialmatch.services.background_preparation import queue_trial_preparation
+from trialmatch.services.embedding_codec import encode_embedding
+from trialmatch.services.prepared_trials import (
+    criteria_embedding_matrices,
+    embedding_version,
+    ensure_trials_prepared,
+)
+from trialmatch.services.exclusion_index import disqualified_by_gate
+from trialmatch.services.match_history import latest_match_for_patient, record_match
+from trialmatch.services.patient_repository import PatientReadModel, load_patient_read_model
+from trialmatch.services.quantized_index import quantized_scores
+from trialmatch.services.ranking import rank_trials
+from trialmatch.services.rerank import RerankBudget, rerank_shortlist
+from trialmatch.services.score_cache import get_score_cache, pair_cache_key
+from trialmatch.services.singleflight import SingleFlight
+from trialmatch.services.write_behind import persist
 from trialmatch.config import settings
 
 
 MatchMode = Literal["demo", "random"]
 logger = logging.getLogger(__name__)
 
-
-def _get_patient_profile(patient_id: str) -> Optional[Dict[str, Any]]:
-    doc = patients_collection().find_one({"patient_id": patient_id})
-    if not doc:
-        return None
-    return doc.get("profile") or {}
+# Identical match requests arriving while one is running share its result.
+_match_flights = SingleFlight()
 
 
 def _patient_summary_hash(profile: Dict[str, Any]) -> str:
@@ -46,70 +60,165 @@ def _patient_summary_hash(profile: Dict[str, Any]) -> str:
     return hashlib.sha256(summary.encode("utf-8")).hexdigest()
 
 
-def _get_patient_embedding(patient_id: str, profile: Dict[str, Any]) -> np.ndarray:
+def _get_patient_embedding(patient: PatientReadModel) -> np.ndarray:
+    profile = patient.profile
     summary = str(profile.get("text_summary") or "").strip()
     if not summary:
         return np.array([], dtype=np.float32)
 
+    # Reuse the stored vector only if it embeds this summary with the current model.
     summary_hash = _patient_summary_hash(profile)
-    doc = patients_collection().find_one(
-        {"patient_id": patient_id},
-        {"profile_embedding": 1, "profile_embedding_hash": 1},
-    )
-    cached_hash = str((doc or {}).get("profile_embedding_hash") or "")
-    cached_embedding = (doc or {}).get("profile_embedding")
-    if cached_hash == summary_hash and isinstance(cached_embedding, list) and cached_embedding:
-        return np.array(cached_embedding, dtype=np.float32)
+    version = embedding_version()
+    if (
+        patient.embedding_hash == summary_hash
+        and patient.embedding_version == version
+        and patient.embedding.size
+    ):
+        return patient.embedding
 
+    patient_id = patient.patient_id
     embedding = get_embedding(summary)
-    patients_collection().update_one(
-        {"patient_id": patient_id},
-        {
-            "$set": {
-                "profile_embedding_hash": summary_hash,
-                "profile_embedding": embedding.tolist(),
-            }
-        },
+    persist(
+        patients_collection,
+        [
+            UpdateOne(
+                {"patient_id": patient_id},
+                {
+                    "$set": {
+                        "profile_embedding_hash": summary_hash,
+                        "profile_embedding_version": version,
+                        "profile_embedding": encode_embedding(embedding),
+                    }
+                },
+            )
+        ],
     )
     return embedding
 
 
+def _prepare_trials(
+    trials_df: Any,
+    patient_id: str = "-",
+    deadline: Optional[float] = None,
+    skipped: Optional[List[str]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Ensure every trial in ``trials_df`` has cached criteria and embeddings; trials
+    without inclusion criteria cannot be scored and are dropped. With a
+    ``deadline``, trials that could not be prepared in time are dropped too and
+    their NCT ids appended to ``skipped``.
+    """
+    prepared_trials: List[Dict[str, Any]] = []
+    t0 = time.perf_counter()
+    trial_docs = [trial.to_dict() for _, trial in trials_df.iterrows()]
+    not_ready: List[str] = []
+    prepared_docs = ensure_trials_prepared(trial_docs, deadline=deadline, skipped=not_ready)
+    logger.info(
+        "matching:prepare:done patient_id=%s trials=%s skipped=%s elapsed_s=%.2f",
+        patient_id,
+        len(trial_docs),
+        len(not_ready),
+        time.perf_counter() - t0,
+    )
+    if skipped is not None:
+        skipped.extend(not_ready)
+    not_ready_ids = set(not_ready)
+    for prepared_trial in prepared_docs:
+        nct_id = str(prepared_trial["nct_id"])
+        if nct_id in not_ready_ids:
+            continue
+        parsed_criteria = prepared_trial.get("parsed_criteria") or {}
+        inclusion_embeddings = criteria_embedding_matrices(prepared_trial)["inclusion"]
+        if not parsed_criteria.get("inclusion") or not len(inclusion_embeddings):
+            logger.info(
+                "matching:score:skip_no_inclusion patient_id=%s nct_id=%s",
+                patient_id,
+                nct_id,
+            )
+            continue
+        prepared_trials.append(prepared_trial)
+    return prepared_trials
+
+
 def run_matching_for_patient(
     patient_id: str,
     mode: MatchMode = "demo",
     num_trials: Optional[int] = None,
+    top_k: Optional[int] = None,
+    deadline_s: Optional[float] = None,
+    rerank: Optional[RerankBudget] = None,
 ) -> Dict[str, Any]:
     """
     Run the full matching pipeline for a single patient.
 
+    ``top_k`` keeps only the best ``top_k`` trials; trials that cannot reach them are
+    pruned without a full evaluation (see ``trialmatch.services.ranking``).
+
+    ``deadline_s`` is a time budget in seconds. Trials that are already prepared
+    are always scored; trials whose criteria still need parsing/embedding are only
+    prepared while budget remains. The others are queued for background
+    preparation and the document is marked ``"partial": true`` with their NCT ids
+    in ``"pending_trials"``.
+
+    Trials scored with outdated cached criteria while a background refresh rebuilds
+    them (``TRIAL_CACHE_SERVE_STALE``) are listed in ``"stale_trials"``.
+
+    ``rerank`` sends the top ``rerank.k`` ranked trials to the reasoning model and
+    re-scores them per the budget's blending policy (see
+    ``trialmatch.services.rerank``); the stage's counters are in ``"rerank"``.
+
+    Concurrent calls with the same arguments against the same catalog version
+    are coalesced into one run and receive the same document.
+
     Returns a document of the form:
     {
         "patient_id": "...",
         "mode": "...",
         "created_at": "...",
+        "catalog_version": 0,
         "trials": [
             {"nct_id": "...", "title": "...", "score": 0-100},
             ...
         ],
     }
     """
-    profile = _get_patient_profile(patient_id)
+    deadline = time.monotonic() + deadline_s if deadline_s else None
+    key = (patient_id, mode, num_trials, top_k, deadline_s, rerank, current_catalog_version())
+    return _match_flights.do(
+        key, lambda: _run_matching(patient_id, mode, num_trials, top_k, deadline, rerank)
+    )
+
+
+def _run_matching(
+    patient_id: str,
+    mode: MatchMode,
+    num_trials: Optional[int],
+    top_k: Optional[int],
+    deadline: Optional[float],
+    rerank: Optional[RerankBudget] = None,
+) -> Dict[str, Any]:
+    # Profile and stored embedding in one read.
+    patient = load_patient_read_model(patient_id, with_embedding=True, with_latest_match=False)
+    profile = patient.profile if patient else None
     if not profile:
         raise ValueError(f"Patient '{patient_id}' not found or has no profile.")
 
     started = time.perf_counter()
     logger.info(
-        "matching:start patient_id=%s mode=%s num_trials=%s",
+        "matching:start patient_id=%s mode=%s num_trials=%s top_k=%s",
         patient_id,
         mode,
         num_trials,
+        top_k,
     )
 
-    patient_embedding = _get_patient_embedding(patient_id, profile)
+    patient_embedding = _get_patient_embedding(patient)
     if patient_embedding.size == 0:
         raise RuntimeError("Patient profile has no summary text for embedding.")
 
     # --- Select trials to analyze ---
+    # Read before loading trials so a concurrent upload is picked up by delta matching.
+    catalog_version = current_catalog_version()
     if mode == "demo":
         trials_df = load_target_trials_data()
     else:
@@ -122,67 +231,147 @@ def run_matching_for_patient(
 
     logger.info("matching:trials_selected patient_id=%s count=%s", patient_id, len(trials_df))
 
-    # --- Compute scores ---
-    results: List[Dict[str, Any]] = []
-    for _, trial in trials_df.iterrows():
-        nct_id = str(trial["nct_id"])
-        t0 = time.perf_counter()
-        prepared_trial = ensure_trial_prepared(trial.to_dict())
+    pending_trials: List[str] = []
+    prepared_trials = _prepare_trials(trials_df, patient_id, deadline, pending_trials)
+    if pending_trials:
+        queue_trial_preparation(pending_trials)
         logger.info(
-            "matching:prepare:done patient_id=%s nct_id=%s elapsed_s=%.2f",
+            "matching:deadline_partial patient_id=%s pending=%s",
             patient_id,
-            nct_id,
-            time.perf_counter() - t0,
-        )
-
-        parsed_criteria = prepared_trial.get("parsed_criteria") or {}
-        criteria_embeddings = prepared_trial.get("criteria_embeddings") or {}
-        if not parsed_criteria.get("inclusion") or not criteria_embeddings.get("inclusion"):
-            logger.info(
-                "matching:score:skip_no_inclusion patient_id=%s nct_id=%s",
-                patient_id,
-                nct_id,
-            )
-            continue
-        t1 = time.perf_counter()
-        logger.info("matching:score:start patient_id=%s nct_id=%s", patient_id, nct_id)
-        score = calculate_match_score_from_precomputed(
-            patient_embedding,
-            {
-                "inclusion_embeddings": criteria_embeddings.get("inclusion") or [],
-                "exclusion_embeddings": criteria_embeddings.get("exclusion") or [],
-            },
+            len(pending_trials),
         )
+    stale_trials = [str(trial["nct_id"]) for trial in prepared_trials if trial.get("stale")]
+    if stale_trials:
         logger.info(
-            "matching:score:done patient_id=%s nct_id=%s score=%.2f elapsed_s=%.2f",
+            "matching:stale_cache patient_id=%s stale=%s",
             patient_id,
-            nct_id,
-            score,
-            time.perf_counter() - t1,
+            len(stale_trials),
         )
-        if score <= 0:
-            continue
 
-        title = prepared_trial.get("brief_title") or nct_id
-        results.append(
+    # --- Exclusion gate: drop disqualified trials before any inclusion work ---
+    t_gate = time.perf_counter()
+    disqualified = disqualified_by_gate(prepared_trials, patient_embedding, catalog_version)
+    logger.info(
+        "matching:exclusion_gate patient_id=%s disqualified=%s elapsed_s=%.2f",
+        patient_id,
+        len(disqualified),
+        time.perf_counter() - t_gate,
+    )
+
+    # --- Compute scores and rank (descending, ties in catalog order) ---
+    t_rank = time.perf_counter()
+    patient_hash = _patient_summary_hash(profile)
+    cache_keys: Dict[str, str] = {}
+    candidates: List[Dict[str, Any]] = []
+    candidate_trials: Dict[str, Dict[str, Any]] = {}
+    for prepared_trial in prepared_trials:
+        nct_id = str(prepared_trial["nct_id"])
+        if nct_id in disqualified:
+            continue
+        candidate_trials[nct_id] = prepared_trial
+        cache_keys[nct_id] = pair_cache_key(
+            patient_hash,
+            str(prepared_trial.get("criteria_hash") or ""),
+            prepared_trial.get("cache_version") or {},
+        )
+        candidates.append(
             {
                 "nct_id": nct_id,
-                "title": title,
-                "score": float(round(score, 2)),
+                "title": prepared_trial.get("brief_title") or nct_id,
+                # Decoded below only for candidates left without a score.
+                "inclusion_embeddings": None,
+                # Exclusions were already applied exactly by the gate above.
+                "exclusion_embeddings": [],
             }
         )
 
-    # Sort descending by score
-    results.sort(key=lambda x: x["score"], reverse=True)
+    score_cache = get_score_cache()
+    cached_scores = score_cache.get_many(cache_keys.values()) if score_cache else {}
+    for candidate in candidates:
+        candidate["cached_score"] = cached_scores.get(cache_keys[candidate["nct_id"]])
+
+    exact_scores: Dict[str, float] = {}
+    unscored = [candidate for candidate in candidates if candidate["cached_score"] is None]
+    if settings.embedding_quantization and unscored:
+        # Quantized first pass scores the unscored candidates exactly in one sweep over
+        # the catalog index; float32 rows are decoded only for rows it rescores.
+        stats: Dict[str, int] = {}
+        scores = quantized_scores(
+            [candidate_trials[candidate["nct_id"]] for candidate in unscored],
+            patient_embedding,
+            catalog_version,
+            settings.embedding_quantization,
+            stats=stats,
+        )
+        for candidate in unscored:
+            candidate["cached_score"] = scores[candidate["nct_id"]]
+            exact_scores[candidate["nct_id"]] = candidate["cached_score"]
+        logger.info(
+            "matching:quantized_pass patient_id=%s dtype=%s rows=%s rescored=%s",
+            patient_id,
+            settings.embedding_quantization,
+            stats.get("rows", 0),
+            stats.get("rescored", 0),
+        )
+    for candidate in candidates:
+        if candidate["cached_score"] is None:
+            candidate["inclusion_embeddings"] = criteria_embedding_matrices(
+                candidate_trials[candidate["nct_id"]]
+            )["inclusion"]
+    results = rank_trials(patient_embedding, candidates, top_k=top_k, exact_scores=exact_scores)
+    if score_cache and exact_scores:
+        score_cache.put_many({cache_keys[nct_id]: score for nct_id, score in exact_scores.items()})
+    logger.info(
+        "matching:score:done patient_id=%s candidates=%s cache_hits=%s computed=%s elapsed_s=%.2f",
+        patient_id,
+        len(candidates),
+        len(cached_scores),
+        len(exact_scores),
+        time.perf_counter() - t_rank,
+    )
+
+    rerank_stats: Dict[str, Any] = {}
+    if rerank is not None and results:
+        if deadline is not None:
+            # The rerank budget never outlasts the request's own deadline.
+            remaining = max(0.0, deadline - time.monotonic())
+            rerank = replace(rerank, time_budget_s=min(rerank.time_budget_s, remaining))
+        results = rerank_shortlist(
+            results,
+            {str(trial["nct_id"]): trial for trial in prepared_trials},
+            str(profile.get("text_summary") or "").strip(),
+            patient_hash,
+            rerank,
+            stats=rerank_stats,
+        )
+        logger.info(
+            "matching:rerank patient_id=%s policy=%s judged=%s cached=%s skipped=%s elapsed_s=%.2f",
+            patient_id,
+            rerank.policy,
+            rerank_stats["judged"],
+            rerank_stats["cached"],
+            rerank_stats["skipped"],
+            rerank_stats["elapsed_s"],
+        )
 
     match_doc = {
         "patient_id": patient_id,
         "mode": mode,
         "created_at": datetime.now(timezone.utc).isoformat(),
+        "catalog_version": catalog_version,
         "trials": results,
     }
+    if top_k is not None:
+        match_doc["top_k"] = int(top_k)
+    if pending_trials:
+        match_doc["partial"] = True
+        match_doc["pending_trials"] = pending_trials
+    if stale_trials:
+        match_doc["stale_trials"] = stale_trials
+    if rerank_stats:
+        match_doc["rerank"] = rerank_stats
 
-    matches_collection().insert_one(match_doc)
+    record_match(match_doc)
     logger.info(
         "matching:done patient_id=%s mode=%s matched_trials=%s elapsed_s=%.2f",
         patient_id,
@@ -191,7 +380,7 @@ def run_matching_for_patient(
         time.perf_counter() - started,
     )
     # Convert ObjectId to string for API response
-    match_doc["_id"] = str(match_doc.get("_id", ""))  # may be absent in memory
+    match_doc["_id"] = str(match_doc["_id"])
     return match_doc
 
 
@@ -199,15 +388,5 @@ def latest_matches_for_patient(patient_id: str) -> Optional[Dict[str, Any]]:
     """
     Fetch the most recent match document for a patient, if any.
     """
-    doc = (
-        matches_collection()
-        .find({"patient_id": patient_id})
-        .sort("created_at", -1)
-        .limit(1)
-    )
-    latest = next(iter(doc), None)
-    if not latest:
-        return None
-    latest["_id"] = str(latest["_id"])
-    return latest
+    return latest_match_for_patient(patient_id)
 
@@ -0,0 +1,147 @@
+"""
+Dynamic micro-batching of concurrent single-item calls.
+
+``MicroBatcher`` collects items submitted from any thread for up to ``max_wait_s``
+after the first one arrives (or until ``max_batch`` items are waiting), hands them
+to ``batch_fn`` as one list, and resolves each caller's ``Future`` with its own
+row. Under concurrent load the per-call overhead of a backend (HTTP round trip,
+model forward pass) is paid once per batch instead of once per item; a lone
+caller waits at most ``max_wait_s`` extra.
+
+One thread collects batches; up to ``max_concurrency`` batches run at once on a
+worker pool (size it to the backend's connection pool so the adaptive limiter
+still sees real concurrency). While every worker is busy, waiting items gather
+into the next, larger batch. ``max_concurrency=1`` keeps ``batch_fn`` on a single
+thread, for models that must not be called concurrently.
+
+If a batch call fails, its items are retried one by one (on the same worker) so a
+single bad input only fails its own caller.
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import Future, ThreadPoolExecutor
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Generic, List, Sequence, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    Batches ``submit(item)`` calls into ``batch_fn(items) -> results`` calls.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[T]], Sequence[R]],
+        max_batch: int,
+        max_wait_s: float,
+        name: str = "batcher",
+        max_concurrency: int = 1,
+    ) -> None:
+        self._batch_fn = batch_fn
+        self._max_batch = max(1, int(max_batch))
+        self._max_wait_s = max(0.0, float(max_wait_s))
+        self._name = name
+        self._queue: "queue.Queue[Tuple[T, Future]]" = queue.Queue()
+        self._max_concurrency = max(1, int(max_concurrency))
+        self._slots = threading.Semaphore(self._max_concurrency)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._max_concurrency, thread_name_prefix=f"{name}-worker"
+        )
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "items": 0,
+            "batches": 0,
+            "largest_batch": 0,
+            "batch_failures": 0,
+            "in_flight": 0,
+            "max_in_flight": 0,
+        }
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item: T) -> "Future[R]":
+        future: "Future[R]" = Future()
+        self._queue.put((item, future))
+        return future
+
+    def submit_many(self, items: Sequence[T]) -> List["Future[R]"]:
+        return [self.submit(item) for item in items]
+
+    def _collect(self) -> List[Tuple[T, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self._max_wait_s
+        while len(batch) < self._max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(
+                    self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+        return batch
+
+    def _dispatch(self, batch: List[Tuple[T, Future]]) -> None:
+        items = [item for item, _ in batch]
+        try:
+            results = list(self._batch_fn(items))
+            if len(results) != len(items):
+                raise RuntimeError(
+                    f"{self._name}: batch returned {len(results)} rows for {len(items)} inputs"
+                )
+        except Exception as exc:  # noqa: BLE001 - surfaced through the futures
+            if len(batch) == 1:
+                batch[0][1].set_exception(exc)
+                return
+            with self._stats_lock:
+                self._stats["batch_failures"] += 1
+            logger.warning("%s:batch_failed size=%s error=%s", self._name, len(batch), exc)
+            for pair in batch:
+                self._dispatch([pair])
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def _run_batch(self, batch: List[Tuple[T, Future]]) -> None:
+        try:
+            self._dispatch(batch)
+        except Exception as exc:  # noqa: BLE001 - never leave callers waiting
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+        finally:
+            with self._stats_lock:
+                self._stats["in_flight"] -= 1
+            self._slots.release()
+
+    def _run(self) -> None:
+        while True:
+            # Wait for a free worker first: items keep queueing meanwhile and form
+            # the next batch.
+            self._slots.acquire()
+            batch = self._collect()
+            with self._stats_lock:
+                self._stats["items"] += len(batch)
+                self._stats["batches"] += 1
+                self._stats["largest_batch"] = max(self._stats["largest_batch"], len(batch))
+                self._stats["in_flight"] += 1
+                self._stats["max_in_flight"] = max(
+                    self._stats["max_in_flight"], self._stats["in_flight"]
+                )
+            try:
+                self._executor.submit(self._run_batch, batch)
+            except RuntimeError:
+                # Interpreter shutdown: run it here rather than strand the callers.
+                self._run_batch(batch)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return dict(self._stats)
@@ -0,0 +1,356 @@
+"""
+Shared local model server for ``DEV_LOCAL_INFERENCE`` deployments.
+
+Without it every web worker process loads its own copies of the local reasoning,
+embedding and NER models. ``ModelServer`` loads them once in a separate process
+(``python -m trialmatch.cli model-server``) and answers requests over a Unix
+socket; ``ModelServerClient`` exposes the same ``chat_completion``,
+``feature_extraction`` and ``token_classification`` methods as the in-process
+local clients, so ``llm_models`` hands it out when ``MODEL_SERVER_SOCKET`` is set.
+
+Requests from all connections are micro-batched per model role (see
+``trialmatch.services.micro_batcher``), so every operation on a model, single or
+``*_batch``, runs on that role's one batch thread and the model and its tokenizer
+are never used from two threads at once. Within a batch, single-text requests go
+to the model's ``<op>_batch(texts)`` in one call when it has one, otherwise they
+run one after another. Chat requests with the same generation settings share one
+``chat_completion_batch`` call.
+
+Wire format: each message is a 4-byte big-endian length followed by UTF-8 JSON.
+Requests are ``{"op": ..., "args": {...}}``; replies are ``{"ok": true,
+"result": ...}`` or ``{"ok": false, "error": "..."}``.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+from trialmatch.services.micro_batcher import MicroBatcher
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct(">I")
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+# Operation -> model role it runs on.
+OPERATIONS = {
+    "chat_completion": "reasoning",
+    "chat_completion_batch": "reasoning",
+    "feature_extraction": "embedding",
+    "feature_extraction_batch": "embedding",
+    "token_classification": "ner",
+    "token_classification_batch": "ner",
+}
+
+
+def _jsonable(value: Any) -> Any:
+    """Model outputs (numpy scalars/arrays included) as plain JSON types."""
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return value
+
+
+def _completion_content(completion: Any) -> Dict[str, Any]:
+    return {"content": completion.choices[0].message["content"]}
+
+
+def _completion(result: Dict[str, Any]) -> Any:
+    return SimpleNamespace(choices=[SimpleNamespace(message={"content": result["content"]})])
+
+
+def send_message(sock: socket.socket, payload: Dict[str, Any]) -> None:
+    data = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    chunks: List[bytes] = []
+    remaining = size
+    while remaining:
+        chunk = sock.recv(min(remaining, 1024 * 1024))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_message(sock: socket.socket) -> Optional[Dict[str, Any]]:
+    """Next message from ``sock``; ``None`` when the peer closed the connection."""
+    header = _recv_exact(sock, _HEADER.size)
+    if header is None:
+        return None
+    (size,) = _HEADER.unpack(header)
+    if size > MAX_MESSAGE_BYTES:
+        raise ValueError(f"model server message of {size} bytes exceeds the limit")
+    data = _recv_exact(sock, size)
+    if data is None:
+        return None
+    return json.loads(data.decode("utf-8"))
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    # Every web worker thread may connect at once.
+    request_queue_size = 128
+
+
+def _default_loaders() -> Dict[str, Callable[[], Any]]:
+    # Imported here: llm_models imports this module for the client.
+    from trialmatch.services.llm_models import (
+        _LocalEmbeddingClient,
+        _LocalNerClient,
+        _LocalReasoningClient,
+    )
+
+    return {
+        "reasoning": _LocalReasoningClient,
+        "embedding": _LocalEmbeddingClient,
+        "ner": _LocalNerClient,
+    }
+
+
+class ModelServer:
+    """
+    Serves local model calls on a Unix socket; see the module docstring.
+    """
+
+    def __init__(
+        self,
+        socket_path: str,
+        loaders: Optional[Dict[str, Callable[[], Any]]] = None,
+        max_batch: int = 32,
+        max_wait_s: float = 0.005,
+    ) -> None:
+        self.socket_path = socket_path
+        self._loaders = loaders if loaders is not None else _default_loaders()
+        self._models: Dict[str, Any] = {}
+        self._models_lock = threading.Lock()
+        # One batcher (one thread) per model: see the module docstring.
+        self._batchers = {
+            role: MicroBatcher(
+                lambda items, role=role: self._run_batch(role, items),
+                max_batch=max_batch,
+                max_wait_s=max_wait_s,
+                name=f"model-server-{role}",
+            )
+            for role in sorted(set(OPERATIONS.values()))
+        }
+        self._server: Optional[_UnixServer] = None
+
+    def model(self, role: str) -> Any:
+        """The model for ``role``, loaded on first use."""
+        with self._models_lock:
+            model = self._models.get(role)
+            if model is None:
+                logger.info("model_server:load role=%s", role)
+                model = self._models[role] = self._loaders[role]()
+        return model
+
+    def preload(self) -> None:
+        for role in self._loaders:
+            self.model(role)
+
+    def _run_batch(self, role: str, items: List[Dict[str, Any]]) -> List[Any]:
+        model = self.model(role)
+        results: List[Any] = [None] * len(items)
+        groups: Dict[str, List[int]] = {}
+        for index, item in enumerate(items):
+            groups.setdefault(item["op"], []).append(index)
+        for op, indexes in groups.items():
+            rows = self._run_op(model, op, [items[index]["args"] for index in indexes])
+            for index, row in zip(indexes, rows):
+                results[index] = row
+        return results
+
+    def _run_op(self, model: Any, op: str, items: List[Dict[str, Any]]) -> List[Any]:
+        batch_fn = getattr(model, f"{op}_batch", None)
+        if batch_fn is not None and all(set(item) == {"text"} for item in items):
+            return [_jsonable(row) for row in batch_fn([item["text"] for item in items])]
+        if op == "chat_completion":
+            return self._run_chat(model, items)
+        if op == "chat_completion_batch":
+            return [
+                [_completion_content(c) for c in model.chat_completion_batch(**item)]
+                for item in items
+            ]
+        return [_jsonable(getattr(model, op)(**item)) for item in items]
+
+    def _run_chat(self, model: Any, items: List[Dict[str, Any]]) -> List[Any]:
+        batch_fn = getattr(model, "chat_completion_batch", None)
+        if batch_fn is None:
+            return [_completion_content(model.chat_completion(**item)) for item in items]
+        # Requests with the same generation settings share one batched generate().
+        results: List[Any] = [None] * len(items)
+        groups: Dict[Any, List[int]] = {}
+        for index, item in enumerate(items):
+            key = (item.get("max_tokens", 512), item.get("temperature", 0.1))
+            groups.setdefault(key, []).append(index)
+        for (max_tokens, temperature), indexes in groups.items():
+            completions = batch_fn(
+                [items[index]["messages"] for index in indexes],
+                max_tokens=max_tokens,
+                temperature=temperature,
+            )
+            for index, completion in zip(indexes, completions):
+                results[index] = _completion_content(completion)
+        return results
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Reply for one decoded request."""
+        op = request.get("op")
+        if op not in OPERATIONS:
+            return {"ok": False, "error": f"unknown operation {op!r}"}
+        try:
+            item = {"op": op, "args": dict(request.get("args") or {})}
+            result = self._batchers[OPERATIONS[op]].submit(item).result()
+        except Exception as exc:  # noqa: BLE001 - reported to the caller
+            logger.warning("model_server:failed op=%s error=%s", op, exc)
+            return {"ok": False, "error": f"{type(exc).__name__}: {exc}"}
+        return {"ok": True, "result": result}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._models_lock:
+            loaded = sorted(self._models)
+        return {
+            "loaded": loaded,
+            "batchers": {role: b.stats() for role, b in self._batchers.items()},
+        }
+
+    def bind(self) -> None:
+        """Create the listening socket (replacing a stale socket file)."""
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self) -> None:
+                while True:
+                    request = recv_message(self.request)
+                    if request is None:
+                        return
+                    send_message(self.request, server.handle(request))
+
+        self._server = _UnixServer(self.socket_path, Handler)
+        os.chmod(self.socket_path, 0o660)
+
+    def serve_forever(self) -> None:
+        if self._server is None:
+            self.bind()
+        logger.info("model_server:listening socket=%s", self.socket_path)
+        self._server.serve_forever()
+
+    def shutdown(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class ModelServerClient:
+    """
+    Drop-in for the local model clients that forwards calls to a ``ModelServer``.
+    Each thread keeps its own connection; one that fails before the request is
+    written is reopened once.
+    """
+
+    def __init__(self, socket_path: str, timeout_s: float = 120.0) -> None:
+        self.socket_path = socket_path
+        self._timeout_s = timeout_s
+        self._local = threading.local()
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            # Blocking connect: waits for the accept backlog instead of EAGAIN.
+            sock.connect(self.socket_path)
+            sock.settimeout(self._timeout_s)
+            self._local.sock = sock
+        return sock
+
+    def _drop_connection(self) -> None:
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+    def _call(self, op: str, **args: Any) -> Any:
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                send_message(sock, {"op": op, "args": args})
+                break
+            except socket.timeout:
+                self._drop_connection()
+                raise
+            except OSError:
+                # Connect or send failed (e.g. a stale connection): safe to resend.
+                self._drop_connection()
+                if attempt:
+                    raise
+        try:
+            reply = recv_message(sock)
+            if reply is None:
+                raise ConnectionError("model server closed the connection")
+        except OSError:
+            # The request was written and may be running: never resend it.
+            self._drop_connection()
+            raise
+        if not reply.get("ok"):
+            raise RuntimeError(f"model server {op} failed: {reply.get('error')}")
+        return reply["result"]
+
+    def chat_completion(
+        self,
+        messages: list[dict[str, str]],
+        max_tokens: int = 512,
+        temperature: float = 0.1,
+    ) -> Any:
+        result = self._call(
+            "chat_completion",
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+        )
+        return _completion(result)
+
+    def chat_completion_batch(
+        self,
+        conversations: list[list[dict[str, str]]],
+        max_tokens: int = 512,
+        temperature: float = 0.1,
+    ) -> list[Any]:
+        results = self._call(
+            "chat_completion_batch",
+            conversations=conversations,
+            max_tokens=max_tokens,
+            temperature=temperature,
+        )
+        return [_completion(result) for result in results]
+
+    def feature_extraction(self, text: str) -> Any:
+        return self._call("feature_extraction", text=text)
+
+    def feature_extraction_batch(self, texts: list[str]) -> Any:
+        return self._call("feature_extraction_batch", texts=list(texts))
+
+    def token_classification(self, text: str) -> Any:
+        return self._call("token_classification", text=text)
+
+    def token_classification_batch(self, texts: list[str]) -> Any:
+        return self._call("token_classification_batch", texts=list(texts))
@@ -0,0 +1,82 @@
+"""
+In-memory matrix of stored patient profile embeddings.
+
+Bulk operations (delta matching, cohort screening) score one trial against every
+patient at once, so they need all ``profile_embedding`` vectors stacked into a single
+``(patients, dim)`` float32 matrix rather than one document read per patient.
+"""
+
+from __future__ import annotations
+
+from collections import Counter
+from dataclasses import dataclass, field
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from trialmatch.services.db import patients_collection
+from trialmatch.services.embedding_codec import decode_embedding
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PatientEmbeddingMatrix:
+    patient_ids: List[str] = field(default_factory=list)
+    embeddings: np.ndarray = field(default_factory=lambda: np.zeros((0, 0), dtype=np.float32))
+
+    def __len__(self) -> int:
+        return len(self.patient_ids)
+
+    def rows_for(self, patient_ids: Iterable[str]) -> np.ndarray:
+        """Row indices of ``patient_ids`` that are present in the matrix."""
+        positions = {pid: idx for idx, pid in enumerate(self.patient_ids)}
+        return np.array(
+            [positions[pid] for pid in patient_ids if pid in positions],
+            dtype=np.int64,
+        )
+
+
+def load_patient_embedding_matrix(
+    patient_ids: Optional[Iterable[str]] = None,
+) -> PatientEmbeddingMatrix:
+    """
+    Load stored profile embeddings, optionally restricted to ``patient_ids``.
+
+    Patients without an embedding are skipped, as are vectors whose dimension differs
+    from the majority (left over from a previous embedding model).
+    """
+    # Embeddings are stored as packed binary or legacy arrays; patients uploaded
+    # without a summary carry an empty hash and are skipped here.
+    query: Dict[str, Any] = {
+        "profile_embedding": {"$exists": True},
+        "profile_embedding_hash": {"$nin": ["", None]},
+    }
+    if patient_ids is not None:
+        query["patient_id"] = {"$in": list(patient_ids)}
+    cursor = patients_collection().find(query, {"_id": 0, "patient_id": 1, "profile_embedding": 1})
+
+    ids: List[str] = []
+    rows: List[np.ndarray] = []
+    for doc in cursor:
+        row = decode_embedding(doc.get("profile_embedding"))
+        if row.ndim != 1 or row.size == 0:
+            continue
+        ids.append(str(doc["patient_id"]))
+        rows.append(row)
+    if not rows:
+        return PatientEmbeddingMatrix()
+
+    dim, _ = Counter(row.shape[0] for row in rows).most_common(1)[0]
+    keep = [idx for idx, row in enumerate(rows) if row.shape[0] == dim]
+    if len(keep) != len(rows):
+        logger.warning(
+            "patient_matrix:skipped_dimension_mismatch count=%s dim=%s",
+            len(rows) - len(keep),
+            dim,
+        )
+    return PatientEmbeddingMatrix(
+        patient_ids=[ids[idx] for idx in keep],
+        embeddings=np.vstack([rows[idx] for idx in keep]),
+    )
@@ -4,14 +4,39 @@ Patient profile extraction service.
 This refactors the logic from the original scripts so we can work
 directly from an in-memory Synthea JSON object (no filesystem writes
 are required for the serverless backend).
+
+NER runs on sentence chunks of each summary (so long summaries are not truncated
+at the model's maximum length); the chunks of all patients in a call go to the
+backend together and entities are merged back per patient. Hosted backends take
+one chunk per request, so those requests run concurrently on a small pool, still
+bounded by the provider's concurrency limit.
 """
 
 from __future__ import annotations
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
-from typing import Any, Dict, List
+import re
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+from trialmatch.config import settings
+from trialmatch.services.llm_models import call_backend, get_ner_client
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
 
-from trialmatch.services.llm_models import get_ner_client
+_ner_executor: Optional[ThreadPoolExecutor] = None
+_ner_executor_lock = threading.Lock()
+
+
+def _get_ner_executor() -> ThreadPoolExecutor:
+    global _ner_executor
+    with _ner_executor_lock:
+        if _ner_executor is None:
+            _ner_executor = ThreadPoolExecutor(
+                max_workers=max(1, settings.ner_max_workers), thread_name_prefix="ner"
+            )
+    return _ner_executor
 
 
 def _dedupe_keep_order(values: List[str]) -> List[str]:
@@ -63,18 +88,94 @@ def _condition_status_phrase(resource: Dict[str, Any]) -> str:
     return "present"
 
 
-def build_patient_profile_from_json(patient_data: Dict[str, Any]) -> Dict[str, Any]:
+def _split_long(sentence: str, max_chars: int) -> List[str]:
+    # Rare run-on sentences (long condition lists) are wrapped at word boundaries.
+    pieces: List[str] = []
+    current = ""
+    for word in sentence.split():
+        if current and len(current) + 1 + len(word) > max_chars:
+            pieces.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def sentence_chunks(text: str, max_chars: int | None = None) -> List[str]:
     """
-    Build a structured patient profile from a Synthea-style FHIR JSON document.
+    ``text`` split at sentence ends and packed into chunks of at most ``max_chars``
+    characters (default ``NER_CHUNK_MAX_CHARS``), never cutting a sentence unless
+    it alone is longer than that.
+    """
+    limit = max(1, max_chars or settings.ner_chunk_max_chars)
+    chunks: List[str] = []
+    current = ""
+    for sentence in _SENTENCE_END.split(str(text or "").strip()):
+        for piece in _split_long(sentence, limit) if len(sentence) > limit else [sentence]:
+            if current and len(current) + 1 + len(piece) > limit:
+                chunks.append(current)
+                current = piece
+            else:
+                current = f"{current} {piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
 
-    Returns a dictionary of the form:
-    {
-        "conditions": [...],
-        "medications": [...],
-        "text_summary": "Patient has ...",
-        "ner_entities": [...]
-    }
+
+def _classify_chunks(chunks: List[str]) -> List[List[Dict[str, Any]]]:
+    """NER output per chunk; backends with a batch method get all chunks at once."""
+    ner_client = get_ner_client()
+    if len(chunks) > 1 and hasattr(ner_client, "token_classification_batch"):
+
+        def run(client: Any) -> List[Any]:
+            batch = getattr(client, "token_classification_batch", None)
+            if batch is not None:
+                return list(batch(chunks))
+            return [client.token_classification(chunk) for chunk in chunks]
+
+        return call_backend("ner", ner_client, run)
+
+    # Hugging Face Inference API - token classification, one chunk per request;
+    # call_backend holds the provider's concurrency slot around each request.
+    def classify(text: str) -> Any:
+        return call_backend("ner", ner_client, lambda client: client.token_classification(text))
+
+    if len(chunks) == 1:
+        return [classify(chunks[0])]
+    return list(_get_ner_executor().map(classify, chunks))
+
+
+def extract_entities(texts: Sequence[str], max_chunks: int | None = None) -> List[List[str]]:
     """
+    Distinct NER entity words for each of ``texts``, in first-seen order, from
+    one batched pass over the sentence chunks of all texts. Raises ``ValueError``
+    before any NER call when there are more than ``max_chunks`` chunks.
+    """
+    owners: List[int] = []
+    chunks: List[str] = []
+    for index, text in enumerate(texts):
+        for chunk in sentence_chunks(text):
+            owners.append(index)
+            chunks.append(chunk)
+    if max_chunks is not None and len(chunks) > max_chunks:
+        raise ValueError(
+            f"Patient summaries split into {len(chunks)} NER chunks; at most {max_chunks} "
+            "are processed per request."
+        )
+    if not chunks:
+        return [[] for _ in texts]
+    words: List[Dict[str, None]] = [{} for _ in texts]
+    for owner, entities in zip(owners, _classify_chunks(chunks)):
+        for entity in entities or []:
+            if "word" in entity:
+                words[owner].setdefault(entity["word"], None)
+    return [list(found) for found in words]
+
+
+def _build_profile(patient_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Profile without ``ner_entities``; see ``build_patient_profile_from_json``."""
     if "entry" not in patient_data:
         return {}
 
@@ -150,16 +251,39 @@ def build_patient_profile_from_json(patient_data: Dict[str, Any]) -> Dict[str, A
         )
 
     profile["text_summary"] = " ".join(_dedupe_keep_order(full_text_narrative))
+    return profile
 
-    if profile["text_summary"]:
-        ner_client = get_ner_client()
-        # Hugging Face Inference API - token classification
-        entities = ner_client.token_classification(profile["text_summary"])
-        profile["ner_entities"] = list(
-            {entity["word"] for entity in entities if "word" in entity}
-        )
-    else:
-        profile["ner_entities"] = []
 
-    return profile
+def build_patient_profiles_from_json(
+    patients: Sequence[Dict[str, Any]],
+    max_ner_chunks: int | None = None,
+) -> List[Dict[str, Any]]:
+    """
+    ``build_patient_profile_from_json`` for several patients with one batched NER
+    pass over all their summaries (bulk ingestion). Patients without FHIR entries
+    get ``{}``. Raises ``ValueError`` when the summaries exceed ``max_ner_chunks``.
+    """
+    profiles = [_build_profile(patient_data) for patient_data in patients]
+    built = [profile for profile in profiles if profile]
+    entities = extract_entities(
+        [profile["text_summary"] for profile in built], max_chunks=max_ner_chunks
+    )
+    for profile, words in zip(built, entities):
+        profile["ner_entities"] = words
+    return profiles
+
+
+def build_patient_profile_from_json(patient_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build a structured patient profile from a Synthea-style FHIR JSON document.
+
+    Returns a dictionary of the form:
+    {
+        "conditions": [...],
+        "medications": [...],
+        "text_summary": "Patient has ...",
+        "ner_entities": [...]
+    }
+    """
+    return build_patient_profiles_from_json([patient_data])[0]
 
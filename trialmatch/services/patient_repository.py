@@ -0,0 +1,186 @@
+"""
+Patient read paths.
+
+``load_patient_read_model`` is the single read behind the detail page, the PDF
+report and matching: one ``find_one`` returns the profile, optionally the stored
+embedding, and the latest match from the denormalized ``latest_match`` pointer.
+
+``list_patients_page`` pages through patients newest first with a keyset cursor on
+``(created_at, _id)`` (served by the ``created_at_id_desc`` index), so every page
+costs the same however deep it is, and projects only the fields the list renders:
+the id, the upload time and the first few conditions via ``$slice``.
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+from dataclasses import dataclass, field
+from datetime import datetime
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+import numpy as np
+
+from trialmatch.services.db import patients_collection
+from trialmatch.services.embedding_codec import decode_embedding
+from trialmatch.services.match_history import newest_match_run, public_match_doc
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+LIST_CONDITIONS = 4
+
+_LIST_PROJECTION = {
+    "_id": 1,
+    "patient_id": 1,
+    "created_at": 1,
+    "profile.conditions": {"$slice": LIST_CONDITIONS},
+}
+
+
+@dataclass
+class PatientReadModel:
+    patient_id: str
+    created_at: Optional[str] = None
+    profile: Dict[str, Any] = field(default_factory=dict)
+    latest_match: Optional[Dict[str, Any]] = None
+    embedding_hash: str = ""
+    embedding_version: Dict[str, str] = field(default_factory=dict)
+    embedding: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.float32))
+
+
+def load_patient_read_model(
+    patient_id: str,
+    with_embedding: bool = False,
+    with_latest_match: bool = True,
+) -> Optional[PatientReadModel]:
+    """
+    Read a patient in one round trip, projecting only the requested parts.
+
+    Patients matched before ``latest_match`` existed fall back to the history query
+    (``python -m trialmatch.cli compact-matches`` backfills the pointer).
+    """
+    projection: Dict[str, Any] = {"_id": 0, "patient_id": 1, "created_at": 1, "profile": 1}
+    if with_embedding:
+        projection.update(
+            {"profile_embedding": 1, "profile_embedding_hash": 1, "profile_embedding_version": 1}
+        )
+    if with_latest_match:
+        projection["latest_match"] = 1
+    doc = patients_collection().find_one({"patient_id": patient_id}, projection)
+    if not doc:
+        return None
+
+    latest = None
+    if with_latest_match:
+        latest = doc.get("latest_match") or newest_match_run(patient_id)
+    return PatientReadModel(
+        patient_id=str(doc.get("patient_id") or patient_id),
+        created_at=doc.get("created_at"),
+        profile=doc.get("profile") or {},
+        latest_match=public_match_doc(latest) if latest else None,
+        embedding_hash=str(doc.get("profile_embedding_hash") or ""),
+        embedding_version=dict(doc.get("profile_embedding_version") or {}),
+        embedding=decode_embedding(doc.get("profile_embedding")),
+    )
+
+
+def encode_cursor(created_at: str, doc_id: ObjectId) -> str:
+    raw = json.dumps({"c": created_at, "i": str(doc_id)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    """Inverse of ``encode_cursor``; raises ``ValueError`` on a malformed cursor."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return {"created_at": str(data["c"]), "_id": ObjectId(data["i"])}
+    except (binascii.Error, UnicodeError, ValueError, KeyError, TypeError, InvalidId) as exc:
+        raise ValueError("Invalid cursor.") from exc
+
+
+def _iso_bound(value: str, name: str) -> str:
+    try:
+        datetime.fromisoformat(value)
+    except ValueError as exc:
+        raise ValueError(f"`{name}` must be an ISO 8601 date or datetime.") from exc
+    return value
+
+
+def patient_list_query(
+    cursor: Optional[str] = None,
+    condition: Optional[str] = None,
+    created_from: Optional[str] = None,
+    created_to: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Mongo filter for one list page. ``created_from`` is inclusive and ``created_to``
+    exclusive; both compare against the stored ISO ``created_at`` strings.
+    """
+    clauses: List[Dict[str, Any]] = []
+    created: Dict[str, str] = {}
+    if created_from:
+        created["$gte"] = _iso_bound(created_from, "created_from")
+    if created_to:
+        created["$lt"] = _iso_bound(created_to, "created_to")
+    if created:
+        clauses.append({"created_at": created})
+    if condition:
+        clauses.append(
+            {"profile.conditions": {"$regex": re.escape(condition.strip()), "$options": "i"}}
+        )
+    if cursor:
+        after = decode_cursor(cursor)
+        clauses.append(
+            {
+                "$or": [
+                    {"created_at": {"$lt": after["created_at"]}},
+                    {"created_at": after["created_at"], "_id": {"$lt": after["_id"]}},
+                ]
+            }
+        )
+    if not clauses:
+        return {}
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def list_patients_page(
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    condition: Optional[str] = None,
+    created_from: Optional[str] = None,
+    created_to: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    One page of the patient list, newest first.
+
+    Returns {"patients": [{"patient_id", "created_at", "conditions"}, ...],
+    "next_cursor": str | None}. Raises ``ValueError`` for a bad cursor or date.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    query = patient_list_query(cursor, condition, created_from, created_to)
+    docs = list(
+        patients_collection()
+        .find(query, _LIST_PROJECTION)
+        .sort([("created_at", -1), ("_id", -1)])
+        .limit(limit + 1)
+    )
+    page = docs[:limit]
+    next_cursor = None
+    if len(docs) > limit and page:
+        last = page[-1]
+        next_cursor = encode_cursor(str(last.get("created_at") or ""), last["_id"])
+    return {
+        "patients": [
+            {
+                "patient_id": doc.get("patient_id"),
+                "created_at": doc.get("created_at"),
+                "conditions": (doc.get("profile") or {}).get("conditions", []),
+            }
+            for doc in page
+        ],
+        "next_cursor": next_cursor,
+    }
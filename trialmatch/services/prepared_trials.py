@@ -1,31 +1,95 @@
 """
 Helpers for persisting trial eligibility parsing and criterion embeddings.
+
+Criterion embeddings live in the ``criteria_vectors`` collection keyed by
+``criteria_hash``, so trials with identical criteria share one vector set and reads
+of trial metadata never carry vectors. Trial documents keep the hash, model versions
+and parsed bullets; ``ensure_trials_prepared`` attaches the vectors for scoring.
+
+When only the reasoning model changed (so stored criterion embeddings are still
+comparable with patient embeddings), outdated vector sets are served marked
+``stale`` while the background preparation queue rebuilds them; the rebuilt set
+replaces the old document in one write. Vector sets are always written before
+the trial metadata that points at them.
 """
 
 from __future__ import annotations
 
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from datetime import datetime, timezone
 import hashlib
-from typing import Any, Dict, Iterable, List
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pymongo import UpdateOne
 
 from trialmatch.config import settings
-from trialmatch.services.db import trials_collection
-from trialmatch.services.eligibility_parser import parse_eligibility_criteria
-from trialmatch.services.matching_engine import get_embedding
+from trialmatch.services.db import criteria_vectors_collection, trials_collection
+from trialmatch.services.eligibility_parser import (
+    parse_eligibility_criteria,
+    parse_eligibility_criteria_many,
+)
+from trialmatch.services.embedding_codec import decode_embedding_rows, encode_embedding
+from trialmatch.services.background_preparation import queue_trial_preparation
+from trialmatch.services.matching_engine import get_embeddings
+from trialmatch.services.singleflight import SingleFlight
+from trialmatch.services.write_behind import persist
+
+
+logger = logging.getLogger(__name__)
+
+# Concurrent preparation of identical criteria (same models) runs once.
+_prepare_flights = SingleFlight()
+# Deadline-bound builds run here so a request can stop waiting for them.
+_build_executor: Optional[ThreadPoolExecutor] = None
+_build_executor_lock = threading.Lock()
+
+
+def _get_build_executor() -> ThreadPoolExecutor:
+    global _build_executor
+    with _build_executor_lock:
+        if _build_executor is None:
+            _build_executor = ThreadPoolExecutor(
+                max_workers=max(1, settings.preparation_workers),
+                thread_name_prefix="trial-build",
+            )
+    return _build_executor
 
 
 def _criteria_hash(criteria_text: str) -> str:
     return hashlib.sha256((criteria_text or "").strip().encode("utf-8")).hexdigest()
 
 
+def _local_inference_version() -> str:
+    if not settings.dev_local_inference:
+        return "false"
+    # Int8 embeddings are close to, but not interchangeable with, float32 ones.
+    return "int8" if settings.local_embedding_quantize else "true"
+
+
 def _cache_version() -> Dict[str, str]:
     return {
         "reasoning_model": settings.hf_reasoning_model,
         "embedding_model": settings.hf_embedding_model,
-        "local_inference": "true" if settings.dev_local_inference else "false",
+        "local_inference": _local_inference_version(),
     }
 
 
+# Version fields a stored vector set must share with the current settings to be
+# scored against current patient embeddings.
+_EMBEDDING_VERSION_FIELDS = ("embedding_model", "local_inference")
+
+
+def embedding_version() -> Dict[str, str]:
+    """The parts of the cache version that decide which vectors embeddings come from."""
+    current = _cache_version()
+    return {field: current[field] for field in _EMBEDDING_VERSION_FIELDS}
+
+
 def _normalized_strings(values: Iterable[Any]) -> List[str]:
     out: List[str] = []
     seen = set()
@@ -41,8 +105,24 @@ def _normalized_strings(values: Iterable[Any]) -> List[str]:
     return out
 
 
-def build_trial_cache(criteria_text: str) -> Dict[str, Any]:
-    parsed = parse_eligibility_criteria(criteria_text)
+def _encode_criteria_embeddings(items: List[str]) -> Any:
+    rows = get_embeddings(items)
+    return encode_embedding(np.vstack(rows) if rows else np.zeros((0, 0), dtype=np.float32))
+
+
+def criteria_embedding_matrices(trial_doc: Dict[str, Any]) -> Dict[str, np.ndarray]:
+    """
+    Decode a trial's cached criterion embeddings (binary or legacy lists) into
+    ``{"inclusion": (n, dim), "exclusion": (m, dim)}`` float32 matrices.
+    """
+    embeddings = trial_doc.get("criteria_embeddings") or {}
+    return {
+        "inclusion": decode_embedding_rows(embeddings.get("inclusion")),
+        "exclusion": decode_embedding_rows(embeddings.get("exclusion")),
+    }
+
+
+def _cache_payload(criteria_text: str, parsed: Dict[str, Any]) -> Dict[str, Any]:
     inclusion = _normalized_strings(parsed.get("inclusion") or [])
     exclusion = _normalized_strings(parsed.get("exclusion") or [])
     return {
@@ -53,14 +133,103 @@ def build_trial_cache(criteria_text: str) -> Dict[str, Any]:
             "exclusion": exclusion,
         },
         "criteria_embeddings": {
-            "inclusion": [get_embedding(item).tolist() for item in inclusion],
-            "exclusion": [get_embedding(item).tolist() for item in exclusion],
+            "inclusion": _encode_criteria_embeddings(inclusion),
+            "exclusion": _encode_criteria_embeddings(exclusion),
         },
         "prepared_at": datetime.now(timezone.utc).isoformat(),
     }
 
 
-def is_trial_cache_fresh(trial_doc: Dict[str, Any]) -> bool:
+def build_trial_cache(criteria_text: str) -> Dict[str, Any]:
+    return _cache_payload(criteria_text, parse_eligibility_criteria(criteria_text))
+
+
+def build_trial_caches(criteria_texts: Sequence[str]) -> List[Dict[str, Any]]:
+    """``build_trial_cache`` for several texts with one batched LLM parse."""
+    parsed = parse_eligibility_criteria_many(criteria_texts)
+    return [_cache_payload(text, result) for text, result in zip(criteria_texts, parsed)]
+
+
+def _vectors_doc(cache_payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "_id": cache_payload["criteria_hash"],
+        "cache_version": cache_payload["cache_version"],
+        "parsed_criteria": cache_payload["parsed_criteria"],
+        "criteria_embeddings": cache_payload["criteria_embeddings"],
+        "prepared_at": cache_payload["prepared_at"],
+    }
+
+
+def trial_metadata_update(cache_payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Mongo update for a trial document after its criteria were prepared: the small
+    parsed/hash/version fields are set and any inline vectors are removed.
+    """
+    return {
+        "$set": {
+            "criteria_hash": cache_payload["criteria_hash"],
+            "cache_version": cache_payload["cache_version"],
+            "parsed_criteria": cache_payload["parsed_criteria"],
+            "prepared_at": cache_payload["prepared_at"],
+        },
+        "$unset": {"criteria_embeddings": ""},
+    }
+
+
+def load_criteria_vectors(criteria_hashes: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Vector sets stored for ``criteria_hashes``, keyed by hash."""
+    hashes = sorted({h for h in criteria_hashes if h})
+    if not hashes:
+        return {}
+    return {doc["_id"]: doc for doc in criteria_vectors_collection().find({"_id": {"$in": hashes}})}
+
+
+def store_criteria_vectors(cache_payload: Dict[str, Any]) -> None:
+    # Written inline, never through write-behind: trial metadata and the removal
+    # of inline vectors may only follow a stored vector set, and the next request
+    # must see it instead of parsing and embedding the criteria again.
+    vectors = _vectors_doc(cache_payload)
+    criteria_vectors_collection().replace_one({"_id": vectors["_id"]}, vectors, upsert=True)
+
+
+def _is_vectors_doc_fresh(vectors_doc: Optional[Dict[str, Any]], criteria_hash: str) -> bool:
+    return (
+        vectors_doc is not None
+        and vectors_doc.get("_id") == criteria_hash
+        and (vectors_doc.get("cache_version") or {}) == _cache_version()
+    )
+
+
+def _is_vectors_doc_servable_stale(
+    vectors_doc: Optional[Dict[str, Any]],
+    criteria_hash: str,
+) -> bool:
+    """True for an outdated vector set whose embeddings still match the current model."""
+    if vectors_doc is None or vectors_doc.get("_id") != criteria_hash:
+        return False
+    cached_version = vectors_doc.get("cache_version") or {}
+    return all(cached_version.get(field) == value for field, value in embedding_version().items())
+
+
+def _vectors_payload(vectors_doc: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "criteria_hash": vectors_doc["_id"],
+        "cache_version": vectors_doc["cache_version"],
+        "parsed_criteria": vectors_doc.get("parsed_criteria") or {},
+        "criteria_embeddings": vectors_doc.get("criteria_embeddings") or {},
+        "prepared_at": vectors_doc.get("prepared_at"),
+    }
+
+
+def is_trial_cache_fresh(
+    trial_doc: Dict[str, Any],
+    vectors_doc: Optional[Dict[str, Any]] = None,
+) -> bool:
+    """
+    True when the trial's prepared metadata matches its criteria text and the
+    current models. When ``vectors_doc`` (its ``criteria_vectors`` entry) is given,
+    that vector set must match the same hash and models too.
+    """
     criteria = str(trial_doc.get("criteria") or "").strip()
     if not criteria:
         return False
@@ -70,19 +239,314 @@ def is_trial_cache_fresh(trial_doc: Dict[str, Any]) -> bool:
         return False
 
     cached_version = trial_doc.get("cache_version") or {}
-    return cached_version == _cache_version()
+    if cached_version != _cache_version():
+        return False
+    return vectors_doc is None or _is_vectors_doc_fresh(vectors_doc, prepared_hash)
 
 
-def ensure_trial_prepared(trial_doc: Dict[str, Any]) -> Dict[str, Any]:
-    if is_trial_cache_fresh(trial_doc):
-        return trial_doc
+def prepare_criteria(
+    criteria_text: str,
+    vectors_doc: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Parsed criteria and embeddings for ``criteria_text``: reused from ``vectors_doc``
+    when it is fresh, otherwise built and stored in ``criteria_vectors``.
+    """
+    criteria_hash = _criteria_hash(criteria_text)
+    if _is_vectors_doc_fresh(vectors_doc, criteria_hash):
+        return _vectors_payload(vectors_doc)
+    return _prepare_flights.do(
+        _build_key(criteria_hash), lambda: _build_and_store(criteria_text)
+    )
 
-    criteria = str(trial_doc.get("criteria") or "").strip()
-    cache_payload = build_trial_cache(criteria)
-    trials_collection().update_one(
-        {"nct_id": trial_doc["nct_id"]},
-        {"$set": cache_payload},
+
+def cache_version_key() -> str:
+    """The current cache version (models, scoring inputs) as a hashable string."""
+    return json.dumps(_cache_version(), sort_keys=True)
+
+
+def _build_key(criteria_hash: str) -> Tuple[str, str]:
+    return (criteria_hash, cache_version_key())
+
+
+def _build_and_store(criteria_text: str) -> Dict[str, Any]:
+    cache_payload = build_trial_cache(criteria_text)
+    store_criteria_vectors(cache_payload)
+    return cache_payload
+
+
+def prepare_criteria_async(
+    criteria_text: str,
+    vectors_doc: Optional[Dict[str, Any]] = None,
+) -> "Future[Dict[str, Any]]":
+    """
+    ``prepare_criteria`` as a future: a build runs on the preparation executor
+    (joining one already in flight for the same criteria), so callers can stop
+    waiting at a deadline while the build finishes and stores its vectors.
+    """
+    criteria_hash = _criteria_hash(criteria_text)
+    if _is_vectors_doc_fresh(vectors_doc, criteria_hash):
+        done: "Future[Dict[str, Any]]" = Future()
+        done.set_result(_vectors_payload(vectors_doc))
+        return done
+    return _prepare_flights.share(
+        _build_key(criteria_hash),
+        lambda: _get_build_executor().submit(_build_and_store, criteria_text),
+    )
+
+
+def prepare_criteria_many(criteria_texts: Sequence[str]) -> List[Dict[str, Any]]:
+    """
+    ``prepare_criteria`` for several texts with one vector lookup; texts without
+    fresh vectors are built together (one batched LLM parse), joining builds
+    already in flight for the same criteria instead of repeating them.
+    """
+    texts = [str(text or "").strip() for text in criteria_texts]
+    vectors = load_criteria_vectors(_criteria_hash(text) for text in texts)
+    missing: Dict[Tuple[str, str], str] = {}
+    for text in texts:
+        criteria_hash = _criteria_hash(text)
+        if not _is_vectors_doc_fresh(vectors.get(criteria_hash), criteria_hash):
+            missing.setdefault(_build_key(criteria_hash), text)
+
+    def build(keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        built_texts = [missing[key] for key in keys]
+        if len(built_texts) > 1:
+            cache_payloads = build_trial_caches(built_texts)
+        else:
+            cache_payloads = [build_trial_cache(built_texts[0])]
+        for cache_payload in cache_payloads:
+            store_criteria_vectors(cache_payload)
+        return dict(zip(keys, cache_payloads))
+
+    if missing:
+        for cache_payload in _prepare_flights.do_many(list(missing), build).values():
+            vectors[cache_payload["criteria_hash"]] = _vectors_doc(cache_payload)
+    return [_vectors_payload(vectors[_criteria_hash(text)]) for text in texts]
+
+
+def prepare_catalog(batch_size: int = 32) -> Dict[str, int]:
+    """
+    Offline preparation of every trial whose cached criteria are missing or
+    outdated, ``batch_size`` trials per batched parse/embedding pass.
+
+    Outdated trials are listed in one quick scan first and fetched per batch, so
+    no cursor stays open across the slow LLM passes (it would time out).
+    """
+    summary = {"trials": 0, "prepared": 0}
+    projection = {"nct_id": 1, "criteria": 1, "criteria_hash": 1, "cache_version": 1}
+    outdated: List[str] = []
+    for doc in trials_collection().find({}, projection):
+        summary["trials"] += 1
+        if str(doc.get("criteria") or "").strip() and not is_trial_cache_fresh(doc):
+            outdated.append(doc["nct_id"])
+
+    size = max(1, batch_size)
+    for start in range(0, len(outdated), size):
+        batch = [
+            doc
+            for doc in trials_collection().find(
+                {"nct_id": {"$in": outdated[start : start + size]}}, projection
+            )
+            if str(doc.get("criteria") or "").strip() and not is_trial_cache_fresh(doc)
+        ]
+        if not batch:
+            continue
+        payloads = prepare_criteria_many([doc["criteria"] for doc in batch])
+        persist(
+            trials_collection,
+            [
+                UpdateOne({"nct_id": doc["nct_id"]}, trial_metadata_update(payload))
+                for doc, payload in zip(batch, payloads)
+            ],
+        )
+        summary["prepared"] += len(batch)
+    return summary
+
+
+def vectors_signature(prepared_trial: Dict[str, Any]) -> Tuple[str, str]:
+    """Identifies the vector set a prepared trial carries: criteria hash and build time."""
+    return (
+        str(prepared_trial.get("criteria_hash") or ""),
+        str(prepared_trial.get("prepared_at") or ""),
     )
-    updated = dict(trial_doc)
-    updated.update(cache_payload)
-    return updated
+
+
+def load_prepared_catalog(batch_size: int = 500) -> List[Dict[str, Any]]:
+    """
+    Every trial in the catalog with a fresh stored vector set, as prepared-trial
+    dicts (``nct_id`` plus the vector set), for catalog-wide indexes. Trials are
+    listed in one scan; their vector sets are loaded ``batch_size`` at a time.
+    """
+    listed: List[Tuple[str, str]] = []
+    for doc in trials_collection().find({}, {"nct_id": 1, "criteria": 1}):
+        criteria = str(doc.get("criteria") or "").strip()
+        if criteria:
+            listed.append((str(doc["nct_id"]), _criteria_hash(criteria)))
+    catalog: List[Dict[str, Any]] = []
+    size = max(1, batch_size)
+    for start in range(0, len(listed), size):
+        batch = listed[start : start + size]
+        vectors = load_criteria_vectors(criteria_hash for _, criteria_hash in batch)
+        for nct_id, criteria_hash in batch:
+            stored = vectors.get(criteria_hash)
+            if _is_vectors_doc_fresh(stored, criteria_hash):
+                catalog.append({"nct_id": nct_id, **_vectors_payload(stored)})
+    return catalog
+
+
+def _adopt_inline_vectors(trial_docs: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Move vectors still embedded in trial documents (written before the
+    ``criteria_vectors`` collection existed) into it, without re-embedding.
+    """
+    inline = {
+        doc["nct_id"]: doc
+        for doc in trials_collection().find(
+            {
+                "nct_id": {"$in": [doc["nct_id"] for doc in trial_docs]},
+                "criteria_embeddings": {"$exists": True},
+            },
+            {"nct_id": 1, "criteria_embeddings": 1},
+        )
+    }
+    adopted: Dict[str, Dict[str, Any]] = {}
+    for trial_doc in trial_docs:
+        found = inline.get(trial_doc["nct_id"])
+        if not found:
+            continue
+        cache_payload = {
+            "criteria_hash": trial_doc["criteria_hash"],
+            "cache_version": trial_doc["cache_version"],
+            "parsed_criteria": trial_doc.get("parsed_criteria") or {},
+            "criteria_embeddings": found["criteria_embeddings"],
+            "prepared_at": trial_doc.get("prepared_at"),
+        }
+        store_criteria_vectors(cache_payload)
+        trials_collection().update_one(
+            {"nct_id": trial_doc["nct_id"]},
+            {"$unset": {"criteria_embeddings": ""}},
+        )
+        adopted[cache_payload["criteria_hash"]] = _vectors_doc(cache_payload)
+    return adopted
+
+
+def _stored_vectors(
+    trial_doc: Dict[str, Any],
+    vectors: Dict[str, Dict[str, Any]],
+) -> Tuple[Optional[Dict[str, Any]], str]:
+    criteria_hash = _criteria_hash(str(trial_doc.get("criteria") or "").strip())
+    return vectors.get(criteria_hash), criteria_hash
+
+
+def ensure_trials_prepared(
+    trial_docs: Sequence[Dict[str, Any]],
+    deadline: Optional[float] = None,
+    skipped: Optional[List[str]] = None,
+    allow_stale: Optional[bool] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Return ``trial_docs`` with ``parsed_criteria`` and ``criteria_embeddings``
+    attached, loading all vector sets in one query and preparing only trials whose
+    criteria (or models) changed. Trials sharing identical criteria share one
+    vector set.
+
+    With a ``deadline`` (``time.monotonic()`` value), trials whose vectors must
+    still be built are built on the preparation executor and waited for only until
+    the deadline (a build already in flight for another request is joined, not
+    waited on past it). Trials not ready by then are returned unchanged and their
+    NCT ids appended to ``skipped``; their builds keep running and store their
+    vectors for the next request.
+
+    With ``allow_stale`` (default ``TRIAL_CACHE_SERVE_STALE``), a trial whose stored
+    vector set is outdated but built with the current embedding model is returned
+    with that set and ``stale: True``, and queued for background preparation.
+    """
+    if allow_stale is None:
+        allow_stale = settings.trial_cache_serve_stale
+    # Documents that still carry fresh inline vectors need no lookup.
+    pending = [
+        doc
+        for doc in trial_docs
+        if not (isinstance(doc.get("criteria_embeddings"), dict) and is_trial_cache_fresh(doc))
+    ]
+    vectors = load_criteria_vectors(
+        _criteria_hash(str(doc.get("criteria") or "").strip()) for doc in pending
+    )
+    orphans = [
+        doc
+        for doc in pending
+        if is_trial_cache_fresh(doc) and doc["criteria_hash"] not in vectors
+    ]
+    if orphans:
+        vectors.update(_adopt_inline_vectors(orphans))
+
+    def needs_build(doc: Dict[str, Any]) -> bool:
+        stored, criteria_hash = _stored_vectors(doc, vectors)
+        if _is_vectors_doc_fresh(stored, criteria_hash):
+            return False
+        return not (allow_stale and _is_vectors_doc_servable_stale(stored, criteria_hash))
+
+    prepared: Dict[int, Dict[str, Any]] = {}
+    metadata_ops: List[UpdateOne] = []
+    stale_ids: List[str] = []
+    building: List[Tuple[Dict[str, Any], str, Future]] = []
+
+    def attach(doc: Dict[str, Any], criteria_hash: str, cache_payload: Dict[str, Any]) -> None:
+        vectors[criteria_hash] = _vectors_doc(cache_payload)
+        if not is_trial_cache_fresh(doc):
+            metadata_ops.append(
+                UpdateOne({"nct_id": doc["nct_id"]}, trial_metadata_update(cache_payload))
+            )
+        updated = dict(doc)
+        updated.update(cache_payload)
+        prepared[id(doc)] = updated
+
+    # Trials with stored vectors are cheap; build the others last, within budget.
+    pending.sort(key=needs_build)
+    for doc in pending:
+        criteria = str(doc.get("criteria") or "").strip()
+        criteria_hash = _criteria_hash(criteria)
+        stored = vectors.get(criteria_hash)
+        if not _is_vectors_doc_fresh(stored, criteria_hash):
+            if allow_stale and _is_vectors_doc_servable_stale(stored, criteria_hash):
+                updated = dict(doc)
+                updated.update(_vectors_payload(stored))
+                updated["stale"] = True
+                prepared[id(doc)] = updated
+                stale_ids.append(str(doc["nct_id"]))
+                continue
+            if deadline is not None:
+                if time.monotonic() >= deadline:
+                    if skipped is not None:
+                        skipped.append(str(doc["nct_id"]))
+                else:
+                    building.append((doc, criteria_hash, prepare_criteria_async(criteria, stored)))
+                continue
+        attach(doc, criteria_hash, prepare_criteria(criteria, stored))
+    if building:
+        remaining = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+        done, _ = wait([future for _, _, future in building], timeout=remaining)
+        for doc, criteria_hash, future in building:
+            # A failed build is skipped like an unfinished one; the next request retries.
+            error = future.exception() if future in done else None
+            if future in done and error is None:
+                attach(doc, criteria_hash, future.result())
+            else:
+                if error is not None:
+                    logger.warning(
+                        "prepare:build_failed nct_id=%s error=%s", doc["nct_id"], error
+                    )
+                if skipped is not None:
+                    skipped.append(str(doc["nct_id"]))
+        if len(done) < len(building):
+            logger.info("prepare:deadline_unfinished builds=%s", len(building) - len(done))
+    if metadata_ops:
+        persist(trials_collection, metadata_ops)
+    if stale_ids:
+        queue_trial_preparation(stale_ids)
+    return [prepared.get(id(doc), doc) for doc in trial_docs]
+
+
+def ensure_trial_prepared(trial_doc: Dict[str, Any]) -> Dict[str, Any]:
+    return ensure_trials_prepared([trial_doc])[0]
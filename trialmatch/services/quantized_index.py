@@ -0,0 +1,355 @@
+"""
+Quantized first-pass scoring over the whole trial catalog.
+
+Every inclusion and exclusion embedding is row-normalized and stored as per-row
+scaled int8 (or float16); only these codes stay resident, and the catalog-wide
+similarity pass reads them directly (numpy casts small buffers on the fly rather
+than materializing float32 blocks), so it streams a quarter (or half) of the bytes
+of the float32 matrix. Each row also records its worst-case quantization error; a
+similarity whose error bound straddles one of the scoring cut-offs (0.6 / 0.68 for
+inclusions, 0.82 for exclusions) is recomputed with the exact float32 cosine, so
+every criterion lands in the same band as in
+``calculate_match_score_from_precomputed`` and the final scores are identical.
+
+The index keeps no float32 rows. ``score_trials`` takes a ``row_source`` that
+returns one trial's float32 matrices (``prepared_trial_rows`` decodes them from
+the request's prepared trials), called only for trials owning a row to rescore.
+
+The index covers the whole prepared catalog and is built once per catalog version,
+cache version and dtype (``get_quantized_index``); a request scores only the rows
+of its candidate trials. ``quantized_scores`` uses the catalog index for
+candidates whose vector set it holds and a small per-request index for the rest.
+"""
+
+from __future__ import annotations
+
+import sys
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from trialmatch.services.matching_engine import (
+    EXCLUSION_THRESHOLD,
+    STRONG_INCLUSION_THRESHOLD,
+    WEAK_INCLUSION_THRESHOLD,
+    _THRESHOLD_RECHECK_MARGIN,
+    _cosine_similarity,
+    unit_rows,
+)
+from trialmatch.services.prepared_trials import (
+    cache_version_key,
+    criteria_embedding_matrices,
+    load_prepared_catalog,
+    vectors_signature,
+)
+from trialmatch.services.singleflight import SingleFlight
+
+QUANTIZATION_DTYPES = ("int8", "float16")
+_DEFAULT_BLOCK_SIZE = 4096
+
+# nct_id -> that trial's (inclusion, exclusion) float32 matrices.
+RowSource = Callable[[str], Tuple[np.ndarray, np.ndarray]]
+
+
+def prepared_trial_rows(prepared_trials: Sequence[Dict[str, Any]]) -> RowSource:
+    """Row source decoding the vectors of ``prepared_trials`` on demand."""
+    by_id = {str(trial["nct_id"]): trial for trial in prepared_trials}
+
+    def rows(nct_id: str) -> Tuple[np.ndarray, np.ndarray]:
+        matrices = criteria_embedding_matrices(by_id[nct_id])
+        return matrices["inclusion"], matrices["exclusion"]
+
+    return rows
+
+
+def quantize_rows(unit: np.ndarray, dtype: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Quantize row-normalized vectors.
+
+    Returns ``(codes, scales, errors)``: ``codes * scales[:, None]`` approximates
+    ``unit`` and ``errors`` is each row's largest absolute element error.
+    """
+    if dtype == "int8":
+        peak = np.abs(unit).max(axis=1) if unit.size else np.zeros(0, dtype=np.float32)
+        scales = np.where(peak > 0, peak / 127.0, 1.0).astype(np.float32)
+        codes = np.clip(np.rint(unit / scales[:, None]), -127, 127).astype(np.int8)
+    elif dtype == "float16":
+        scales = np.ones(unit.shape[0], dtype=np.float32)
+        codes = unit.astype(np.float16)
+    else:
+        raise ValueError(f"Unsupported embedding quantization: {dtype}")
+    restored = codes.astype(np.float32) * scales[:, None]
+    errors = np.abs(unit - restored).max(axis=1) if unit.size else np.zeros(0, dtype=np.float32)
+    return codes, scales, errors.astype(np.float32)
+
+
+class QuantizedCriteriaIndex:
+    """
+    Quantized criterion rows for a set of trials, scored in one blocked pass.
+    """
+
+    def __init__(
+        self,
+        trials: Iterable[Tuple[str, np.ndarray, np.ndarray]],
+        dtype: str = "int8",
+        block_size: int = _DEFAULT_BLOCK_SIZE,
+    ) -> None:
+        if dtype not in QUANTIZATION_DTYPES:
+            raise ValueError(f"Unsupported embedding quantization: {dtype}")
+        self.dtype = dtype
+        self._block_size = max(1, int(block_size))
+        self._nct_ids: List[str] = []
+        # nct_id -> ``vectors_signature`` of the vector set indexed, when known.
+        self.signatures: Dict[str, Tuple[str, str]] = {}
+        num_inclusions: List[int] = []
+        num_rows: List[int] = []
+        owners: List[np.ndarray] = []
+        kinds: List[np.ndarray] = []
+        # Position of each row within its trial's exclusion/inclusion matrix.
+        offsets: List[np.ndarray] = []
+        codes: List[np.ndarray] = []
+        scales: List[np.ndarray] = []
+        errors: List[np.ndarray] = []
+        # Quantized one trial at a time: no catalog-sized float32 matrix is built.
+        for position, (nct_id, inclusion, exclusion) in enumerate(trials):
+            self._nct_ids.append(str(nct_id))
+            num_inclusions.append(len(inclusion))
+            num_rows.append(len(inclusion) + len(exclusion))
+            for is_exclusion, rows in ((True, exclusion), (False, inclusion)):
+                if len(rows) == 0:
+                    continue
+                unit = unit_rows(np.asarray(rows, dtype=np.float32))
+                row_codes, row_scales, row_errors = quantize_rows(unit, dtype)
+                codes.append(row_codes)
+                scales.append(row_scales)
+                errors.append(row_errors)
+                owners.append(np.full(len(unit), position, dtype=np.int32))
+                kinds.append(np.full(len(unit), is_exclusion, dtype=bool))
+                offsets.append(np.arange(len(unit), dtype=np.int32))
+
+        def stack(parts: List[np.ndarray], dtype: Any) -> np.ndarray:
+            return np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+
+        self._num_inclusions = np.array(num_inclusions, dtype=np.int32)
+        self._positions = {nct_id: position for position, nct_id in enumerate(self._nct_ids)}
+        # Each trial's rows are contiguous: trial p owns rows [starts[p], starts[p + 1]).
+        self._row_starts = np.concatenate(([0], np.cumsum(num_rows, dtype=np.int64)))
+        self._owners = stack(owners, np.int32)
+        self._is_exclusion = stack(kinds, bool)
+        self._offsets = stack(offsets, np.int32)
+        self._scales = stack(scales, np.float32)
+        self._errors = stack(errors, np.float32)
+        code_dtype = np.int8 if dtype == "int8" else np.float16
+        self._codes = np.concatenate(codes) if codes else np.zeros((0, 0), dtype=code_dtype)
+
+    @classmethod
+    def from_prepared_trials(
+        cls,
+        prepared_trials: Iterable[Dict[str, Any]],
+        dtype: str = "int8",
+    ) -> "QuantizedCriteriaIndex":
+        signatures: Dict[str, Tuple[str, str]] = {}
+
+        def rows():
+            for trial in prepared_trials:
+                signatures[str(trial["nct_id"])] = vectors_signature(trial)
+                matrices = criteria_embedding_matrices(trial)
+                yield str(trial["nct_id"]), matrices["inclusion"], matrices["exclusion"]
+
+        index = cls(rows(), dtype=dtype)
+        index.signatures = signatures
+        return index
+
+    def __len__(self) -> int:
+        return int(self._codes.shape[0])
+
+    def holds(self, prepared_trial: Dict[str, Any]) -> bool:
+        """True when the index holds exactly the vector set ``prepared_trial`` carries."""
+        signature = self.signatures.get(str(prepared_trial["nct_id"]))
+        return signature is not None and signature == vectors_signature(prepared_trial)
+
+    @property
+    def nbytes(self) -> int:
+        """Resident bytes of the whole index: codes, per-row metadata and trial ids."""
+        arrays = (
+            self._codes,
+            self._scales,
+            self._errors,
+            self._owners,
+            self._is_exclusion,
+            self._offsets,
+            self._num_inclusions,
+            self._row_starts,
+        )
+        ids = sys.getsizeof(self._nct_ids) + sum(sys.getsizeof(i) for i in self._nct_ids)
+        positions = sys.getsizeof(self._positions)
+        return int(sum(array.nbytes for array in arrays) + ids + positions)
+
+    @property
+    def codes_nbytes(self) -> int:
+        """Bytes of quantized codes read by one first pass."""
+        return int(self._codes.nbytes)
+
+    @property
+    def float32_nbytes(self) -> int:
+        """Bytes the same rows occupy as a float32 matrix."""
+        return int(self._codes.size * 4)
+
+    def _similarities(
+        self, patient: np.ndarray, row_source: RowSource, rows: np.ndarray
+    ) -> Tuple[np.ndarray, int]:
+        """Similarities of the index ``rows`` to ``patient`` (exact near cut-offs)."""
+        unit_patient = (patient / (np.linalg.norm(patient) + 1e-12)).astype(np.float32)
+        sims = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), self._block_size):
+            stop = start + self._block_size
+            block = rows[start:stop]
+            # Straight from the codes: einsum casts through small internal buffers.
+            dots = np.einsum(
+                "ij,j->i",
+                self._codes[block],
+                unit_patient,
+                dtype=np.float32,
+                casting="unsafe",
+            )
+            sims[start:stop] = dots * self._scales[block]
+
+        # |quantized - float32 cosine| <= row error * ||unit_patient||_1, plus float32
+        # accumulation slack; the recheck margin then covers float32 vs scalar cosine.
+        dim = self._codes.shape[1] if self._codes.ndim == 2 else 0
+        is_exclusion = self._is_exclusion[rows]
+        bounds = (
+            self._errors[rows] * float(np.abs(unit_patient).sum())
+            + dim * np.finfo(np.float32).eps
+            + _THRESHOLD_RECHECK_MARGIN
+        )
+        near = is_exclusion & (np.abs(sims - EXCLUSION_THRESHOLD) <= bounds)
+        for threshold in (WEAK_INCLUSION_THRESHOLD, STRONG_INCLUSION_THRESHOLD):
+            near |= ~is_exclusion & (np.abs(sims - threshold) <= bounds)
+        rescored = np.flatnonzero(near)
+        owners = self._owners[rows[rescored]]
+        # Fetch each owning trial's float32 rows once.
+        for position in np.unique(owners):
+            inclusion, exclusion = row_source(self._nct_ids[int(position)])
+            for index in rescored[owners == position]:
+                row = rows[index]
+                matrix = exclusion if self._is_exclusion[row] else inclusion
+                vector = np.asarray(matrix[self._offsets[row]], dtype=np.float32)
+                sims[index] = _cosine_similarity(patient, vector)
+        return sims, int(rescored.size)
+
+    def score_trials(
+        self,
+        patient_embedding: np.ndarray,
+        row_source: RowSource,
+        stats: Optional[Dict[str, int]] = None,
+        nct_ids: Optional[Iterable[str]] = None,
+    ) -> Dict[str, float]:
+        """
+        Return ``nct_id -> score`` for every indexed trial (or the indexed ones among
+        ``nct_ids``, reading only their rows), identical to
+        ``calculate_match_score_from_precomputed`` on the float32 embeddings.
+        ``row_source`` supplies the float32 rows of trials that need rescoring.
+
+        When ``stats`` is given it receives ``rows`` and ``rescored`` counts.
+        """
+        num_trials = len(self._nct_ids)
+        if nct_ids is None:
+            positions = np.arange(num_trials)
+            rows = np.arange(len(self))
+        else:
+            wanted = (self._positions.get(str(nct_id)) for nct_id in dict.fromkeys(nct_ids))
+            positions = np.array([p for p in wanted if p is not None], dtype=np.int64)
+            parts = [np.arange(self._row_starts[p], self._row_starts[p + 1]) for p in positions]
+            rows = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+        if len(positions) == 0:
+            return {}
+        patient = np.asarray(patient_embedding, dtype=np.float32)
+        if len(rows):
+            sims, rescored = self._similarities(patient, row_source, rows)
+        else:
+            sims, rescored = np.zeros(0, dtype=np.float32), 0
+        if stats is not None:
+            stats.update({"rows": len(rows), "rescored": rescored})
+
+        owners = self._owners[rows]
+        is_exclusion = self._is_exclusion[rows]
+
+        def per_trial(mask: np.ndarray) -> np.ndarray:
+            return np.bincount(owners[mask], minlength=num_trials)[positions]
+
+        excluded = per_trial(is_exclusion & (sims > EXCLUSION_THRESHOLD)) > 0
+        inclusion = ~is_exclusion
+        strong = per_trial(inclusion & (sims >= STRONG_INCLUSION_THRESHOLD))
+        weak = per_trial(
+            inclusion & (sims >= WEAK_INCLUSION_THRESHOLD) & (sims < STRONG_INCLUSION_THRESHOLD)
+        )
+        missed = per_trial(inclusion & (sims < WEAK_INCLUSION_THRESHOLD))
+
+        scores = 100.0 - 8.0 * weak - 15.0 * missed - np.where(strong == 0, 10.0, 0.0)
+        scores = np.clip(scores, 0.0, 100.0)
+        scores[self._num_inclusions[positions] == 0] = 50.0
+        scores[excluded] = 0.0
+        return {self._nct_ids[int(p)]: float(score) for p, score in zip(positions, scores)}
+
+
+_cache_lock = threading.Lock()
+_cached_key: Optional[Tuple[int, str, str]] = None
+_cached_index: Optional[QuantizedCriteriaIndex] = None
+_builds = SingleFlight()
+
+
+def get_quantized_index(catalog_version: int, dtype: str) -> QuantizedCriteriaIndex:
+    """
+    Return the quantized index over the whole prepared catalog, built once per
+    catalog version, cache version and dtype (concurrent callers share one build).
+    """
+    global _cached_key, _cached_index
+    key = (int(catalog_version), cache_version_key(), dtype)
+    with _cache_lock:
+        if _cached_index is not None and key == _cached_key:
+            return _cached_index
+    index = _builds.do(
+        key, lambda: QuantizedCriteriaIndex.from_prepared_trials(load_prepared_catalog(), dtype)
+    )
+    with _cache_lock:
+        _cached_key = key
+        _cached_index = index
+    return index
+
+
+def quantized_scores(
+    prepared_trials: Sequence[Dict[str, Any]],
+    patient_embedding: np.ndarray,
+    catalog_version: int,
+    dtype: str,
+    stats: Optional[Dict[str, int]] = None,
+) -> Dict[str, float]:
+    """
+    ``nct_id -> score`` for ``prepared_trials``: trials held by the catalog index
+    are scored on its rows, the others on an index built for them alone. Float32
+    rows are decoded only for trials with a row to rescore.
+    """
+    index = get_quantized_index(catalog_version, dtype)
+    held: List[str] = []
+    others: List[Dict[str, Any]] = []
+    for trial in prepared_trials:
+        if index.holds(trial):
+            held.append(str(trial["nct_id"]))
+        else:
+            others.append(trial)
+    row_source = prepared_trial_rows(prepared_trials)
+    parts: List[Tuple[QuantizedCriteriaIndex, Optional[List[str]]]] = [(index, held)]
+    if others:
+        parts.append((QuantizedCriteriaIndex.from_prepared_trials(others, dtype=dtype), None))
+    totals = {"rows": 0, "rescored": 0}
+    scores: Dict[str, float] = {}
+    for part, nct_ids in parts:
+        part_stats: Dict[str, int] = {}
+        scores.update(part.score_trials(patient_embedding, row_source, part_stats, nct_ids))
+        for name in totals:
+            totals[name] += part_stats.get(name, 0)
+    if stats is not None:
+        stats.update(totals)
+    return scores
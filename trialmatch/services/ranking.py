@@ -0,0 +1,94 @@
+"""
+Top-K trial ranking with upper-bound pruning.
+
+Scores start at 100 and only lose points per weak inclusion criterion, so the running
+score while criteria are evaluated is an upper bound on the final one. The ranker
+keeps the current best ``top_k`` in a min-heap and hands the heap's weakest score to
+``calculate_match_score_from_precomputed`` as ``prune_at``: any trial whose bound
+falls to that score stops being evaluated. Ties keep catalog order, exactly like the
+stable sort used for exhaustive ranking, so the output is identical to sorting every
+score and slicing.
+"""
+
+from __future__ import annotations
+
+import heapq
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from trialmatch.services.matching_engine import calculate_match_score_from_precomputed
+
+logger = logging.getLogger(__name__)
+
+
+def rank_trials(
+    patient_embedding: np.ndarray,
+    trials: Sequence[Dict[str, Any]],
+    top_k: Optional[int] = None,
+    exact_scores: Optional[Dict[str, float]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Score ``trials`` against the patient and return the positive scores in
+    descending order, as ``{"nct_id", "title", "score"}`` rows.
+
+    Each trial dict carries ``nct_id``, ``title``, ``inclusion_embeddings`` and
+    ``exclusion_embeddings``. With ``top_k`` set only the best ``top_k`` rows are
+    returned and trials that provably cannot reach them are not fully evaluated.
+
+    A trial may carry a ``cached_score`` (its exact score from an earlier run), which
+    is used instead of evaluating it. When ``exact_scores`` is given it is filled with
+    ``nct_id -> score`` for every score computed exactly here, so callers can cache them.
+    """
+    limit = None if top_k is None else max(0, int(top_k))
+    # Min-heap of (score, -position, row): the root is the weakest kept result, and
+    # among equal scores the later trial, which a stable sort would also drop first.
+    heap: List[Tuple[float, int, Dict[str, Any]]] = []
+    skipped = 0
+
+    for position, trial in enumerate(trials):
+        if limit == 0:
+            break
+        threshold = heap[0][0] if limit is not None and len(heap) >= limit else 0.0
+        cached_score = trial.get("cached_score")
+        if cached_score is not None:
+            score = float(cached_score)
+        else:
+            score = calculate_match_score_from_precomputed(
+                patient_embedding,
+                {
+                    "inclusion_embeddings": trial.get("inclusion_embeddings"),
+                    "exclusion_embeddings": trial.get("exclusion_embeddings"),
+                },
+                prune_at=threshold,
+            )
+            # Above the cut-off the score is exact; at a zero cut-off a pruned bound
+            # is already clamped to the exact score of 0.
+            if exact_scores is not None and (score > threshold or threshold <= 0):
+                exact_scores[str(trial["nct_id"])] = score
+        rounded = float(round(score, 2))
+        if rounded <= threshold:
+            if score > 0:
+                skipped += 1
+            continue
+
+        row = {
+            "nct_id": str(trial["nct_id"]),
+            "title": trial.get("title") or str(trial["nct_id"]),
+            "score": rounded,
+        }
+        entry = (rounded, -position, row)
+        if limit is not None and len(heap) >= limit:
+            heapq.heapreplace(heap, entry)
+        else:
+            heapq.heappush(heap, entry)
+
+    logger.info(
+        "matching:rank:done candidates=%s kept=%s skipped=%s top_k=%s",
+        len(trials),
+        len(heap),
+        skipped,
+        top_k,
+    )
+    return [row for _, _, row in sorted(heap, key=lambda item: (-item[0], -item[1]))]
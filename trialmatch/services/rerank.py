@@ -0,0 +1,326 @@
+"""
+Optional second ranking stage: the reasoning model judges the embedding shortlist.
+
+Semantic scores produce many near-ties, and an LLM call per patient–trial pair is
+unaffordable, so only the top ``k`` ranked trials are sent to the reasoning model
+with the patient summary. A ``RerankBudget`` bounds each request three ways:
+``k`` trials at most, an estimated ``max_tokens`` (prompt + verdict) spent in rank
+order, and ``time_budget_s`` after which unfinished judgements are left out (they
+still land in the cache when they complete). Verdicts are cached in a
+``PairCache`` keyed by patient summary hash, criteria hash and trial cache version
+(which pins the reasoning model), so repeat matches cost nothing.
+
+The blending policy decides how a verdict changes a shortlisted trial's score:
+
+- ``blend``: ``(1 - weight) * semantic + weight * llm``
+- ``replace``: the LLM score
+- ``tiebreak``: the semantic score, with LLM scores ordering equal scores
+
+All rows are then re-sorted by final score (a stable sort, so trials outside the
+shortlist keep their order): a shortlisted trial the verdict marks down can fall
+below trials that were never judged.
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from trialmatch.config import settings
+from trialmatch.services.db import rerank_cache_collection
+from trialmatch.services.llm_models import get_reasoning_client, inference_slot
+from trialmatch.services.score_cache import PairCache, pair_cache_key
+
+logger = logging.getLogger(__name__)
+
+# Bump when the prompt or verdict format changes so cached verdicts are not reused.
+RERANK_VERSION = "rerank-1"
+BLEND_POLICIES = ("blend", "replace", "tiebreak")
+VERDICT_MAX_TOKENS = 128
+VERDICTS = ("eligible", "ineligible", "uncertain")
+
+PROMPT_PREFIX = (
+    "You are screening a patient for a clinical trial. Compare the patient summary "
+    "with the trial's eligibility criteria. Respond with valid JSON only — no "
+    'markdown fences or explanation: {"verdict": "eligible" | "ineligible" | '
+    '"uncertain", "score": <0-100, how likely the patient is eligible>, '
+    '"reason": "<one short sentence>"}.\n\n'
+)
+
+
+@dataclass(frozen=True)
+class RerankBudget:
+    """Per-request limits and blending policy of the rerank stage."""
+
+    k: int
+    max_tokens: int
+    time_budget_s: float
+    policy: str = "blend"
+    weight: float = 0.5
+
+    @classmethod
+    def from_request(cls, value: Any) -> "RerankBudget":
+        """
+        Budget from a request's ``rerank`` value: ``true`` for the configured
+        defaults, or an object with any of ``k``, ``max_tokens``,
+        ``time_budget_ms``, ``policy`` and ``weight``. Raises ``ValueError``.
+        """
+        if value is True:
+            value = {}
+        if not isinstance(value, dict):
+            raise ValueError("rerank must be true or an object.")
+        k = value.get("k", settings.rerank_k)
+        max_tokens = value.get("max_tokens", settings.rerank_max_tokens)
+        time_budget_ms = value.get("time_budget_ms", settings.rerank_time_budget_ms)
+        policy = value.get("policy", settings.rerank_policy)
+        weight = value.get("weight", settings.rerank_blend_weight)
+        if not _is_int(k) or not 0 < k <= settings.rerank_max_k:
+            raise ValueError(f"rerank.k must be an integer between 1 and {settings.rerank_max_k}.")
+        if not _is_int(max_tokens) or max_tokens <= 0:
+            raise ValueError("rerank.max_tokens must be a positive integer.")
+        if not _is_number(time_budget_ms) or time_budget_ms <= 0:
+            raise ValueError("rerank.time_budget_ms must be a positive number.")
+        if policy not in BLEND_POLICIES:
+            raise ValueError(f"rerank.policy must be one of {', '.join(BLEND_POLICIES)}.")
+        if not _is_number(weight) or not 0 <= weight <= 1:
+            raise ValueError("rerank.weight must be between 0 and 1.")
+        return cls(
+            k=int(k),
+            max_tokens=int(max_tokens),
+            time_budget_s=float(time_budget_ms) / 1000.0,
+            policy=policy,
+            weight=float(weight),
+        )
+
+
+def _is_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _bullets(items: List[str], max_chars: int) -> str:
+    text = "\n".join(f"- {item}" for item in items) or "- (none)"
+    return text[:max_chars]
+
+
+def build_prompt(summary: str, trial: Dict[str, Any]) -> str:
+    parsed = trial.get("parsed_criteria") or {}
+    return (
+        PROMPT_PREFIX
+        + f"Patient:\n{summary[:2000]}\n\n"
+        + f"Trial: {trial.get('brief_title') or trial.get('nct_id')}\n"
+        + f"Inclusion criteria:\n{_bullets(parsed.get('inclusion') or [], 2500)}\n\n"
+        + f"Exclusion criteria:\n{_bullets(parsed.get('exclusion') or [], 2500)}"
+    )
+
+
+def estimate_tokens(prompt: str) -> int:
+    """Rough token cost of one judgement: ~4 characters per prompt token plus the verdict."""
+    return len(prompt) // 4 + VERDICT_MAX_TOKENS
+
+
+def parse_verdict(text: str) -> Optional[Dict[str, Any]]:
+    """``{"verdict", "score", "reason"}`` from a model reply, or ``None``."""
+    start = text.find("{")
+    end = text.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    try:
+        raw = json.loads(text[start : end + 1])
+        score = float(raw.get("score"))
+    except (json.JSONDecodeError, AttributeError, TypeError, ValueError):
+        return None
+    verdict = str(raw.get("verdict") or "").strip().lower()
+    return {
+        "verdict": verdict if verdict in VERDICTS else "uncertain",
+        "score": round(min(100.0, max(0.0, score)), 2),
+        "reason": str(raw.get("reason") or "").strip()[:300],
+    }
+
+
+def _completion_text(completion: Any) -> str:
+    choices = getattr(completion, "choices", None) or []
+    if not choices:
+        return ""
+    message = choices[0].message
+    if isinstance(message, dict):
+        return message.get("content", "") or ""
+    return getattr(message, "content", None) or ""
+
+
+def judge(prompts: List[str]) -> List[Optional[Dict[str, Any]]]:
+    """Verdicts for ``prompts``; backends with ``chat_completion_batch`` get one call."""
+    client = get_reasoning_client()
+    conversations = [[{"role": "user", "content": prompt}] for prompt in prompts]
+    batch = getattr(client, "chat_completion_batch", None)
+    if batch is not None and len(prompts) > 1:
+        with inference_slot("reasoning"):
+            completions = batch(conversations, max_tokens=VERDICT_MAX_TOKENS, temperature=0.0)
+    else:
+        completions = []
+        for messages in conversations:
+            with inference_slot("reasoning"):
+                completions.append(
+                    client.chat_completion(
+                        messages=messages, max_tokens=VERDICT_MAX_TOKENS, temperature=0.0
+                    )
+                )
+    return [parse_verdict(_completion_text(completion)) for completion in completions]
+
+
+def blended_score(semantic: float, verdict: Dict[str, Any], budget: RerankBudget) -> float:
+    if budget.policy == "replace":
+        return verdict["score"]
+    if budget.policy == "blend":
+        return round((1 - budget.weight) * semantic + budget.weight * verdict["score"], 2)
+    return semantic
+
+
+_verdict_cache: Optional[PairCache] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def get_verdict_cache() -> Optional[PairCache]:
+    """Lazy getter for the process-wide verdict cache; ``None`` when caching is off."""
+    global _verdict_cache
+    if not settings.score_cache_enabled:
+        return None
+    with _lock:
+        if _verdict_cache is None:
+            _verdict_cache = PairCache(
+                rerank_cache_collection,
+                max_memory_entries=settings.score_cache_memory_entries,
+                max_persisted_entries=settings.score_cache_max_entries,
+                trim_interval_s=settings.score_cache_trim_interval_s,
+            )
+    return _verdict_cache
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(1, settings.rerank_max_workers), thread_name_prefix="rerank"
+            )
+    return _executor
+
+
+def rerank_shortlist(
+    results: List[Dict[str, Any]],
+    trials_by_id: Dict[str, Dict[str, Any]],
+    summary: str,
+    patient_hash: str,
+    budget: RerankBudget,
+    stats: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    ``results`` (ranked rows) with the first ``budget.k`` rows judged and re-scored
+    per ``budget.policy``, re-sorted by final score; see the module docstring.
+    Judged rows gain ``semantic_score``, ``llm_score``, ``llm_verdict`` and
+    ``llm_reason``.
+    """
+    started = time.monotonic()
+    shortlist, rest = results[: budget.k], results[budget.k :]
+    keys = {}
+    for row in shortlist:
+        trial = trials_by_id.get(row["nct_id"]) or {}
+        keys[row["nct_id"]] = pair_cache_key(
+            patient_hash,
+            str(trial.get("criteria_hash") or ""),
+            trial.get("cache_version") or {},
+            scoring_version=RERANK_VERSION,
+        )
+    cache = get_verdict_cache()
+    cached = cache.get_many(keys.values()) if cache else {}
+    verdicts = {nct_id: cached[key] for nct_id, key in keys.items() if key in cached}
+
+    # Uncached rows are judged in rank order while the token estimate fits.
+    prompts: Dict[str, str] = {}
+    tokens = 0
+    for row in shortlist:
+        nct_id = row["nct_id"]
+        if nct_id in verdicts or nct_id not in trials_by_id:
+            continue
+        prompt = build_prompt(summary, trials_by_id[nct_id])
+        cost = estimate_tokens(prompt)
+        if tokens + cost > budget.max_tokens:
+            break
+        prompts[nct_id] = prompt
+        tokens += cost
+
+    def judge_and_cache(nct_ids: List[str]) -> Callable[[], Dict[str, Any]]:
+        def run() -> Dict[str, Any]:
+            found = {
+                nct_id: verdict
+                for nct_id, verdict in zip(nct_ids, judge([prompts[n] for n in nct_ids]))
+                if verdict is not None
+            }
+            if cache and found:
+                cache.put_many({keys[nct_id]: verdict for nct_id, verdict in found.items()})
+            return found
+
+        return run
+
+    judged = 0
+    remaining = budget.time_budget_s - (time.monotonic() - started)
+    if prompts and remaining > 0:
+        executor = _get_executor()
+        ids = list(prompts)
+        # Batched backends get bounded groups, so one slow prompt only costs the
+        # verdicts of its own group when the time budget runs out.
+        size = 1
+        if hasattr(get_reasoning_client(), "chat_completion_batch"):
+            size = max(1, settings.rerank_batch_size)
+        groups = [ids[start : start + size] for start in range(0, len(ids), size)]
+        futures: List[Future] = [executor.submit(judge_and_cache(group)) for group in groups]
+        remaining = budget.time_budget_s - (time.monotonic() - started)
+        done, _ = wait(futures, timeout=max(0.0, remaining))
+        for future in done:
+            error = future.exception()
+            if error is not None:
+                logger.warning("rerank:judge_failed error=%s", error)
+                continue
+            found = future.result()
+            judged += len(found)
+            verdicts.update(found)
+
+    reranked: List[Dict[str, Any]] = []
+    for row in shortlist:
+        verdict = verdicts.get(row["nct_id"])
+        if verdict is not None:
+            row = dict(
+                row,
+                score=blended_score(row["score"], verdict, budget),
+                semantic_score=row["score"],
+                llm_score=verdict["score"],
+                llm_verdict=verdict["verdict"],
+                llm_reason=verdict["reason"],
+            )
+        reranked.append(row)
+    merged = reranked + rest
+    if budget.policy == "tiebreak":
+        merged.sort(key=lambda row: (-row["score"], -row.get("llm_score", -1.0)))
+    else:
+        merged.sort(key=lambda row: -row["score"])
+
+    if stats is not None:
+        stats.update(
+            k=budget.k,
+            policy=budget.policy,
+            cached=len(cached),
+            judged=judged,
+            skipped=len(shortlist) - len(cached) - judged,
+            tokens_estimate=tokens,
+            elapsed_s=round(time.monotonic() - started, 3),
+        )
+    return merged
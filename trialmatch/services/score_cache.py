@@ -0,0 +1,173 @@
+"""
+Persistent patient–trial score cache.
+
+Scores are keyed by (patient summary hash, trial criteria hash, trial cache version,
+scoring version). The trial cache version already pins the reasoning and embedding
+models, so a model or scoring change simply produces new keys.
+
+Lookups go through a bounded in-process LRU first and then a single ``$in`` query
+against the ``score_cache`` collection. The collection is trimmed back to
+``SCORE_CACHE_MAX_ENTRIES`` documents, oldest first, after a write at most once
+per ``SCORE_CACHE_TRIM_INTERVAL_S`` (counting documents on every write would add
+a round trip to each one), so it can briefly overshoot the limit. Cache failures
+are logged and treated as misses so matching never fails because of the cache.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from datetime import datetime, timezone
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from trialmatch.config import settings
+from trialmatch.services.db import score_cache_collection
+from trialmatch.services.matching_engine import SCORING_VERSION
+
+logger = logging.getLogger(__name__)
+
+
+def pair_cache_key(
+    patient_hash: str,
+    criteria_hash: str,
+    cache_version: Dict[str, Any],
+    scoring_version: str = SCORING_VERSION,
+) -> str:
+    version = json.dumps(cache_version or {}, sort_keys=True)
+    raw = "|".join([patient_hash, criteria_hash, version, scoring_version])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class PairCache:
+    """
+    Two-tier bounded cache of values keyed by ``pair_cache_key``.
+    """
+
+    def __init__(
+        self,
+        collection_getter: Callable[[], Any],
+        max_memory_entries: int,
+        max_persisted_entries: int,
+        trim_interval_s: float = 0.0,
+    ) -> None:
+        self._collection_getter = collection_getter
+        self._max_memory_entries = max(0, int(max_memory_entries))
+        self._max_persisted_entries = max(0, int(max_persisted_entries))
+        self._trim_interval_s = max(0.0, float(trim_interval_s))
+        self._next_trim = 0.0
+        self._memory: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, key: str, value: Any) -> None:
+        if self._max_memory_entries == 0:
+            return
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        found: Dict[str, Any] = {}
+        missing = []
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                else:
+                    missing.append(key)
+        if not missing or self._max_persisted_entries == 0:
+            return found
+
+        try:
+            docs = list(
+                self._collection_getter().find({"_id": {"$in": missing}}, {"value": 1})
+            )
+        except PyMongoError as exc:
+            logger.warning("score_cache:read_failed keys=%s error=%s", len(missing), exc)
+            return found
+
+        with self._lock:
+            for doc in docs:
+                found[doc["_id"]] = doc["value"]
+                self._remember(doc["_id"], doc["value"])
+        return found
+
+    def put_many(self, values: Dict[str, Any]) -> None:
+        if not values:
+            return
+        with self._lock:
+            for key, value in values.items():
+                self._remember(key, value)
+        if self._max_persisted_entries == 0:
+            return
+
+        now = datetime.now(timezone.utc).isoformat()
+        try:
+            coll = self._collection_getter()
+            coll.bulk_write(
+                [
+                    UpdateOne(
+                        {"_id": key},
+                        {"$set": {"value": value, "cached_at": now}},
+                        upsert=True,
+                    )
+                    for key, value in values.items()
+                ],
+                ordered=False,
+            )
+            if self._trim_due():
+                self._trim(coll)
+        except PyMongoError as exc:
+            logger.warning("score_cache:write_failed keys=%s error=%s", len(values), exc)
+
+    def _trim_due(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_trim:
+                return False
+            self._next_trim = now + self._trim_interval_s
+        return True
+
+    def _trim(self, coll: Any) -> None:
+        excess = coll.estimated_document_count() - self._max_persisted_entries
+        if excess <= 0:
+            return
+        oldest = coll.find({}, {"_id": 1}).sort("cached_at", 1).limit(excess)
+        ids = [doc["_id"] for doc in oldest]
+        if ids:
+            coll.delete_many({"_id": {"$in": ids}})
+            logger.info("score_cache:evicted count=%s", len(ids))
+
+    def clear_memory(self) -> None:
+        with self._lock:
+            self._memory.clear()
+
+
+_score_cache: Optional[PairCache] = None
+_score_cache_lock = threading.Lock()
+
+
+def get_score_cache() -> Optional[PairCache]:
+    """
+    Lazy getter for the process-wide score cache; ``None`` when disabled.
+    """
+    global _score_cache
+    if not settings.score_cache_enabled:
+        return None
+    with _score_cache_lock:
+        if _score_cache is None:
+            _score_cache = PairCache(
+                score_cache_collection,
+                max_memory_entries=settings.score_cache_memory_entries,
+                max_persisted_entries=settings.score_cache_max_entries,
+                trim_interval_s=settings.score_cache_trim_interval_s,
+            )
+    return _score_cache
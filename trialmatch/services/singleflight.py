@@ -0,0 +1,119 @@
+"""
+In-flight request coalescing ("singleflight").
+
+While a computation for a key is running, other callers asking for the same key
+wait for it and receive the same result (or exception) instead of starting their
+own. Nothing is cached: once the computation finishes the key is forgotten, so
+the next caller computes afresh. Results are shared objects, so callers must not
+mutate them.
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import Future
+import threading
+from typing import Any, Callable, Dict, Hashable, List
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls per key; see ``do``, ``do_many`` and ``share``.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self._stats = {"started": 0, "coalesced": 0}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Run ``fn()`` unless a call for ``key`` is in flight; then wait for that one."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self._stats["started"] += 1
+            else:
+                self._stats["coalesced"] += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def do_many(
+        self,
+        keys: List[Hashable],
+        fn: Callable[[List[Hashable]], Dict[Hashable, Any]],
+    ) -> Dict[Hashable, Any]:
+        """
+        ``do`` for several keys: ``fn(keys)`` runs once for the keys not in flight and
+        returns a result per key; keys already in flight are waited for instead.
+        """
+        led: Dict[Hashable, Future] = {}
+        joined: Dict[Hashable, Future] = {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                future = self._calls.get(key)
+                if future is None:
+                    led[key] = self._calls[key] = Future()
+                    self._stats["started"] += 1
+                else:
+                    joined[key] = future
+                    self._stats["coalesced"] += 1
+
+        results: Dict[Hashable, Any] = {}
+        if led:
+            try:
+                computed = fn(list(led))
+                for key, future in led.items():
+                    results[key] = computed[key]
+                    future.set_result(results[key])
+            except BaseException as exc:
+                for future in led.values():
+                    if not future.done():
+                        future.set_exception(exc)
+                raise
+            finally:
+                with self._lock:
+                    for key, future in led.items():
+                        if self._calls.get(key) is future:
+                            del self._calls[key]
+        for key, future in joined.items():
+            results[key] = future.result()
+        return results
+
+    def share(self, key: Hashable, start: Callable[[], Future]) -> Future:
+        """
+        Future-returning variant: ``start()`` is called only when no future for
+        ``key`` is pending, and every caller gets that same future.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self._stats["coalesced"] += 1
+                return future
+            future = self._calls[key] = start()
+            self._stats["started"] += 1
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future
+
+    def _forget(self, key: Hashable, future: Future) -> None:
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            out = dict(self._stats)
+            out["in_flight"] = len(self._calls)
+        return out
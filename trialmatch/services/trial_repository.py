@@ -4,11 +4,12 @@ Trial loading from MongoDB (admin upload flow only).
 
 from __future__ import annotations
 
-from typing import Optional
+from typing import Any, Dict, Optional
 
 import pandas as pd
+from pymongo import ReturnDocument
 
-from trialmatch.services.db import trials_collection
+from trialmatch.services.db import meta_collection, trials_collection
 
 
 ACTIVE_STATUSES = {
@@ -18,6 +19,13 @@ ACTIVE_STATUSES = {
     "NOT_YET_RECRUITING",
 }
 
+# Monotonic counter bumped by every trial upload that adds or changes trials. Trials
+# carry the version they were last changed in; match documents the version they reflect.
+CATALOG_VERSION_KEY = "catalog_version"
+# Criterion vectors live in ``criteria_vectors``; documents written before that
+# may still embed them, so metadata reads leave them out explicitly.
+TRIAL_METADATA_PROJECTION = {"criteria_embeddings": 0}
+
 
 def _load_trials_from_mongo(limit: Optional[int] = None) -> Optional[pd.DataFrame]:
     """
@@ -36,7 +44,7 @@ def _load_trials_from_mongo(limit: Optional[int] = None) -> Optional[pd.DataFram
     if count == 0:
         return None
 
-    cursor = coll.find({})
+    cursor = coll.find({}, TRIAL_METADATA_PROJECTION)
     if limit is not None:
         cursor = cursor.limit(limit)
     docs = list(cursor)
@@ -45,23 +53,68 @@ def _load_trials_from_mongo(limit: Optional[int] = None) -> Optional[pd.DataFram
     return pd.DataFrame(docs)
 
 
+def current_catalog_version() -> int:
+    doc = meta_collection().find_one({"_id": CATALOG_VERSION_KEY})
+    return int((doc or {}).get("value") or 0)
+
+
+def bump_catalog_version() -> int:
+    doc = meta_collection().find_one_and_update(
+        {"_id": CATALOG_VERSION_KEY},
+        {"$inc": {"value": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return int(doc["value"])
+
+
+def load_trials_changed_since(version: int) -> Optional[pd.DataFrame]:
+    """Trials added or changed by uploads after catalog ``version``."""
+    docs = list(
+        trials_collection().find(
+            {"catalog_version": {"$gt": int(version)}},
+            TRIAL_METADATA_PROJECTION,
+        )
+    )
+    if not docs:
+        return None
+    return pd.DataFrame(docs)
+
+
 def load_target_trials_data() -> Optional[pd.DataFrame]:
     """All trials in Mongo (matching mode ``demo``)."""
     return _load_trials_from_mongo(limit=None)
 
 
-def load_random_trials_data(num_trials: int) -> Optional[pd.DataFrame]:
-    """Sample recruiting-style trials from Mongo for matching mode ``random``."""
-    trials_df = _load_trials_from_mongo(limit=None)
-    if trials_df is None or trials_df.empty:
+def _sample_trials_from_mongo(query: Dict[str, Any], size: int) -> Optional[pd.DataFrame]:
+    """Up to ``size`` random trials matching ``query``, sampled server-side."""
+    docs = list(
+        trials_collection().aggregate(
+            [
+                {"$match": query},
+                {"$sample": {"size": int(size)}},
+                {"$project": TRIAL_METADATA_PROJECTION},
+            ]
+        )
+    )
+    if not docs:
         return None
+    return pd.DataFrame(docs)
 
-    if "overall_status" in trials_df.columns:
-        active_df = trials_df[trials_df["overall_status"].isin(ACTIVE_STATUSES)]
-    else:
-        active_df = trials_df.iloc[0:0]
-    source_df = active_df if not active_df.empty else trials_df
-    sample_size = min(int(num_trials), len(source_df))
+
+def load_random_trials_data(num_trials: int) -> Optional[pd.DataFrame]:
+    """
+    Sample recruiting-style trials from Mongo for matching mode ``random``, falling
+    back to any trials when none has an active status. The status filter runs in
+    Mongo (``overall_status`` index), so only the sample is transferred.
+    """
+    sample_size = int(num_trials)
     if sample_size <= 0:
         return None
-    return source_df.sample(n=sample_size).reset_index(drop=True)
+    sampled = _sample_trials_from_mongo(
+        {"overall_status": {"$in": sorted(ACTIVE_STATUSES)}},
+        sample_size,
+    )
+    if sampled is None:
+        sampled = _sample_trials_from_mongo({}, sample_size)
+    return sampled
@@ -0,0 +1,344 @@
+"""
+Write-behind persistence for results the caller already holds in memory.
+
+Match runs, lazily computed patient embeddings and refreshed trial metadata are
+queued here and written by one background thread as ``bulk_write`` batches, so
+request latency no longer includes those round trips. Each queued write names its
+collection through a getter from ``trialmatch.services.db``. Batches are written in
+queue order, but operations inside one batch are sent unordered, so every queued
+operation must be safe to apply in any order relative to the others (the
+``latest_match`` pointer only moves forward; the other writes are idempotent).
+
+Only transient errors (network, failover, write conflicts) are retried, and only
+for the operations the server reports as failed; duplicate-key and validation
+errors are final. A write's ``then`` callback is skipped when any of its
+operations failed.
+
+The queue is bounded (``WRITE_BEHIND_MAX_QUEUE``). When it is full the caller
+blocks for up to ``WRITE_BEHIND_ENQUEUE_TIMEOUT_S`` and then gets
+``WriteBehindFull``, so a slow database causes back-pressure without writing ahead
+of older queued writes. The buffer is flushed at interpreter exit. Writes still
+queued when the process is killed are lost, which is acceptable for these
+documents: each is recomputed on the next request that misses it.
+
+Disabled by default (``WRITE_BEHIND_ENABLED``); ``persist`` then writes inline.
+"""
+
+from __future__ import annotations
+
+import atexit
+from collections import OrderedDict
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set
+
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, PyMongoError
+
+from trialmatch.config import settings
+
+logger = logging.getLogger(__name__)
+
+CollectionGetter = Callable[[], Any]
+
+DUPLICATE_KEY = 11000
+# Server error codes worth retrying: failover, shutdown, network, write conflicts.
+_TRANSIENT_CODES = {6, 7, 89, 91, 112, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436}
+
+
+class WriteBehindFull(PyMongoError):
+    """The write-behind queue stayed full for ``WRITE_BEHIND_ENQUEUE_TIMEOUT_S``."""
+
+
+def _is_transient(exc: PyMongoError) -> bool:
+    return isinstance(exc, ConnectionFailure) or exc.has_error_label("RetryableWriteError")
+
+
+class _Write:
+    __slots__ = ("getter", "ops", "then", "enqueued_at")
+
+    def __init__(
+        self,
+        getter: CollectionGetter,
+        ops: Sequence[Any],
+        then: Optional[Callable[[], Any]],
+    ) -> None:
+        self.getter = getter
+        self.ops = list(ops)
+        self.then = then
+        self.enqueued_at = time.monotonic()
+
+
+def _bulk_write(getter: CollectionGetter, ops: List[Any]) -> None:
+    getter().bulk_write(ops, ordered=False)
+
+
+class WriteBehindBuffer:
+    """
+    Bounded queue of pymongo write operations drained by a daemon thread.
+
+    ``then`` callbacks run on the writer thread after their operations are
+    written (used for follow-up work that must read the new documents).
+    """
+
+    def __init__(
+        self,
+        max_queue: int,
+        batch_size: int,
+        flush_interval_s: float,
+        max_retries: int = 2,
+        enqueue_timeout_s: float = 5.0,
+    ) -> None:
+        self._queue: "queue.Queue[_Write]" = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._batch_size = max(1, int(batch_size))
+        self._flush_interval_s = max(0.0, float(flush_interval_s))
+        self._max_retries = max(0, int(max_retries))
+        self._enqueue_timeout_s = max(0.0, float(enqueue_timeout_s))
+        self._stats_lock = threading.Lock()
+        self._stats: Dict[str, Any] = {
+            "enqueued": 0,
+            "written": 0,
+            "failed": 0,
+            "batches": 0,
+            "retried": 0,
+            "queue_full_waits": 0,
+            "rejected": 0,
+            "sync_fallbacks": 0,
+            "callbacks_skipped": 0,
+            "callback_errors": 0,
+            "max_lag_s": 0.0,
+            "last_error": "",
+        }
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def _count(self, **deltas: Any) -> None:
+        with self._stats_lock:
+            for key, value in deltas.items():
+                self._stats[key] += value
+
+    def enqueue(
+        self,
+        getter: CollectionGetter,
+        ops: Sequence[Any],
+        then: Optional[Callable[[], Any]] = None,
+    ) -> bool:
+        """
+        Queue ``ops`` for ``getter()``. A full queue blocks the caller for up to
+        the enqueue timeout, then raises ``WriteBehindFull``. Returns False when
+        the writer thread has already stopped and the ops were written inline.
+        """
+        if not ops and then is None:
+            return True
+        write = _Write(getter, ops, then)
+        if self._thread.is_alive():
+            try:
+                self._queue.put_nowait(write)
+            except queue.Full:
+                self._count(queue_full_waits=1)
+                try:
+                    self._queue.put(write, timeout=self._enqueue_timeout_s)
+                except queue.Full:
+                    self._count(rejected=len(write.ops))
+                    logger.error("write_behind:queue_full ops=%s", len(write.ops))
+                    raise WriteBehindFull(
+                        f"write-behind queue full for {self._enqueue_timeout_s}s"
+                    ) from None
+            self._count(enqueued=len(write.ops))
+            return True
+        # Closed (interpreter exit): nothing is queued ahead any more.
+        self._count(sync_fallbacks=1)
+        logger.warning("write_behind:sync_fallback ops=%s", len(write.ops))
+        self._apply([write])
+        return False
+
+    def _next_batch(self, timeout: Optional[float]) -> List[_Write]:
+        try:
+            first = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return []
+        batch = [first]
+        size = len(first.ops)
+        deadline = time.monotonic() + self._flush_interval_s
+        while size < self._batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                write = (
+                    self._queue.get(timeout=remaining)
+                    if remaining > 0
+                    else self._queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+            batch.append(write)
+            size += len(write.ops)
+        return batch
+
+    def _write_group(self, getter: CollectionGetter, ops: List[Any]) -> Set[int]:
+        """Write ``ops`` unordered; returns the indexes of ops that finally failed."""
+        pending = list(range(len(ops)))
+        failed: Set[int] = set()
+        # After a network error some pending ops may already be applied.
+        maybe_applied = False
+        last_error: Optional[PyMongoError] = None
+        for attempt in range(self._max_retries + 1):
+            if attempt:
+                self._count(retried=len(pending))
+                time.sleep(0.1 * (2 ** (attempt - 1)))
+            try:
+                _bulk_write(getter, [ops[i] for i in pending])
+                self._count(written=len(pending), batches=1)
+                pending = []
+                break
+            except BulkWriteError as exc:
+                last_error = exc
+                errors = exc.details.get("writeErrors") or []
+                retry = []
+                for error in errors:
+                    index = pending[error["index"]]
+                    code = error.get("code")
+                    if (
+                        code == DUPLICATE_KEY
+                        and maybe_applied
+                        and isinstance(ops[index], InsertOne)
+                    ):
+                        continue  # inserted by the attempt that lost its connection
+                    if code in _TRANSIENT_CODES:
+                        retry.append(index)
+                    else:
+                        failed.add(index)
+                self._count(
+                    written=len(pending) - len(retry) - len(failed.intersection(pending)),
+                    batches=1,
+                )
+                pending = retry
+            except PyMongoError as exc:
+                last_error = exc
+                if not _is_transient(exc):
+                    break
+                maybe_applied = True
+            if not pending:
+                break
+        failed.update(pending)
+        if failed:
+            self._count(failed=len(failed))
+            with self._stats_lock:
+                self._stats["last_error"] = str(last_error)
+            logger.error("write_behind:write_failed ops=%s error=%s", len(failed), last_error)
+        return failed
+
+    def _apply(self, batch: List[_Write]) -> None:
+        grouped: "OrderedDict[CollectionGetter, List[Any]]" = OrderedDict()
+        # (write, first op index, op count) within its collection's group.
+        spans = []
+        for write in batch:
+            ops = grouped.setdefault(write.getter, [])
+            spans.append((write, len(ops), len(write.ops)))
+            ops.extend(write.ops)
+
+        failed: Dict[CollectionGetter, Set[int]] = {}
+        for getter, ops in grouped.items():
+            if ops:
+                failed[getter] = self._write_group(getter, ops)
+
+        now = time.monotonic()
+        with self._stats_lock:
+            lag = max(now - write.enqueued_at for write in batch)
+            self._stats["max_lag_s"] = max(self._stats["max_lag_s"], lag)
+        for write, start, count in spans:
+            if write.then is None:
+                continue
+            if failed.get(write.getter, set()).intersection(range(start, start + count)):
+                self._count(callbacks_skipped=1)
+                continue
+            try:
+                write.then()
+            except Exception as exc:  # noqa: BLE001 - a follow-up must not stop the writer
+                self._count(callback_errors=1)
+                logger.warning("write_behind:callback_failed error=%s", exc)
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch(timeout=0.5)
+            if batch:
+                self._apply(batch)
+                for _ in batch:
+                    self._queue.task_done()
+            elif self._stopping.is_set():
+                return
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until everything queued so far is written; False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout: float = 10.0) -> bool:
+        """Stop accepting writes, drain the queue and stop the writer thread."""
+        self._stopping.set()
+        drained = self.flush(timeout)
+        self._thread.join(timeout=1.0)
+        stats = self.stats()
+        logger.info(
+            "write_behind:closed drained=%s written=%s failed=%s pending=%s",
+            drained,
+            stats["written"],
+            stats["failed"],
+            stats["pending"],
+        )
+        return drained
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters since start, plus the current queue depth."""
+        with self._stats_lock:
+            out = dict(self._stats)
+        out["pending"] = self._queue.qsize()
+        return out
+
+
+_buffer: Optional[WriteBehindBuffer] = None
+_buffer_lock = threading.Lock()
+
+
+def get_write_behind() -> Optional[WriteBehindBuffer]:
+    """
+    Lazy getter for the process-wide buffer; ``None`` when write-behind is disabled.
+    """
+    global _buffer
+    if not settings.write_behind_enabled:
+        return None
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = WriteBehindBuffer(
+                max_queue=settings.write_behind_max_queue,
+                batch_size=settings.write_behind_batch_size,
+                flush_interval_s=settings.write_behind_flush_interval_ms / 1000.0,
+                enqueue_timeout_s=settings.write_behind_enqueue_timeout_s,
+            )
+            atexit.register(_buffer.close)
+    return _buffer
+
+
+def persist(
+    getter: CollectionGetter,
+    ops: Sequence[Any],
+    then: Optional[Callable[[], Any]] = None,
+) -> None:
+    """
+    Write ``ops`` to ``getter()`` through the buffer, or inline (then run ``then``)
+    when write-behind is disabled.
+    """
+    buffer = get_write_behind()
+    if buffer is not None:
+        buffer.enqueue(getter, ops, then)
+        return
+    if ops:
+        _bulk_write(getter, list(ops))
+    if then is not None:
+        then()